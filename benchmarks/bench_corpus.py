@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+Extraction performance over the recorded page corpus
+
+Replays the pages in benchmarks/corpus (see corpus/index.json) for
+the platforms of shoplift/config.ini from a local stand-in server,
+under their canonical URLs. Reports URLs/sec, the p50/p99 latency of
+each stage of an extraction (route, fetch, parse, scrape, filter)
+and the peak RSS, and writes them as JSON to compare runs with
+benchmarks.compare. Platforms scraped through an API rather than
+from pages (amazon_api) have no recorded pages.
+
+Usage: python -m benchmarks.bench_corpus [rounds] [latency] [results.json]
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import multiprocessing
+import urlparse
+import subprocess
+from resource import getrusage, RUSAGE_SELF
+
+import shoplift
+from shoplift import web, instrument
+from shoplift.config import Extractor, CONFIG_KEY_URL, CONFIG_KEY_DOMAINS
+
+from .server import serve, replay
+
+CORPUS = os.path.join(os.path.dirname(__file__), 'corpus')
+CONFIG = os.path.join(os.path.dirname(shoplift.__file__), 'config.ini')
+
+STAGES = instrument.STAGES + ('total',)
+
+# Workers used to measure the throughput of extract_many
+WORKERS = 8
+
+
+
+def load_corpus(path=CORPUS):
+    """Returns the recorded pages, as a list of (url, body) tuples"""
+    
+    with open(os.path.join(path, 'index.json')) as index:
+        return [
+            (entry['url'], open(os.path.join(path, entry['page'])).read())
+            for entry in json.load(index)
+        ]
+
+
+def percentile(values, p):
+    """Returns the p-th percentile of values, by the nearest-rank method"""
+    
+    values = sorted(values)
+    return values[max(0, int(round(p / 100.0 * len(values))) - 1)]
+
+
+def revision():
+    """Returns the git commit of the working tree, if any"""
+    
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=open(os.devnull, 'w')
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+
+class StageTimer(instrument.Observer):
+    """Times each stage of real Extractor.extract calls
+    
+    Observes the spans an Extractor reports, see shoplift.instrument,
+    and sums them by stage for each extraction; the total is the
+    wall time of the whole extract call.
+    """
+    
+    def __init__(self):
+        self.timings = dict((stage, []) for stage in STAGES)
+        self.elapsed = None
+        self.platform = None
+    
+    def span(self, stage, seconds, platform=None, attribute=None):
+        self.elapsed[stage] += seconds
+        self.platform = platform or self.platform
+    
+    def extract(self, extractor, url):
+        """Extracts url with an Extractor observed by the timer"""
+        self.elapsed = dict.fromkeys(STAGES, 0.0)
+        self.platform = None
+        
+        started = time.time()
+        product = extractor.extract(url)
+        self.elapsed['total'] = time.time() - started
+        
+        for stage in STAGES:
+            self.timings[stage].append(self.elapsed[stage])
+        return self.platform, product
+    
+    def stats(self):
+        """Returns the p50, p99 & mean of each stage, in milliseconds"""
+        return dict(
+            (stage, {
+                'p50_ms': percentile(values, 50) * 1000,
+                'p99_ms': percentile(values, 99) * 1000,
+                'mean_ms': sum(values) / len(values) * 1000,
+            })
+            for stage, values in self.timings.iteritems()
+        )
+
+
+
+def run(rounds=20, latency=0.0, output=None):
+    corpus = load_corpus()
+    extractor = Extractor(CONFIG)
+    # Stages are timed on an Extractor of their own, so that observing
+    # them doesn't weigh on the throughput of the other one
+    timer = StageTimer()
+    timed = Extractor(CONFIG, observer=timer)
+    
+    # Pages are fetched from their canonical URL
+    server = serve(latency=latency, pages=dict(
+        (urlparse.urlunsplit(('', '') + urlparse.urlsplit(extractor.canonical_url(url))[2:]), body)
+        for url, body in corpus
+    ))
+    replay(web.session, server, [url for url, body in corpus])
+    
+    for name, config in extractor.platforms.iteritems():
+        # Replayed pages aren't subject to the platforms' politeness limits
+        for domain in config[CONFIG_KEY_URL][CONFIG_KEY_DOMAINS]:
+            web.scheduler.set_limit(domain, concurrency=WORKERS)
+    
+    platforms = {}
+    started = time.time()
+    for i in xrange(rounds):
+        for url, body in corpus:
+            name, product = timer.extract(timed, url)
+            platforms.setdefault(name, []).append(timer.timings['total'][-1])
+    elapsed = time.time() - started
+    
+    urls = [url for url, body in corpus] * rounds
+    concurrent_started = time.time()
+    errors = sum(
+        isinstance(product, Exception)
+        for url, product in extractor.extract_many(urls, workers=WORKERS)
+    )
+    concurrent_elapsed = time.time() - concurrent_started
+    
+    parallel_started = time.time()
+    errors += sum(
+        isinstance(product, Exception)
+        for url, product in extractor.extract_parallel(urls)
+    )
+    parallel_elapsed = time.time() - parallel_started
+    
+    results = {
+        'revision': revision(),
+        'python': platform.python_version(),
+        'pages': len(corpus),
+        'rounds': rounds,
+        'latency_ms': latency * 1000,
+        'urls_per_sec': {
+            'extract': len(urls) / elapsed,
+            'extract_many': len(urls) / concurrent_elapsed,
+            'extract_parallel': len(urls) / parallel_elapsed,
+        },
+        'errors': errors,
+        'stages': timer.stats(),
+        'platforms': dict(
+            (name, {
+                'p50_ms': percentile(values, 50) * 1000,
+                'p99_ms': percentile(values, 99) * 1000,
+            })
+            for name, values in platforms.iteritems()
+        ),
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_kb': getrusage(RUSAGE_SELF).ru_maxrss,
+    }
+    
+    # Drop the pooled keep-alive connections before stopping the server
+    web.session.close()
+    server.shutdown()
+    
+    print '%d pages x %d rounds, %.0fms server latency' % (len(corpus), rounds, latency * 1000)
+    print '%-16s %8.1f URLs/sec' % ('extract', results['urls_per_sec']['extract'])
+    print '%-16s %8.1f URLs/sec  (workers=%d)' % ('extract_many', results['urls_per_sec']['extract_many'], WORKERS)
+    print '%-16s %8.1f URLs/sec  (processes=%d)' % ('extract_parallel', results['urls_per_sec']['extract_parallel'], multiprocessing.cpu_count())
+    print '%d errors' % errors
+    print
+    print '%-14s %9s %9s %9s' % ('stage', 'p50 ms', 'p99 ms', 'mean ms')
+    for stage in STAGES:
+        stats = results['stages'][stage]
+        print '%-14s %9.3f %9.3f %9.3f' % (stage, stats['p50_ms'], stats['p99_ms'], stats['mean_ms'])
+    print
+    print '%-14s %9s %9s' % ('platform', 'p50 ms', 'p99 ms')
+    for name in sorted(results['platforms']):
+        stats = results['platforms'][name]
+        print '%-14s %9.3f %9.3f' % (name, stats['p50_ms'], stats['p99_ms'])
+    print
+    print 'peak RSS       %8.1f MB' % (results['peak_rss_kb'] / 1024.0)
+    
+    if output:
+        with open(output, 'w') as results_file:
+            json.dump(results, results_file, indent=4, sort_keys=True)
+    return results
+
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    run(
+        rounds = args and int(args[0]) or 20,
+        latency = len(args) > 1 and float(args[1]) or 0.0,
+        output = len(args) > 2 and args[2] or None,
+    )
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+Throughput of Extractor.extract_many against a local stand-in server
+
+Usage: python -m benchmarks.bench_extract_many [urls] [latency] [workers...]
+"""
+
+import sys
+import time
+from StringIO import StringIO
+
+from shoplift.config import Extractor
+from shoplift.web import session
+
+from .server import serve
+
+# The stand-in's url.concurrency lifts the scheduler's per-host cap
+# (DEFAULT_PER_HOST), which would otherwise hold every run to 4
+# fetches at once, so that the runs measure the extractor itself
+CONFIG = """
+[standin]
+url.path       = /p/.*
+url.domains    = %(host)s
+url.concurrency= 32
+name           = xpath.//h1//text()
+price          = xpath.//span[@class="price"]//text()
+price.filter   = regex.(\d+(\,\d+)*(\.\d+)?)
+image          = opengraph.image
+"""
+
+
+
+def run(count=200, latency=0.05, workers=(1, 4, 16, 32)):
+    server = serve(latency=latency)
+    extractor = Extractor(StringIO(CONFIG % {'host': server.server_address[0]}))
+    urls = ['%s/p/%d' % (server.url, i) for i in xrange(count)]
+    
+    print '%d URLs, %.0fms server latency' % (count, latency * 1000)
+    
+    started = time.time()
+    for url in urls:
+        extractor.extract(url)
+    elapsed = time.time() - started
+    print '%-12s %8.1f URLs/sec' % ('extract', count / elapsed)
+    
+    for n in workers:
+        started = time.time()
+        errors = sum(
+            isinstance(product, Exception)
+            for url, product in extractor.extract_many(urls, workers=n)
+        )
+        elapsed = time.time() - started
+        print '%-12s %8.1f URLs/sec  (%d errors)' % ('workers=%d' % n, count / elapsed, errors)
+    
+    # Drop the pooled keep-alive connections before stopping the server
+    session.close()
+    server.shutdown()
+
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    run(
+        count = args and int(args[0]) or 200,
+        latency = len(args) > 1 and float(args[1]) or 0.05,
+        workers = len(args) > 2 and map(int, args[2:]) or (1, 4, 16, 32),
+    )
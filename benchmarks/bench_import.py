@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+Startup cost of short-lived extraction workers
+
+Times, in fresh interpreters, importing shoplift.config and loading
+a config into an Extractor:
+    import      the import alone
+    xpath       a single platform scraped with xpath
+    config.ini  the platforms shipped with shoplift
+and reports which of the optional heavy modules each case imported.
+Times are the median of the runs, the wall time of the whole process
+included.
+
+Usage: python -m benchmarks.bench_import [runs] [results.json]
+"""
+
+import os
+import sys
+import json
+import time
+import subprocess
+
+from .bench_corpus import CONFIG, revision
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+XPATH_CONFIG = '''
+[example]
+url.domains    = example.com
+url.path       = /p/.*
+name           = xpath.//h1//text()
+'''
+
+CASES = (
+    ('import', None),
+    ('xpath', 'StringIO(%r)' % XPATH_CONFIG),
+    ('config.ini', repr(CONFIG)),
+)
+
+# Modules only some platforms need
+HEAVY_MODULES = (
+    'regex',
+    'shoplift.scrapers.microdata_scraper',
+    'shoplift.scrapers.opengraph_scraper',
+    'shoplift.scrapers.xpath_scraper',
+    'shoplift.scrapers.amazon_api_scraper',
+    'multiprocessing',
+)
+
+SCRIPT = '''
+import sys, time, json
+started = time.time()
+from StringIO import StringIO
+from shoplift.config import Extractor
+imported = time.time()
+config = %s
+if config is not None:
+    Extractor(config)
+print json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'load_ms': (time.time() - imported) * 1000,
+    'modules': [name for name in %r if name in sys.modules],
+})
+'''
+
+
+
+def run_case(config):
+    """Returns the stats of a fresh interpreter loading config, or None if it fails"""
+    
+    started = time.time()
+    process = subprocess.Popen(
+        [sys.executable, '-c', SCRIPT % (config, HEAVY_MODULES)],
+        cwd=ROOT, stdout=subprocess.PIPE, stderr=open(os.devnull, 'w'),
+    )
+    output = process.communicate()[0]
+    if process.returncode:
+        return None
+    stats = json.loads(output)
+    stats['process_ms'] = (time.time() - started) * 1000
+    return stats
+
+
+def median(values):
+    return sorted(values)[len(values) // 2]
+
+
+def run(runs=10, output=None):
+    results = {'revision': revision(), 'runs': runs, 'startup': {}}
+    
+    print '%-12s %10s %10s %12s  %s' % ('case', 'import ms', 'load ms', 'process ms', 'heavy modules imported')
+    for case, config in CASES:
+        stats = [run_case(config) for i in xrange(runs)]
+        if None in stats:
+            print '%-12s %s' % (case, 'failed (run it on its own for the error)')
+            continue
+        
+        result = results['startup'][case] = dict(
+            (key, median([run[key] for run in stats])) for key in ('import_ms', 'load_ms', 'process_ms')
+        )
+        result['modules'] = stats[0]['modules']
+        print '%-12s %10.1f %10.1f %12.1f  %s' % (
+            case, result['import_ms'], result['load_ms'], result['process_ms'], ', '.join(result['modules']) or '-'
+        )
+    
+    if output:
+        with open(output, 'w') as results_file:
+            json.dump(results, results_file, indent=4, sort_keys=True)
+    return results
+
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    run(
+        runs = args and int(args[0]) or 10,
+        output = len(args) > 1 and args[1] or None,
+    )
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+Memory held by the results of a batch extraction
+
+Extracts the pages of the corpus (see bench_corpus) over and over,
+as distinct URLs, and reports the peak RSS growth per 10k URLs when
+a batch job keeps:
+    products    only the extracted products
+    resources   the Resources the products were extracted from
+    released    the Resources, released once extracted
+Each case runs in a process of its own, so that their peaks don't
+mix. Pages are built in memory rather than fetched, so that only the
+memory of the results is measured. Linux only (/proc/self/statm).
+
+Usage: python -m benchmarks.bench_memory [urls] [results.json]
+"""
+
+import os
+import sys
+import json
+import multiprocessing
+from resource import getrusage, RUSAGE_SELF
+
+from shoplift import web
+from shoplift.config import Extractor
+from shoplift.web import Resource
+
+from .bench_corpus import CONFIG, load_corpus, revision
+
+CASES = ('products', 'resources', 'released')
+
+
+
+def rss_kb():
+    """Returns the current RSS of the process, in kilobytes"""
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024
+
+
+def extract(case, count, results):
+    """Extracts count pages, keeping what the case keeps, and reports the RSS growth"""
+    
+    corpus = load_corpus()
+    extractor = Extractor(CONFIG)
+    baseline = rss_kb()
+    
+    kept = []
+    for i in xrange(count):
+        url, body = corpus[i % len(corpus)]
+        url += ('?' in url and '&' or '?') + 'copy=%d' % i
+        resource = Resource(url)
+        resource.response = web.build_response(url, body, 'utf-8')
+        product = extractor.extract(resource)
+        
+        if case == 'released':
+            resource.release()
+        kept.append(case == 'products' and product or (resource, product))
+    
+    # ru_maxrss is in kilobytes on Linux, and starts afresh in a forked process
+    results.put((case, {
+        'peak_kb': getrusage(RUSAGE_SELF).ru_maxrss - baseline,
+        'retained_kb': rss_kb() - baseline,
+    }))
+
+
+def run(count=10000, output=None):
+    results = multiprocessing.Queue()
+    for case in CASES:
+        process = multiprocessing.Process(target=extract, args=(case, count, results))
+        process.start()
+        process.join()
+    
+    scale = 10000.0 / count
+    cases = dict(results.get() for case in CASES)
+    results = {
+        'revision': revision(),
+        'urls': count,
+        'rss_kb_per_10k': dict(
+            (case, dict((key, kb * scale) for key, kb in stats.iteritems()))
+            for case, stats in cases.iteritems()
+        ),
+    }
+    
+    print '%d URLs, RSS growth per 10k URLs' % count
+    print '%-12s %10s %12s' % ('keeping', 'peak MB', 'retained MB')
+    for case in CASES:
+        stats = results['rss_kb_per_10k'][case]
+        print '%-12s %10.1f %12.1f' % (case, stats['peak_kb'] / 1024.0, stats['retained_kb'] / 1024.0)
+    
+    if output:
+        with open(output, 'w') as results_file:
+            json.dump(results, results_file, indent=4, sort_keys=True)
+    return results
+
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    run(
+        count = args and int(args[0]) or 10000,
+        output = len(args) > 1 and args[1] or None,
+    )
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+Native microdata items against the microdata library
+
+For the flipkart & apple pages of the corpus, times resolving the
+microdata paths of their config.ini attributes with the previous
+implementation (html5lib parse with the microdata library, then an
+Item.json() & json.loads round-trip per attribute) and with
+shoplift.microdata (items read off the lxml tree, paths walked
+directly). Both must resolve every path to the same value.
+
+Requires the microdata library for the previous implementation.
+
+Usage: python -m benchmarks.bench_microdata [rounds]
+"""
+
+import sys
+import json
+import time
+import urlparse
+from StringIO import StringIO
+
+import lxml.html
+import microdata as microdata_library
+
+from shoplift.config import Extractor, CONFIG_KEY_METHOD
+from shoplift.microdata import get_items
+from shoplift.scrapers.microdata_scraper import parse_itemprop
+
+from .bench_corpus import CONFIG, load_corpus
+
+PLATFORMS = ('flipkart', 'apple')
+
+
+
+def library_extract(contents, paths):
+    """The previous implementation: one parse, one JSON round-trip per path"""
+    
+    items = microdata_library.get_items(StringIO(contents))
+    return [reduce(lambda value, key: value[key], path, json.loads(items[0].json())) for path in paths]
+
+
+def native_extract(contents, paths):
+    items = get_items(lxml.html.fromstring(contents))
+    return [reduce(lambda value, key: value[key], path, items[0]) for path in paths]
+
+
+def timeit(function, contents, paths, rounds):
+    started = time.time()
+    for i in xrange(rounds):
+        function(contents, paths)
+    return (time.time() - started) / rounds
+
+
+def run(rounds=20):
+    extractor = Extractor(CONFIG)
+    
+    print '%-36s %5s %12s %12s %8s' % ('page', 'paths', 'library ms', 'native ms', 'speedup')
+    for url, body in load_corpus():
+        name, config = extractor.get_platform(url)
+        if name not in PLATFORMS:
+            continue
+        
+        paths = [
+            parse_itemprop(methods[CONFIG_KEY_METHOD].split('.', 1)[1])
+            for attribute, methods in sorted(config.iteritems())
+            if methods.get(CONFIG_KEY_METHOD, '').startswith('microdata.')
+        ]
+        # html5lib decodes the page itself, lxml parses response.text
+        contents = body.decode('utf-8')
+        assert library_extract(body, paths) == native_extract(contents, paths), url
+        
+        library = timeit(library_extract, body, paths, rounds)
+        native = timeit(native_extract, contents, paths, rounds)
+        print '%-36s %5d %12.2f %12.2f %7.1fx' % (
+            urlparse.urlsplit(url).path[-36:], len(paths), library * 1000, native * 1000, library / native
+        )
+
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    run(rounds = args and int(args[0]) or 20)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+Platform lookup cost with many configured platforms
+
+Compares Extractor.get_platform against the linear scan over every
+platform it replaced, for 1,000 synthetic platforms.
+
+Usage: python -m benchmarks.bench_router [platforms] [lookups]
+"""
+
+import re
+import sys
+import time
+import urlparse
+from StringIO import StringIO
+
+from shoplift.config import Extractor, CONFIG_KEY_URL, CONFIG_KEY_DOMAINS, CONFIG_KEY_PATHS
+from shoplift.web import sanitize_url
+
+SECTION = """
+[shop%(i)d]
+url.path       = /.*/p%(i)d/.*
+url.domains    = shop%(i)d.com, www.shop%(i)d.co.in
+name           = xpath.//h1//text()
+"""
+
+
+
+def linear_scan(platforms, url):
+    """The get_platform implementation prior to the router"""
+    url = urlparse.urlsplit(sanitize_url(url))
+    for name, config in platforms.iteritems():
+        if len(filter(
+            url.netloc.endswith,
+            config[CONFIG_KEY_URL][CONFIG_KEY_DOMAINS]
+        )) and re.search(
+            r'%s' % config[CONFIG_KEY_URL][CONFIG_KEY_PATHS],
+            urlparse.urlunsplit(('','') + url[2:])
+        ):
+            return (name, config)
+    return None
+
+
+def timeit(function, urls):
+    started = time.time()
+    for url in urls:
+        function(url)
+    return (time.time() - started) / len(urls)
+
+
+def run(count=1000, lookups=5000):
+    extractor = Extractor(StringIO(''.join(SECTION % {'i': i} for i in xrange(count))))
+    urls = [
+        # Hits spread over all the platforms, plus unsupported hosts
+        i % 5 and 'http://www.shop%d.com/item/p%d/%d' % (i % count, i % count, i)
+        or 'http://unknown%d.example.org/item/%d' % (i, i)
+        for i in xrange(lookups)
+    ]
+    
+    # Both implementations must agree
+    for url in urls[:200]:
+        assert extractor.get_platform(url) == linear_scan(extractor.platforms, url), url
+    
+    print '%d platforms, %d lookups' % (count, lookups)
+    scan = timeit(lambda url: linear_scan(extractor.platforms, url), urls)
+    print '%-12s %10.1f us/lookup' % ('linear scan', scan * 1e6)
+    routed = timeit(extractor.get_platform, urls)
+    print '%-12s %10.1f us/lookup  (%.0fx)' % ('router', routed * 1e6, scan / routed)
+
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    run(
+        count = args and int(args[0]) or 1000,
+        lookups = len(args) > 1 and int(args[1]) or 5000,
+    )
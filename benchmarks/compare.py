@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+Compares the JSON results of two benchmark runs
+
+Prints every metric of both runs side by side with the relative
+change, flagging changes larger than the threshold (10% default).
+Higher is better for */sec metrics, lower for all the others.
+
+Usage: python -m benchmarks.compare before.json after.json [threshold]
+"""
+
+import sys
+import json
+
+
+
+def flatten(results, prefix=''):
+    """Returns the numeric metrics of nested results, by dotted name"""
+    
+    metrics = {}
+    for key, value in results.iteritems():
+        if isinstance(value, dict):
+            metrics.update(flatten(value, prefix + key + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[prefix + key] = value
+    return metrics
+
+
+def compare(before, after, threshold=0.1):
+    """Returns (metric, before, after, change, regressed) for each metric of both runs"""
+    
+    before, after = flatten(before), flatten(after)
+    rows = []
+    for metric in sorted(set(before) & set(after)):
+        change = before[metric] and (after[metric] - before[metric]) / float(before[metric]) or 0.0
+        worse = 'per_sec' in metric and -change or change
+        rows.append((metric, before[metric], after[metric], change, worse > threshold))
+    return rows
+
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    before, after = [json.load(open(path)) for path in args[:2]]
+    threshold = len(args) > 2 and float(args[2]) or 0.1
+    
+    print '%-32s %12s %12s %9s' % ('metric', before.get('revision'), after.get('revision'), 'change')
+    regressions = 0
+    for metric, old, new, change, regressed in compare(before, after, threshold):
+        regressions += regressed
+        print '%-32s %12.3f %12.3f %+8.1f%%%s' % (metric, old, new, change * 100, regressed and '  !' or '')
+    
+    sys.exit(regressions and 1 or 0)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+Records product pages into the benchmark corpus
+
+Fetches each URL live and saves the page under corpus/<platform>/,
+adding it to corpus/index.json. URLs of unsupported platforms are
+skipped.
+
+Usage: python -m benchmarks.record name url [name url ...]
+"""
+
+import os
+import sys
+import json
+
+from shoplift.config import Extractor
+from shoplift.web import Resource
+
+from .bench_corpus import CORPUS, CONFIG
+
+
+
+def record(pages, path=CORPUS):
+    """Records (name, url) pages, replacing earlier recordings of the URLs"""
+    
+    extractor = Extractor(CONFIG)
+    index_path = os.path.join(path, 'index.json')
+    index = dict((entry['url'], entry) for entry in json.load(open(index_path)))
+    
+    for name, url in pages:
+        platform = extractor.get_platform(url)
+        if not platform:
+            print 'skipped %s: unsupported platform' % url
+            continue
+        
+        page = '%s/%s.html' % (platform[0], name)
+        if not os.path.isdir(os.path.join(path, platform[0])):
+            os.makedirs(os.path.join(path, platform[0]))
+        with open(os.path.join(path, page), 'w') as page_file:
+            page_file.write(Resource(url, max_bytes=None).response.content)
+        
+        index[url] = {'url': url, 'page': page}
+        print 'recorded %s as %s' % (url, page)
+    
+    with open(index_path, 'w') as index_file:
+        json.dump(sorted(index.values(), key=lambda entry: entry['page']), index_file, indent=4, sort_keys=True)
+
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    record(zip(args[::2], args[1::2]))
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+benchmarks.server
+-----------------
+
+A local HTTP stand-in for e-commerce sites, used by the benchmarks
+"""
+
+import time
+import threading
+import urlparse
+import BaseHTTPServer
+import SocketServer
+
+from requests.adapters import HTTPAdapter
+
+PRODUCT_PAGE = """<html>
+<head>
+    <title>%(name)s</title>
+    <meta property="og:title" content="%(name)s" />
+    <meta property="og:image" content="http://example.com/%(id)s.jpg" />
+</head>
+<body itemscope itemtype="http://schema.org/Product">
+    <h1 itemprop="name">%(name)s</h1>
+    <div itemprop="offers" itemscope itemtype="http://schema.org/Offer">
+        <span class="price" itemprop="price">Rs. %(price)s</span>
+        <meta itemprop="priceCurrency" content="INR" />
+    </div>
+</body>
+</html>
+"""
+
+
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+    
+    def handle_error(self, request, client_address):
+        # Clients drop keep-alive connections at will; that's not an error here
+        pass
+
+
+
+class ProductPageHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves a generated product page for any path, after a fixed delay"""
+    
+    protocol_version = 'HTTP/1.1'
+    
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        product_id = self.path.rstrip('/').rsplit('/', 1)[-1]
+        body = self.server.pages.get(self.path) or PRODUCT_PAGE % {
+            'id': product_id,
+            'name': 'Product %s' % product_id,
+            'price': '%d.00' % (len(product_id) * 100),
+        }
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        # Keep responses out of the HTTP cache, so that every run fetches
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass
+
+
+
+def serve(latency=0.0, pages=None):
+    """Starts a stand-in server in a background thread
+    
+    Every request is answered after `latency` seconds. `pages` maps
+    request paths to recorded bodies; other paths get a generated
+    product page. Returns the server; its base URL is server.url
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ProductPageHandler)
+    server.latency = latency
+    server.pages = pages or {}
+    server.url = 'http://127.0.0.1:%d' % server.server_address[1]
+    
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+
+class ReplayAdapter(HTTPAdapter):
+    """Sends the requests for recorded URLs to a stand-in server
+    
+    Mounted on a session for the hosts of a recorded corpus, so that
+    pages keep their original URLs (and platforms) while being served
+    locally. Requests keep their path & query, and the original host
+    in the Host header.
+    """
+    
+    def __init__(self, server):
+        super(ReplayAdapter, self).__init__()
+        self.server = server
+    
+    def send(self, request, **kwargs):
+        url = urlparse.urlsplit(request.url)
+        request.headers['Host'] = url.netloc
+        request.url = urlparse.urlunsplit(urlparse.urlsplit(self.server.url)[:2] + url[2:])
+        return super(ReplayAdapter, self).send(request, **kwargs)
+
+
+
+def replay(session, server, urls):
+    """Serves the given URLs from server, for requests made through session"""
+    
+    adapter = ReplayAdapter(server)
+    for url in urls:
+        url = urlparse.urlsplit(url)
+        session.mount('%s://%s/' % url[:2], adapter)
@@ -0,0 +1,10 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""Runs the command line interface: python -m shoplift, see shoplift.cli"""
+
+import sys
+
+from shoplift.cli import main
+
+sys.exit(main())
@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+shoplift.cache
+--------------
+
+HTTP response caches for the cachecontrol session in shoplift.web,
+and a cache of extraction results
+
+All HTTP caches implement the cachecontrol cache API: get, set &
+delete of serialized responses by URL.
+"""
+
+import time
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from cachecontrol.cache import BaseCache
+from cachecontrol.caches import FileCache
+
+# Default byte-size cap of the in-process cache
+DEFAULT_MEMORY_BYTES = 32 * 1024 * 1024
+
+# Default number of products kept by a ResultCache
+DEFAULT_RESULT_ENTRIES = 100000
+
+
+
+class MemoryCache(BaseCache):
+    """In-process LRU cache with a byte-size cap and an optional TTL
+    
+    Least recently used entries are evicted once the total size of
+    the cached values exceeds max_bytes, and entries older than ttl
+    seconds are dropped on access. Hits, misses, evictions and
+    expirations are counted, and reported by self.stats
+    """
+    
+    def __init__(self, max_bytes=DEFAULT_MEMORY_BYTES, ttl=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = dict.fromkeys(('hits', 'misses', 'evictions', 'expirations'), 0)
+    
+    @property
+    def stats(self):
+        """Get the cache counters, with the current number of entries & bytes"""
+        return dict(self.counters, entries=len(self.data), bytes=self.size)
+    
+    def get(self, key):
+        with self.lock:
+            entry = self.data.pop(key, None)
+            if entry is None:
+                self.counters['misses'] += 1
+                return None
+            
+            value, stored = entry
+            if self.ttl is not None and time.time() - stored > self.ttl:
+                self.size -= len(value)
+                self.counters['expirations'] += 1
+                self.counters['misses'] += 1
+                return None
+            
+            # Re-insert to mark the entry as the most recently used
+            self.data[key] = entry
+            self.counters['hits'] += 1
+            return value
+    
+    def set(self, key, value, expires=None):
+        with self.lock:
+            self._remove(key)
+            
+            # Values larger than the whole cache are never kept
+            if len(value) > self.max_bytes:
+                return
+            
+            self.data[key] = (value, time.time())
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                oldest = next(iter(self.data))
+                self._remove(oldest)
+                self.counters['evictions'] += 1
+    
+    def delete(self, key):
+        with self.lock:
+            self._remove(key)
+    
+    def _remove(self, key):
+        entry = self.data.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[0])
+
+
+
+class SQLiteCache(BaseCache):
+    """Persistent cache stored in a single SQLite database file"""
+    
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value BLOB)'
+            )
+    
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT value FROM responses WHERE key = ?', (key,)
+            ).fetchone()
+        return row and str(row[0]) or None
+    
+    def set(self, key, value, expires=None):
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO responses (key, value) VALUES (?, ?)',
+                (key, sqlite3.Binary(value))
+            )
+    
+    def delete(self, key):
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM responses WHERE key = ?', (key,))
+
+
+
+class ResultCache(object):
+    """Persistent cache of extracted products, in a SQLite database
+    
+    Products are stored by (URL, platform config digest), along with
+    the digest of the page body they were extracted from. A lookup
+    only hits if the page body is unchanged, and storing a product
+    replaces the one of an earlier body. Once over max_entries, the
+    least recently used products are evicted.
+    
+    The validators (ETag, Last-Modified) of the page can be stored
+    with a product, to revalidate the page later on, see lookup.
+    """
+    
+    def __init__(self, path, max_entries=DEFAULT_RESULT_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.counters = dict.fromkeys(('hits', 'misses', 'evictions'), 0)
+        with self.lock, self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS products ('
+                'url TEXT, config TEXT, body TEXT, product TEXT, validators TEXT, accessed REAL, '
+                'PRIMARY KEY (url, config))'
+            )
+            self.connection.execute('CREATE INDEX IF NOT EXISTS products_accessed ON products (accessed)')
+            self.entries = self.connection.execute('SELECT COUNT(*) FROM products').fetchone()[0]
+    
+    @property
+    def stats(self):
+        """Get the cache counters, with the current number of entries"""
+        return dict(self.counters, entries=self.entries)
+    
+    def get(self, key):
+        """Returns the product stored for a (url, config, body) key, or None"""
+        url, config, body = key
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                'SELECT product FROM products WHERE url = ? AND config = ? AND body = ?',
+                (url, config, body)
+            ).fetchone()
+            if row is None:
+                self.counters['misses'] += 1
+                return None
+            
+            self.connection.execute(
+                'UPDATE products SET accessed = ? WHERE url = ? AND config = ?',
+                (time.time(), url, config)
+            )
+            self.counters['hits'] += 1
+        return json.loads(row[0])
+    
+    def lookup(self, url, config):
+        """Returns the (product, validators) stored for a page whatever its body, or None"""
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                'SELECT product, validators FROM products WHERE url = ? AND config = ?',
+                (url, config)
+            ).fetchone()
+            if row is None:
+                return None
+            
+            self.connection.execute(
+                'UPDATE products SET accessed = ? WHERE url = ? AND config = ?',
+                (time.time(), url, config)
+            )
+        return json.loads(row[0]), json.loads(row[1] or '{}')
+    
+    def set(self, key, product, validators=None):
+        """Stores the product for a (url, config, body) key, with the page's validators
+        
+        Products are stored as JSON, and come back with unicode
+        strings. Products that aren't JSON serializable, eg. holding
+        the lxml elements an xpath scraped, aren't stored. Returns
+        whether the product was stored.
+        """
+        url, config, body = key
+        try:
+            serialized = json.dumps(product)
+        except TypeError:
+            return False
+        
+        with self.lock, self.connection:
+            replaced = self.connection.execute(
+                'SELECT 1 FROM products WHERE url = ? AND config = ?', (url, config)
+            ).fetchone()
+            self.connection.execute(
+                'INSERT OR REPLACE INTO products (url, config, body, product, validators, accessed) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (url, config, body, serialized, json.dumps(validators or {}), time.time())
+            )
+            self.entries += not replaced
+            
+            if self.entries > self.max_entries:
+                evicted = self.connection.execute(
+                    'DELETE FROM products WHERE rowid IN '
+                    '(SELECT rowid FROM products ORDER BY accessed LIMIT ?)',
+                    (self.entries - self.max_entries,)
+                ).rowcount
+                self.entries -= evicted
+                self.counters['evictions'] += evicted
+        return True
+    
+    def clear(self):
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM products')
+            self.entries = 0
+
+
+
+class LayeredCache(BaseCache):
+    """Fronts a persistent backend with a fast in-process cache
+    
+    Reads are served from the front cache when possible; misses fall
+    through to the backend and are copied to the front. Writes and
+    deletes go to both. Backend hits & misses are reported by
+    self.stats, next to the front cache's own counters.
+    """
+    
+    def __init__(self, front, backend):
+        self.front = front
+        self.backend = backend
+        self.lock = threading.Lock()
+        self.counters = dict.fromkeys(('backend_hits', 'backend_misses'), 0)
+    
+    @property
+    def stats(self):
+        """Get the front cache's stats along with the backend counters"""
+        with self.lock:
+            counters = dict(self.counters)
+        return dict(self.front.stats, **counters)
+    
+    def get(self, key):
+        value = self.front.get(key)
+        if value is None:
+            value = self.backend.get(key)
+            with self.lock:
+                self.counters[value is None and 'backend_misses' or 'backend_hits'] += 1
+            if value is not None:
+                self.front.set(key, value)
+        return value
+    
+    def set(self, key, value, expires=None):
+        self.front.set(key, value)
+        self.backend.set(key, value)
+    
+    def delete(self, key):
+        self.front.delete(key)
+        try:
+            self.backend.delete(key)
+        except (IOError, OSError):
+            # FileCache raises for keys it doesn't have
+            pass
+
+
+
+def redis_cache(location):
+    """Returns a cache on the Redis (or Redis-protocol) server at location
+    
+    location is a 'host:port' string. Requires the redis client library.
+    """
+    import redis
+    from cachecontrol.caches.redis_cache import RedisCache
+    
+    host, _, port = location.partition(':')
+    return RedisCache(redis.StrictRedis(host=host or 'localhost', port=int(port or 6379)))
+
+
+
+# Persistent backends by name, each built from a location
+BACKENDS = {
+    'file': FileCache,
+    'sqlite': SQLiteCache,
+    'redis': redis_cache,
+}
+
+
+
+def build_cache(backend='file', location='.webcache', memory_bytes=DEFAULT_MEMORY_BYTES, ttl=None):
+    """Builds a cache stack for the web session
+    
+    backend is one of BACKENDS ('file', 'sqlite' or 'redis') built
+    from location, or None for an in-process cache only. Unless
+    memory_bytes is 0, the backend is fronted by a MemoryCache of
+    that size, whose entries expire after ttl seconds.
+    """
+    backend = backend and BACKENDS[backend](location)
+    front = memory_bytes and MemoryCache(memory_bytes, ttl)
+    
+    if backend and front:
+        return LayeredCache(front, backend)
+    return front or backend or MemoryCache(0)
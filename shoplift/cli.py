@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+shoplift.cli
+------------
+
+Bulk extraction from the command line
+
+Reads product URLs, one per line, from files or stdin and writes a
+JSON object per URL as soon as it's extracted (JSON Lines):
+    {"url": "...", "product": {...}}
+    {"url": "...", "error": "IOError: ..."}
+URLs are read as the extraction goes on, so any number of them runs
+in bounded memory. With a checkpoint file, the input lines handled
+and the length of the output are saved as the job goes. A job
+resumed with --resume truncates the output to that length, and skips
+the lines handled, so that each URL gets a single result line; only
+URLs that were in flight when the job stopped are extracted again.
+Output to stdout can't be truncated: results written after the last
+checkpoint are then written again. Ctrl-C stops a job, over threads
+or --processes alike, and exits with status 130 once the checkpoint
+is saved.
+
+Usage: python -m shoplift [options] [file ...]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import fileinput
+import threading
+from collections import deque
+
+from .config import Extractor
+
+DEFAULT_CONFIG = os.path.join(os.path.dirname(__file__), 'config.ini')
+
+# Seconds between checkpoints
+CHECKPOINT_INTERVAL = 5
+
+
+
+class Progress(object):
+    """Tracks the input lines handled, in any order, and the throughput
+    
+    `lines` is the number of leading input lines all handled, and
+    `handled` the numbers of the lines handled ahead of it, which is
+    what a checkpoint saves. Those are kept until `lines` catches up,
+    so at most as many as are in flight.
+    """
+    
+    def __init__(self, lines=0, handled=()):
+        self.lock = threading.Lock()
+        self.lines = lines
+        self.handled = set(handled)
+        # Input line numbers of the URLs in flight
+        self.pending = {}
+        self.extracted = 0
+        self.errors = 0
+        self.started = time.time()
+    
+    def urls(self, lines):
+        """Yields the URLs of the lines not handled yet, recording their line numbers"""
+        for number, line in enumerate(lines):
+            url = line.strip()
+            with self.lock:
+                if number < self.lines or number in self.handled:
+                    continue
+                if not url:
+                    self.done(number)
+                    continue
+                self.pending.setdefault(url, deque()).append(number)
+            yield url
+    
+    def extracted_url(self, url, error=False):
+        """Records the result of a URL"""
+        with self.lock:
+            numbers = self.pending[url]
+            number = numbers.popleft()
+            if not numbers:
+                del self.pending[url]
+            self.extracted += 1
+            self.errors += error
+            self.done(number)
+    
+    def done(self, number):
+        # Must be called with the lock held
+        self.handled.add(number)
+        while self.lines in self.handled:
+            self.handled.remove(self.lines)
+            self.lines += 1
+    
+    def report(self):
+        elapsed = time.time() - self.started
+        return '%d extracted, %d errors, %d lines done, %.1f URLs/sec' % (
+            self.extracted, self.errors, self.lines, elapsed and self.extracted / elapsed or 0.0
+        )
+
+
+
+def read_checkpoint(path):
+    """Returns the progress saved in a checkpoint, see write_checkpoint, or {}"""
+    try:
+        with open(path) as checkpoint:
+            saved = json.load(checkpoint)
+        return isinstance(saved, dict) and saved or {}
+    except (IOError, ValueError):
+        return {}
+
+
+def write_checkpoint(path, progress, output=None):
+    """Saves the input lines handled, and the output's length, atomically"""
+    with progress.lock:
+        saved = {
+            'lines': progress.lines, 'handled': sorted(progress.handled),
+            'extracted': progress.extracted, 'errors': progress.errors,
+        }
+    if output is not None:
+        saved['output'] = output
+    with open(path + '.tmp', 'w') as checkpoint:
+        json.dump(saved, checkpoint)
+    os.rename(path + '.tmp', path)
+
+
+def result_line(url, product):
+    """Returns the JSON line of a URL's product, or of the exception raised"""
+    if isinstance(product, Exception):
+        result = {'url': url, 'error': '%s: %s' % (type(product).__name__, product)}
+    else:
+        result = {'url': url, 'product': product}
+    # Scraped values that aren't strings, eg. elements, are written as text
+    return json.dumps(result, sort_keys=True, default=unicode) + '\n'
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m shoplift', description='Extracts the product info at URLs to JSON Lines')
+    parser.add_argument('files', nargs='*', default=['-'], help='files of URLs, one per line (default: stdin)')
+    parser.add_argument('-c', '--config', default=DEFAULT_CONFIG, help='platforms config file')
+    parser.add_argument('-o', '--output', help='file to write the results to (default: stdout)')
+    parser.add_argument('-w', '--workers', type=int, default=8,
+        help='URLs extracted at once (default: 8); still at most 4 fetched at once per host, unless its url.concurrency allows more')
+    parser.add_argument('-p', '--processes', type=int,
+        help='extract over this many processes rather than threads, see Extractor.extract_parallel')
+    parser.add_argument('--checkpoint', help='file to save the progress of the job to')
+    parser.add_argument('--resume', action='store_true',
+        help='skip the input lines handled according to the checkpoint, and append to the output, '
+             'truncated to its length at the checkpoint')
+    parser.add_argument('--progress', type=float, default=0, metavar='SECONDS',
+        help='report the progress & throughput to stderr every SECONDS')
+    args = parser.parse_args(argv)
+    
+    if args.resume and not args.checkpoint:
+        parser.error('--resume requires --checkpoint')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    extractor = Extractor(args.config)
+    
+    resumed = args.resume and read_checkpoint(args.checkpoint) or {}
+    progress = Progress(resumed.get('lines', 0), resumed.get('handled', ()))
+    lines = fileinput.FileInput(args.files)
+    urls = progress.urls(lines)
+    
+    if args.processes:
+        results = extractor.extract_parallel(urls, args.processes, prefetch=args.workers)
+    else:
+        results = extractor.extract_many(urls, args.workers)
+    
+    output = args.output and open(args.output, resumed and 'a' or 'w') or sys.stdout
+    if output is not sys.stdout:
+        if resumed.get('output') is not None:
+            # Drop the results written since the checkpoint, whose lines it doesn't count
+            output.truncate(resumed['output'])
+        output.seek(0, os.SEEK_END)
+    length = output is not sys.stdout and output.tell or (lambda: None)
+    checkpointed = reported = time.time()
+    try:
+        for url, product in results:
+            output.write(result_line(url, product))
+            progress.extracted_url(url, isinstance(product, Exception))
+            
+            now = time.time()
+            if args.checkpoint and now - checkpointed >= CHECKPOINT_INTERVAL:
+                # The results must be written before the checkpoint counts them
+                output.flush()
+                write_checkpoint(args.checkpoint, progress, length())
+                checkpointed = now
+            if args.progress and now - reported >= args.progress:
+                sys.stderr.write(progress.report() + '\n')
+                reported = now
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        # Interrupted jobs stop reading their input halfway
+        lines.close()
+        output.flush()
+        if args.checkpoint:
+            write_checkpoint(args.checkpoint, progress, length())
+        if args.progress:
+            sys.stderr.write(progress.report() + '\n')
+        if output is not sys.stdout:
+            output.close()
+    
+    return 0
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,12 +4,24 @@
 import os
 import re
 import sys
+import signal
+import time
+import json
+import Queue
+import pickle
+import hashlib
+import threading
 import ConfigParser
 import urlparse
+from StringIO import StringIO
+from contextlib import contextmanager
 
-from . import scrapers, filters
-from .web import sanitize_url, Resource
-from .exceptions import ConfigDoesNotExistException
+from . import scrapers, filters, pool, web, instrument
+from .web import sanitize_url, Resource, AsyncResource
+from .router import Router
+from .plan import ExtractionPlan, bind_step
+from . import registry
+from .exceptions import ConfigDoesNotExistException, ExtractionException
 
 # Assigning var names to hard-coded strings
 CONFIG_KEY_METHOD = 'method'
@@ -17,29 +29,162 @@ CONFIG_KEY_URL = 'url'
 CONFIG_KEY_PATHS = 'path'
 CONFIG_KEY_DOMAINS = 'domains'
 CONFIG_KEY_FILTER = 'filter'
+CONFIG_KEY_RATE = 'rate'
+CONFIG_KEY_CONCURRENCY = 'concurrency'
+CONFIG_KEY_MAX_BYTES = 'max_bytes'
+CONFIG_KEY_DROP_PARAMS = 'drop_params'
+CONFIG_KEY_CANONICAL = 'canonical'
 CONFIG_KEY_SEPARATOR = '.'
 
-class Extractor:
+# Canonical URLs memoized per version of the config, cleared when full
+MAX_CANONICAL_URLS = 10000
+
+# Threads extracting the products of platforms that need no page, eg.
+# through an API, see Extractor.extract_async
+URL_WORKERS = 8
+
+# Needs that call for fetching the page: None stands for scrapers that
+# don't declare what they need, see Extractor.get_needs
+PAGE_NEEDS = frozenset(registry.PAGE_INPUTS + (None,))
+
+
+
+class Configuration(object):
+    """A version of the platforms config, built by Extractor.build_config
+    
+    Holds everything compiled off the config file. It isn't modified
+    once in use, bar the canonical URL memo, so that reloading the
+    config swaps it whole, see Extractor.reload.
+    """
+    
+    def __init__(self, text=''):
+        # The config file's text, to build the Extractors of
+        # extraction processes
+        self.text = text
+        # The ConfigParser values of each platform, by name
+        self.platforms = {}
+        # Platform names in the order they appear in the file, and
+        # the compiled url.path patterns of the router, by name
+        self.order = []
+        self.routes = {}
+        # Looks platforms up by URL, see Extractor.get_platform
+        self.router = Router()
+        # The ExtractionPlans of each platform's attributes
+        self.plans = {}
+        # The inputs each platform's scrapers need, see Extractor.get_needs,
+        # and the options to download its pages, which depend on them
+        self.needs = {}
+        self.fetch_options = {}
+        # Digests of each platform's config, for the results cached off
+        # its pages to be discarded when it changes
+        self.config_digests = {}
+        # The compiled url.drop_params & url.canonical patterns of each
+        # platform, and the canonical URLs memoized, see canonical_url
+        self.canonical_rules = {}
+        self.canonical_urls = {}
+
+
+def _config_attribute(name):
+    """Extractor attribute reading the Configuration in use"""
+    return property(lambda self: getattr(self.config, name))
+
+
+
+class Extractor(object):
     '''
         Extractor that returns the product info given the url of
         the product page of the valid e-commerce websites
     '''
     
-    def __init__(self, config_file):
-        """Initializes the url passed by the user"""
+    def __init__(self, config_file, observer=None, result_cache=None):
+        """Initializes the url passed by the user
         
-        self.platforms = {}
+        If given, observer is reported the timed spans of every
+        extraction, see shoplift.instrument, and products are
+        looked up in & stored to the result_cache, see
+        shoplift.cache.ResultCache
+        """
+        
+        self.observer = observer
+        self.result_cache = result_cache
+        self._config = Configuration()
+        # Configurations pinned by the threads extracting, see pinned
+        self._local = threading.local()
+        self._reload_lock = threading.Lock()
         self.config_file = config_file
         self.parse_config()
     
+    # The attributes of the Configuration in use, see build_config
+    config_text = _config_attribute('text')
+    platforms = _config_attribute('platforms')
+    router = _config_attribute('router')
+    plans = _config_attribute('plans')
+    needs = _config_attribute('needs')
+    fetch_options = _config_attribute('fetch_options')
+    config_digests = _config_attribute('config_digests')
+    canonical_rules = _config_attribute('canonical_rules')
+    canonical_urls = _config_attribute('canonical_urls')
+    
+    @property
+    def config(self):
+        """Get the Configuration in use
+        
+        That's the one the calling thread pinned, if any, see pinned,
+        or else the latest one.
+        """
+        return getattr(self._local, 'config', None) or self._config
+    
+    @contextmanager
+    def pinned(self, config=None):
+        """Pins the Configuration in use for the calling thread
+        
+        Within the block, the thread keeps using the same version of
+        the config however it's reloaded, eg. for an extraction to
+        route a URL & scrape it with the plans of the same version.
+        `config` pins a given version instead of the latest one, or
+        instead of the one pinned by an outer block, until this
+        block exits.
+        """
+        outer = getattr(self._local, 'config', None)
+        self._local.config = config or outer or self._config
+        try:
+            yield
+        finally:
+            self._local.config = outer
+    
     def parse_config(self):
-        """Parses the config file
+        """Parses the config file, see build_config"""
+        
+        self._config = self.build_config(self.read_config(self.config_file))
+    
+    def reload(self, config_file=None):
+        """Reloads the config file, recompiling only the platforms that changed
+        
+        The platforms whose config is unchanged keep their compiled
+        plans & patterns, and the memoized canonical URLs are kept
+        unless the routing or canonical rules of a platform changed.
+        The new version is swapped in at once: extractions in flight
+        finish with the version they started with. config_file
+        replaces the Extractor's, eg. if that was a file object.
         
-        Parses the file using ConfigParser and saves the
-        values in self.platforms
+        Returns the names of the (added, changed, removed) platforms.
         """
         
-        config_file = self.config_file
+        with self._reload_lock:
+            if config_file is not None:
+                self.config_file = config_file
+            previous = self._config
+            self._config = self.build_config(self.read_config(self.config_file), previous)
+        
+        old, new = previous.config_digests, self._config.config_digests
+        return (
+            sorted(set(new) - set(old)),
+            sorted(name for name in new if name in old and new[name] != old[name]),
+            sorted(set(old) - set(new)),
+        )
+    
+    def read_config(self, config_file):
+        """Returns the text of a config file path, or file-like object"""
         
         # Try reading `config_file` if it isn't already a file or file-like object
         if not hasattr(config_file, 'readline'):
@@ -48,9 +193,24 @@ class Extractor:
             
             config_file = open(config_file, 'r')
         
+        try:
+            return config_file.read()
+        finally:
+            config_file.close()
+    
+    def build_config(self, text, previous=None):
+        """Builds the Configuration of a config file's text
+        
+        Applies the platforms' fetch limits, lifting those only set by
+        the `previous` Configuration. Platforms whose config digest is
+        the same there reuse what was compiled for them.
+        """
+        
+        previous = previous or Configuration()
+        config = Configuration(text)
+        
         Config = ConfigParser.ConfigParser()
-        Config.readfp(config_file)
-        config_file.close()
+        Config.readfp(StringIO(text))
         
         # Extract the contents of config_file
         platforms = {
@@ -72,75 +232,444 @@ class Extractor:
         }
         
         # Re-structure data
-        self.platforms = {}
-        for name, config in platforms.iteritems():
+        for name, platform_config in platforms.iteritems():
             
             # Split keys by '.' and create nested dictionaries
             new_config = {}
-            for key, value in config.iteritems():
+            for key, value in platform_config.iteritems():
                 parent, child = key.split(CONFIG_KEY_SEPARATOR, 1)
                 if parent not in new_config : new_config[parent] = {}
                 new_config[parent][child] = value
-            config = new_config
+            platform_config = new_config
             
             # Change url.domains from csv to a list
-            config[CONFIG_KEY_URL][CONFIG_KEY_DOMAINS] = map(str.strip, config[CONFIG_KEY_URL][CONFIG_KEY_DOMAINS].split(','))
-            self.platforms[name] = config
+            platform_config[CONFIG_KEY_URL][CONFIG_KEY_DOMAINS] = map(str.strip, platform_config[CONFIG_KEY_URL][CONFIG_KEY_DOMAINS].split(','))
+            config.platforms[name] = platform_config
+            config.config_digests[name] = hashlib.sha1(json.dumps(platform_config, sort_keys=True)).hexdigest()
+        
+        config.order = [name for name in Config.sections() if name in config.platforms]
+        unchanged = set(
+            name for name in config.platforms
+            if previous.config_digests.get(name) == config.config_digests[name]
+        )
+        
+        for name, platform_config in config.platforms.iteritems():
+            if name in unchanged:
+                for attribute in ('plans', 'needs', 'fetch_options', 'canonical_rules'):
+                    getattr(config, attribute)[name] = getattr(previous, attribute)[name]
+                continue
+            
+            # Compile the extraction plans of every platform attribute
+            url_config = platform_config[CONFIG_KEY_URL]
+            config.plans[name] = tuple(
+                self.compile_plan(attribute, methods)
+                for attribute, methods in platform_config.iteritems()
+            )
+            config.needs[name] = self.get_needs(config.plans[name])
+            config.fetch_options[name] = self.get_fetch_options(url_config, config.needs[name])
+            config.canonical_rules[name] = self.get_canonical_rules(url_config)
+            self.apply_limits(url_config)
+        
+        # Lift the limits of the domains no platform limits anymore
+        for domain in self.get_limited_domains(previous) - self.get_limited_domains(config):
+            web.scheduler.clear_limit(domain)
+        
+        # Route URLs to platforms, in the order they appear in the file
+        for name in config.order:
+            url_config = config.platforms[name][CONFIG_KEY_URL]
+            path = name in unchanged and previous.routes.get(name) or url_config[CONFIG_KEY_PATHS]
+            config.routes[name] = config.router.add(name, url_config[CONFIG_KEY_DOMAINS], path)
         
+        # Canonical URLs stay the same as long as the routes & rules do
+        url_configs = lambda version: [(name, version.platforms[name][CONFIG_KEY_URL]) for name in version.order]
+        if previous.order and url_configs(previous) == url_configs(config):
+            config.canonical_urls = previous.canonical_urls
+        
+        return config
+    
+    def apply_limits(self, url_config):
+        """Limits the fetch rate & concurrency for a platform's domains
+        
+        url.rate is the maximum number of requests per second, and
+        url.concurrency the maximum number of requests at once, for
+        each of the url.domains. Invalid values are ignored.
+        """
+        
+        limits = self.get_limits(url_config)
+        if limits:
+            for domain in url_config[CONFIG_KEY_DOMAINS]:
+                web.scheduler.set_limit(domain, **limits)
     
-    def extract(self, url):
+    def get_limits(self, url_config):
+        """Returns the valid url.rate & url.concurrency of a platform, by key"""
+        
+        limits = {}
+        for key, cast in ((CONFIG_KEY_RATE, float), (CONFIG_KEY_CONCURRENCY, int)):
+            try:
+                limits[key] = cast(url_config[key])
+            except (KeyError, ValueError):
+                pass
+        return limits
+    
+    def get_limited_domains(self, config):
+        """Returns the set of domains the platforms of a Configuration limit"""
+        
+        return set(
+            domain
+            for url_config in (platform[CONFIG_KEY_URL] for platform in config.platforms.itervalues())
+            if self.get_limits(url_config)
+            for domain in url_config[CONFIG_KEY_DOMAINS]
+        )
+    
+    def get_needs(self, plans):
+        """Returns the set of inputs the scrapers of a platform need
+        
+        See shoplift.registry.declare. Scrapers that don't declare
+        what they need add None.
+        """
+        
+        return frozenset(registry.declared(plan.steps[0][0])[0] for plan in plans if plan.steps)
+    
+    def get_fetch_options(self, url_config, needs):
+        """Returns the options to download the pages of a platform
+        
+        url.max_bytes caps the bytes read of each page. Platforms
+        whose attributes are all scraped off OpenGraph tags, or the
+        URL alone, only need a page's <head>, and stop reading right
+        after it.
+        """
+        
+        options = {}
+        try:
+            options['max_bytes'] = int(url_config[CONFIG_KEY_MAX_BYTES])
+        except (KeyError, ValueError):
+            pass
+        
+        if needs & PAGE_NEEDS == set([registry.OPENGRAPH]):
+            options['head_only'] = True
+        
+        return options
+    
+    def get_canonical_rules(self, url_config):
+        """Returns the compiled (url.drop_params, url.canonical) patterns
+        
+        url.drop_params matches the whole name of the query params
+        to drop off a platform's URLs, and url.canonical the part of
+        the URL identifying the product. Missing or invalid patterns
+        are None.
+        """
+        
+        rules = []
+        for key, template in ((CONFIG_KEY_DROP_PARAMS, '(?:%s)$'), (CONFIG_KEY_CANONICAL, '%s')):
+            try:
+                rules.append(re.compile(template % url_config[key]))
+            except (KeyError, re.error):
+                rules.append(None)
+        return tuple(rules)
+    
+    def canonical_url(self, url, name=None):
+        """Returns the canonical URL of a product page
+        
+        Sanitizes the URL, drops its tracking params & the ones of the
+        platform's url.drop_params, then reduces it to the platform's
+        url.canonical match (eg. the product ID), as long as the
+        reduced URL still routes to the platform. URLs of a product
+        are thus fetched & cached as one. Canonical URLs are memoized.
+        name is the URL's platform, if it's already been routed.
+        """
+        
+        config = self.config
+        try:
+            return config.canonical_urls[url]
+        except KeyError:
+            pass
+        
+        sanitized = sanitize_url(url)
+        if name is None:
+            name = config.router.match(urlparse.urlsplit(sanitized))
+        drop_params, pattern = config.canonical_rules.get(name, (None, None))
+        
+        canonical = web.canonical_url(sanitized, drop_params)
+        reduced = pattern and web.reduce_url(canonical, pattern)
+        if reduced and config.router.match(urlparse.urlsplit(reduced)) == name:
+            canonical = reduced
+        
+        if len(config.canonical_urls) >= MAX_CANONICAL_URLS:
+            config.canonical_urls.clear()
+        config.canonical_urls[url] = canonical
+        return canonical
+    
+    def extract(self, url_or_resource):
         """Return the product info found at the given URL
         
-        Returns a dictionary with items: name, image, price, currency
+        Returns a dictionary with items: name, image, price, currency.
+        All the attributes are scraped off a single Resource, so the
+        page is fetched and parsed only once per call. With a result
+        cache, pages scraped before with the same body & config
+        aren't parsed at all, see ResultCache.get. The whole
+        extraction uses the config as it was when it started, even
+        if it's reloaded meanwhile.
         """
         
         product = {}
-        resource = Resource(url)
-        platform = self.get_platform(resource.url)
-        
-        # Extract individual attributes based on the config
-        if platform and len(platform) == 2:
-            name, config = platform
-            for attribute, method in config.iteritems():
-                product[attribute] = self.invoke_extraction_method(method, resource)
+        with self.pinned(), instrument.observing(self.observer) as context:
+            started = time.time()
+            platform = self.get_platform(getattr(url_or_resource, 'url', url_or_resource))
+            context.platform = platform and len(platform) == 2 and platform[0] or None
+            context.emit(instrument.ROUTE, time.time() - started)
+            
+            # Extract individual attributes based on the config
+            if platform and len(platform) == 2:
+                name, config = platform
+                resource = isinstance(url_or_resource, Resource) and url_or_resource or \
+                    Resource(self.canonical_url(url_or_resource, name), **self.fetch_options.get(name, {}))
+                
+                key = self.result_cache is not None and self.get_result_key(name, resource)
+                if key:
+                    cached = self.result_cache.get(key)
+                    if cached is not None:
+                        return cached
+                
+                for plan in self.plans[name]:
+                    context.attribute = plan.attribute
+                    product[plan.attribute] = self.invoke_extraction_method(plan, resource)
+                
+                if key:
+                    self.result_cache.set(key, product, resource.validators)
         
         return product
     
+    def needs_page(self, name):
+        """Whether the scrapers of a platform need its page fetched
+        
+        Platforms whose scrapers only need the URL, eg. to query an
+        API, are extracted without fetching their pages. Scrapers
+        that don't declare what they need are assumed to need it.
+        """
+        
+        return bool(self.needs[name] & PAGE_NEEDS)
+    
+    def get_result_key(self, name, resource):
+        """Returns the result cache key of a page, or None if it can't be cached
+        
+        The key is the (URL, config digest, body digest) of the page.
+        Products of platforms that scrape more than the page itself,
+        eg. through an API, or whose scrapers don't declare what they
+        need, aren't cached.
+        """
+        
+        if not self.needs[name] <= set(registry.PAGE_INPUTS):
+            return None
+        
+        return (
+            sanitize_url(resource.url),
+            self.config_digests[name],
+            hashlib.sha1(resource.response.content).hexdigest(),
+        )
+    
+    def refresh(self, url):
+        """Re-extract the product info at url, unless the page is unchanged
+        
+        The validators (ETag, Last-Modified) stored in the result cache
+        along with the page's product are sent with the fetch. If the
+        server answers 304 Not Modified, the stored product is returned
+        without downloading or scraping the page again, so re-checking
+        unchanged pages only costs their headers.
+        
+        Returns a (changed, product) tuple. Without a result cache, or
+        a product stored for the page, pages are always changed.
+        """
+        
+        with self.pinned():
+            platform = self.get_platform(url)
+            if not (platform and len(platform) == 2):
+                return True, {}
+            
+            name = platform[0]
+            url = self.canonical_url(url, name)
+            stored = self.result_cache is not None and self.result_cache.lookup(url, self.config_digests[name])
+            product, validators = stored or (None, None)
+            
+            with instrument.observing(self.observer, name):
+                resource = Resource(url, validators=validators, **self.fetch_options.get(name, {}))
+                if product is not None and resource.unchanged:
+                    return False, product
+            
+            return True, self.extract(resource)
+    
+    def extract_many(self, urls, workers=4):
+        """Extract the product info for many URLs concurrently
+        
+        Fetches and extracts the URLs over a bounded pool of worker
+        threads, and yields (url, product) tuples in completion order.
+        Errors are captured per URL: if extracting a URL fails, the
+        exception instance is yielded in place of its product.
+        
+        Fetches are still limited per host by the web scheduler: at
+        most scheduler.DEFAULT_PER_HOST (4) at once for a host, unless
+        its platform's url.concurrency allows more, however many
+        workers there are.
+        """
+        
+        for url, product, error in pool.imap_unordered(self.extract, urls, workers):
+            yield url, error or product
+    
+    def refresh_many(self, urls, workers=4):
+        """Refresh the product info of many URLs concurrently
+        
+        Yields (url, (changed, product)) tuples in completion order, or
+        the exception instance in place of the tuple, as extract_many.
+        """
+        
+        for url, result, error in pool.imap_unordered(self.refresh, urls, workers):
+            yield url, error or result
+    
+    def extract_async(self, url, timeout=None):
+        """Start extracting the product info at the given URL
+        
+        Returns immediately with a pool.Future for the product dict.
+        The page is fetched in the background by the web scheduler,
+        which limits concurrent fetches per host, and is extracted
+        as soon as it arrives. URLs of unsupported platforms resolve
+        to an empty product without being fetched, and those of
+        platforms that need no page are extracted by a pool of
+        URL_WORKERS threads instead. The page is extracted with the
+        config it was routed with.
+        """
+        
+        future = pool.Future()
+        config = self.config
+        with self.pinned(config):
+            platform = self.get_platform(url)
+            if not platform:
+                future.set_result({})
+                return future
+            canonical = self.canonical_url(url, platform[0])
+            if not self.needs_page(platform[0]):
+                return _url_pool.submit(self.extract_pinned, config, canonical)
+        
+        def extract(fetched):
+            # The page was fetched in the background since `started`
+            with instrument.observing(self.observer, platform[0]) as context:
+                context.emit(instrument.FETCH, time.time() - started)
+            try:
+                future.set_result(self.extract_pinned(config, resource))
+            except Exception as e:
+                future.set_exception(e)
+        
+        started = time.time()
+        resource = AsyncResource(canonical, timeout, **config.fetch_options.get(platform[0], {}))
+        resource.future.add_done_callback(extract)
+        return future
+    
+    def extract_pinned(self, config, url_or_resource):
+        """Extract the product info with the given config, see pinned"""
+        
+        with self.pinned(config):
+            return self.extract(url_or_resource)
+    
+    def extract_parallel(self, urls, processes=None, prefetch=64):
+        """Extract the product info for many URLs over several processes
+        
+        Pages are fetched by the web scheduler's I/O threads in this
+        process, and their raw bytes are shipped to a pool of
+        `processes` extraction processes (one per core by default),
+        each holding its own compiled copy of the config. Parsing &
+        scraping thus scale with the cores instead of sharing the
+        GIL. The URLs of platforms that need no page are shipped to
+        the processes as-is, without fetching them. At most `prefetch`
+        URLs are fetched or extracted at once.
+        The processes keep the config they started with, even if it's
+        reloaded meanwhile.
+        
+        Yields (url, product) tuples in completion order, with the
+        exception in place of the product if extracting a URL fails.
+        Results are waited for in slices of pool.POLL_INTERVAL, so
+        that Ctrl-C interrupts the consumer, which then terminates the
+        processes; they ignore it themselves.
+        """
+        
+        # Imported here, as most extractions don't need it
+        import multiprocessing
+        
+        results = Queue.Queue()
+        config = self.config
+        workers = multiprocessing.Pool(processes, _init_process, (config.text,))
+        
+        def get():
+            # A blocking get() would defer KeyboardInterrupt until it returns
+            while True:
+                try:
+                    return results.get(True, pool.POLL_INTERVAL)
+                except Queue.Empty:
+                    pass
+        
+        def extracted(url):
+            def callback(result):
+                product, error = result
+                results.put((url, error or product))
+            return callback
+        
+        def fetched(url, canonical):
+            def callback(future):
+                try:
+                    response = future.result()
+                    workers.apply_async(
+                        _extract_page, (canonical, response.content, response.encoding),
+                        callback=extracted(url)
+                    )
+                except Exception as e:
+                    results.put((url, e))
+            return callback
+        
+        try:
+            pending = 0
+            for url in urls:
+                with self.pinned(config):
+                    platform = self.get_platform(url)
+                    if platform and not self.needs_page(platform[0]):
+                        canonical = self.canonical_url(url, platform[0])
+                        workers.apply_async(_extract_url, (canonical,), callback=extracted(url))
+                    elif platform:
+                        canonical = self.canonical_url(url, platform[0])
+                        resource = AsyncResource(canonical, **config.fetch_options.get(platform[0], {}))
+                        resource.future.add_done_callback(fetched(url, canonical))
+                    else:
+                        results.put((url, {}))
+                
+                pending += 1
+                if pending >= prefetch:
+                    yield get()
+                    pending -= 1
+            
+            for i in xrange(pending):
+                yield get()
+            
+            workers.close()
+            workers.join()
+        finally:
+            workers.terminate()
+    
     def get_platform(self, url):
         """Gets the supported platform for a given URL
         
-        Checks for a matching URL config and, if found, 
+        Looks up a matching URL config in the router and, if found,
         returns a tuple with the platform name & attributes config:
         (<name>, { <attr> : { <key> : <method>'.'<arg> }})
         """
         
+        config = self.config
         url = urlparse.urlsplit(sanitize_url(url))
+        name = config.router.match(url)
         
-        # Find the first platform config that matches the URL criteria
-        for name, config in self.platforms.iteritems():
-            if len(filter(
-                # Check for a url.domain match
-                url.netloc.endswith,
-                config[CONFIG_KEY_URL][CONFIG_KEY_DOMAINS]
-                
-            )) and re.search(
-                # Search for a url.path match
-                r'%s' % config[CONFIG_KEY_URL][CONFIG_KEY_PATHS],
-                # Reconstruct the URL from the path onwards
-                urlparse.urlunsplit(('','') + url[2:])
-            ):
-                return (name, config)
-            
-        return None
+        return name and (name, config.platforms[name]) or None
     
-    def invoke_extraction_method(self, config, url):
-        """Invokes a list of functions and returns the final result
+    def compile_plan(self, attribute, config, compile_args=True):
+        """Compiles an attribute's config into an ExtractionPlan
         
-        Expects the list of functions in the following dict format
-        { # <key>    : <function_name>'.'<function_argument>,
-            'method' : 'microdata./properties/offers/0/properties/price/0',
-            'filter' : 'regex.(\\d+.\\d+)',
-        }
+        Binds the scraper & filter named in the config dict to
+        their (pre-parsed) arguments, so that extracting the
+        attribute requires no lookups or string parsing.
         """
         
         call_order = (
@@ -148,16 +677,94 @@ class Extractor:
             (CONFIG_KEY_FILTER, filters),
         )
         
-        # Iterate over the call_order, and reduce from left to right
-        # to get the final result
-        result = url
+        steps = []
         for key, module in call_order:
-            if key in config:
+            if key in config and CONFIG_KEY_SEPARATOR in config[key]:
                 function, arg = config[key].split(CONFIG_KEY_SEPARATOR, 1)
-                if callable( getattr(module, function, None) ):
-                    result = getattr(module, function)(result, arg)
+                step = bind_step(module, function, arg, compile_args)
+                if step:
+                    steps.append(step)
+        
+        return ExtractionPlan(attribute, tuple(steps))
+    
+    def invoke_extraction_method(self, config, url):
+        """Invokes a list of functions and returns the final result
+        
+        Expects either a compiled ExtractionPlan, or the list of
+        functions in the following dict format
+        { # <key>    : <function_name>'.'<function_argument>,
+            'method' : 'microdata./properties/offers/0/properties/price/0',
+            'filter' : 'regex.(\\d+.\\d+)',
+        }
+        """
         
-        return isinstance(result, Resource) and result.url or result
+        # One-off configs are bound as-is, as compiling them wouldn't pay off
+        if not isinstance(config, ExtractionPlan):
+            config = self.compile_plan(None, config, compile_args=False)
+        
+        # Reduce the url through the plan's steps from left to right
+        # to get the final result
+        return config(url)
+
+
+
+# Extracts the products of platforms that need no page, see URL_WORKERS
+_url_pool = pool.ThreadPool(URL_WORKERS)
+
+# The Extractor of an extraction process, see Extractor.extract_parallel
+_process_extractor = None
+
+
+
+def _init_process(config_text):
+    """Compiles the config of an extraction process
+    
+    The process is forked while the parent's threads may hold locks
+    of shoplift's modules, eg. the scheduler's, which apply_limits
+    takes: the modules get fresh ones before the Extractor is built.
+    Ctrl-C is left to the parent, which terminates the pool.
+    """
+    
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from . import plan
+    web.after_fork()
+    plan.after_fork()
+    registry.after_fork()
+    amazon_api_scraper = sys.modules.get('shoplift.scrapers.amazon_api_scraper')
+    if amazon_api_scraper is not None:
+        amazon_api_scraper.after_fork()
+    
+    global _process_extractor
+    _process_extractor = Extractor(StringIO(config_text))
+
+
+def _extract_page(url, content, encoding):
+    """Extracts the product off a page fetched by the parent process
+    
+    Returns a (product, error) tuple, as the callbacks of a
+    multiprocessing.Pool never get the errors of a task.
+    """
+    
+    resource = Resource(url)
+    resource.response = web.build_response(url, content, encoding)
+    return _extract_url(resource)
+
+
+def _extract_url(url_or_resource):
+    """Extracts the product at a URL the parent process didn't fetch
+    
+    For platforms that need no page; returns a (product, error)
+    tuple, as _extract_page.
+    """
+    
+    try:
+        return _process_extractor.extract(url_or_resource), None
+    except Exception as e:
+        try:
+            pickle.dumps(e)
+        except Exception:
+            e = ExtractionException(repr(e))
+        return None, e
 
 
 
@@ -16,3 +16,8 @@ class ShopliftException(Exception):
 class ConfigDoesNotExistException(ShopliftException):
     """Raised when the specified configuration file path cannot be found"""
 
+class TimeoutException(ShopliftException):
+    """Raised when waiting on an asynchronous result takes too long"""
+
+class ExtractionException(ShopliftException):
+    """Stands in for an error of an extraction process that can't be pickled"""
@@ -1,7 +1,17 @@
 #!/usr/bin/env python
 # -*- coding: UTF-8 -*-
 
-import regex as regex_library
+# Filters are cheap to import, so they aren't imported lazily; the
+# regex library is only imported if chosen, see regex.use_engine
 
-from .regex import regex_filter as regex
-from .tuple import tuple_filter as tuple_filter
+from ..registry import Registry
+
+from .regex import regex_filter as regex, compile_pattern as compile_regex
+from .tuple import tuple_filter as tuple_filter, parse_index as compile_tuple
+
+# The tuple filter is looked up here, as filters.tuple is its submodule
+registry = Registry(__name__, 'shoplift.filters')
+registry.register('regex', '.regex', 'regex_filter')
+registry.register('compile_regex', '.regex', 'compile_pattern')
+registry.register('tuple', '.tuple', 'tuple_filter')
+registry.register('compile_tuple', '.tuple', 'parse_index')
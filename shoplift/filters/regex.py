@@ -1,20 +1,80 @@
 #!/usr/bin/env python
 # -*- coding: UTF-8 -*-
 
+from __future__ import absolute_import
+
 import re
 import sys
+import importlib
+
+from ..registry import declare, VALUE
+
+# Modules that can compile filter patterns, by name. The third-party
+# regex engine scans long strings faster, but is slower on short ones,
+# and takes longer to import than the rest of shoplift's filters: it's
+# only imported, and added here, once chosen
+ENGINES = {'re': re}
+OPTIONAL_ENGINES = ('regex',)
+
+# Engine compiling the patterns, see use_engine
+engine = re
+
+# Compiled patterns by engine & pattern string, cleared when full
+_patterns = {}
+MAX_PATTERNS = 1000
+
+def use_engine(name):
+    """Compiles patterns with the named engine from now on
+    
+    Patterns are compiled when a config is loaded, so the engine
+    must be chosen before. Raises KeyError if it's unavailable.
+    """
+    global engine
+    if name not in ENGINES and name in OPTIONAL_ENGINES:
+        try:
+            ENGINES[name] = importlib.import_module(name)
+        except ImportError:
+            pass
+    engine = ENGINES[name]
 
+def compile_pattern(pattern):
+    """Compiles a regex_filter pattern once, for reuse across strings"""
+    key = (engine.__name__, pattern)
+    try:
+        return _patterns[key]
+    except KeyError:
+        if len(_patterns) >= MAX_PATTERNS:
+            _patterns.clear()
+        compiled = _patterns[key] = engine.compile(pattern)
+        return compiled
+
+@declare(VALUE)
 def regex_filter(string, pattern):
-    """Returns the first pattern match in a string or None"""
+    """Returns the first pattern match in a string or None
+    
+    The pattern may be a string or a compiled regular expression
+    """
     
     try:
-        matches = re.search(pattern, string)
+        if not hasattr(pattern, 'search'):
+            pattern = compile_pattern(pattern)
+        matches = pattern.search(string)
         return matches and matches.group(1) or None
     except IndexError:
         return matches.group(0)
     except TypeError:
         return None
 
+def regex_filter_many(strings, pattern):
+    """Applies regex_filter to each string, compiling the pattern once"""
+    
+    try:
+        if not hasattr(pattern, 'search'):
+            pattern = compile_pattern(pattern)
+    except TypeError:
+        return [None for string in strings]
+    return [regex_filter(string, pattern) for string in strings]
+
 if __name__ == "__main__":
     string = sys.argv[1]
     pattern = sys.argv[2]
@@ -1,6 +1,13 @@
 #!/usr/bin/env python
 # -*- coding: UTF-8 -*-
 
+from ..registry import declare, VALUE
+
+def parse_index(index):
+    """Parses a tuple_filter index once, for reuse across tuples"""
+    return int(index)
+
+@declare(VALUE)
 def tuple_filter(tuple_obj, index):
     """Returns tuple value at the given index"""
     
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+shoplift.instrument
+-------------------
+
+Timed spans for the stages of an extraction
+
+An Extractor created with an observer reports a span for each stage
+of every extraction to observer.span(stage, seconds, platform,
+attribute). Spans are exclusive: the time a scraper spends waiting
+for the page to be fetched or parsed is reported as fetch & parse
+spans, not as part of the scrape span. Extractors without an
+observer skip the timing altogether.
+"""
+
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# Stages of an extraction
+ROUTE = 'route'
+FETCH = 'fetch'
+PARSE = 'parse'
+SCRAPE = 'scrape'
+FILTER = 'filter'
+STAGES = (ROUTE, FETCH, PARSE, SCRAPE, FILTER)
+
+# Upper bounds (in seconds) of the histogram buckets: 1us to ~67s
+BUCKETS = tuple(2 ** i / 1e6 for i in xrange(27))
+
+# The observed extraction running in each thread, if any
+_local = threading.local()
+
+
+
+class Observer(object):
+    """Receives the timed spans of extractions; does nothing by default"""
+    
+    def span(self, stage, seconds, platform=None, attribute=None):
+        pass
+
+
+
+class Histogram(object):
+    """Counts durations in exponentially sized buckets"""
+    
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+    
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+    
+    def percentile(self, p):
+        """Returns the upper bound of the bucket holding the p-th percentile"""
+        rank = p / 100.0 * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(i < len(BUCKETS) and BUCKETS[i] or self.max, self.max)
+        return 0.0
+    
+    @property
+    def stats(self):
+        """Get the count, total & mean seconds, with the p50, p99 and max"""
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.count and self.total / self.count or 0.0,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+
+
+class Aggregator(Observer):
+    """Keeps a histogram of the spans of each platform & stage"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+    
+    def span(self, stage, seconds, platform=None, attribute=None):
+        with self.lock:
+            key = (platform, stage)
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].add(seconds)
+    
+    def stats(self):
+        """Returns the histogram stats by platform, then stage"""
+        with self.lock:
+            stats = {}
+            for (platform, stage), histogram in self.histograms.iteritems():
+                stats.setdefault(platform, {})[stage] = histogram.stats
+            return stats
+    
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+    
+    def report(self):
+        """Returns a table of the stats, the most time consuming first"""
+        rows = sorted(
+            ((platform, stage, histogram.stats) for (platform, stage), histogram in self.histograms.items()),
+            key=lambda row: -row[2]['total']
+        )
+        lines = ['%-16s %-8s %8s %10s %10s %10s' % ('platform', 'stage', 'count', 'total s', 'p50 ms', 'p99 ms')]
+        for platform, stage, stats in rows:
+            lines.append('%-16s %-8s %8d %10.3f %10.3f %10.3f' % (
+                platform or '-', stage, stats['count'], stats['total'], stats['p50'] * 1000, stats['p99'] * 1000
+            ))
+        return '\n'.join(lines)
+
+
+
+class Context(object):
+    """Tags & timing state of an extraction, passed on to its observer"""
+    
+    __slots__ = ('observer', 'platform', 'attribute', 'nested')
+    
+    def __init__(self, observer, platform=None):
+        self.observer = observer
+        self.platform = platform
+        self.attribute = None
+        # Time spent in the spans nested in the current span
+        self.nested = 0.0
+    
+    def emit(self, stage, seconds):
+        if self.observer:
+            self.observer.span(stage, seconds, self.platform, self.attribute)
+
+
+
+class Span(object):
+    """Times a stage, excluding the time spent in nested spans"""
+    
+    __slots__ = ('context', 'stage', 'started', 'outer')
+    
+    def __init__(self, context, stage):
+        self.context = context
+        self.stage = stage
+    
+    def __enter__(self):
+        self.outer = self.context.nested
+        self.context.nested = 0.0
+        self.started = time.time()
+    
+    def __exit__(self, *exc_info):
+        elapsed = time.time() - self.started
+        self.context.emit(self.stage, elapsed - self.context.nested)
+        self.context.nested = self.outer + elapsed
+
+
+
+class NoSpan(object):
+    """Stands in for a Span when nothing is observed"""
+    
+    def __enter__(self):
+        pass
+    
+    def __exit__(self, *exc_info):
+        pass
+
+NO_SPAN = NoSpan()
+
+
+
+@contextmanager
+def observing(observer, platform=None):
+    """Reports the spans run in this thread to observer, if any
+    
+    Yields the Context of the extraction, whose platform & attribute
+    tags can be updated as the extraction goes on.
+    """
+    
+    context = Context(observer, platform)
+    if not observer:
+        yield context
+        return
+    
+    outer = getattr(_local, 'context', None)
+    _local.context = context
+    try:
+        yield context
+    finally:
+        _local.context = outer
+
+
+def span(stage):
+    """Returns a context manager timing stage for the thread's observer"""
+    
+    context = getattr(_local, 'context', None)
+    return context and Span(context, stage) or NO_SPAN
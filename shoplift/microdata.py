@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+shoplift.microdata
+------------------
+
+Reads microdata items off a parsed lxml document
+
+Items are built as the dicts of the microdata library's
+Item.json_dict(), so that paths like
+    /properties/offers/0/properties/price/0
+resolve the same way, but without parsing the page again with
+html5lib or serializing the items to JSON and back.
+"""
+
+from lxml import etree
+
+# Top-level items of a document: itemscopes outside of other itemscopes
+ITEMS_XPATH = etree.XPath('//*[@itemscope][not(ancestor::*[@itemscope])]')
+
+# Text content of an element, comments excluded
+TEXT_XPATH = etree.XPath('string()', smart_strings=False)
+
+# Elements whose property value is an attribute rather than their text
+PROPERTY_VALUES = {
+    'meta':     'content',
+    'audio':    'src',
+    'embed':    'src',
+    'iframe':   'src',
+    'img':      'src',
+    'source':   'src',
+    'video':    'src',
+    'a':        'href',
+    'area':     'href',
+    'link':     'href',
+    'object':   'data',
+    'time':     'datetime',
+}
+
+
+
+def get_items(tree):
+    """Returns the top-level microdata items of an lxml document
+    
+    Each item is a dict with its 'properties' by name, each a list
+    of strings and nested item dicts, along with its 'type' list &
+    'id' when the itemscope element declares them.
+    """
+    
+    return [get_item(element) for element in ITEMS_XPATH(tree)]
+
+
+def get_item(element, item=None):
+    """Returns the item of an itemscope element, with its properties
+    
+    Follows the microdata library: properties are looked up in the
+    descendants of the element, down to the nested itemscopes with
+    an itemprop, which are items of their own.
+    """
+    
+    if item is None:
+        item = {'properties': {}}
+        itemtype, itemid = element.get('itemtype'), element.get('itemid')
+        if itemtype:
+            item['type'] = itemtype.split(' ')
+        if itemid:
+            item['id'] = itemid
+    
+    for child in element.iterchildren(tag=etree.Element):
+        name = child.get('itemprop')
+        if name and child.get('itemscope') is not None:
+            item['properties'].setdefault(name, []).append(get_item(child))
+            continue
+        
+        if name:
+            item['properties'].setdefault(name, []).append(property_value(child))
+        get_item(child, item)
+    
+    return item
+
+
+def property_value(element):
+    """Returns the value of an itemprop element"""
+    
+    attribute = PROPERTY_VALUES.get(element.tag)
+    if attribute:
+        return element.get(attribute, '')
+    return TEXT_XPATH(element)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+shoplift.plan
+-------------
+
+Precompiled extraction plans for platform attributes
+"""
+
+import threading
+from collections import namedtuple
+
+from .web import Resource
+from .registry import LazyFunction, declared
+from . import instrument
+
+
+
+class ExtractionPlan(namedtuple('ExtractionPlan', ('attribute', 'steps'))):
+    """Immutable recipe to extract one attribute of a product
+    
+    `steps` is a tuple of (function, argument) pairs, e.g. a scraper
+    bound to a pre-parsed microdata path followed by a filter bound
+    to a compiled regex. Calling the plan with a Resource reduces
+    it through the steps from left to right, without any lookups
+    or string parsing. The first step is timed as the scrape stage,
+    and the others as the filter stage, when observed.
+    """
+    
+    __slots__ = ()
+    
+    def __call__(self, resource):
+        result = resource
+        stage = instrument.SCRAPE
+        for function, arg in self.steps:
+            with instrument.span(stage):
+                result = function(result, arg)
+            stage = instrument.FILTER
+        return isinstance(result, Resource) and result.url or result
+
+
+
+# Locks of the functions that aren't thread safe, see serialized
+_locks = {}
+_locks_lock = threading.Lock()
+
+def after_fork():
+    """Drops the locks held by the parent's threads, see web.after_fork"""
+    global _locks_lock
+    _locks_lock = threading.Lock()
+    _locks.clear()
+
+def lookup(module, name, discover=True):
+    """Returns the function of a scrapers/filters module named name, or None
+    
+    Attributes of the package take precedence, so that they can be
+    patched; functions shadowed by a submodule of the same name, or
+    not exposed as an attribute, are looked up in its registry, and
+    its plugins unless discover is False.
+    """
+    function = getattr(module, name, None)
+    if not callable(function):
+        registry = getattr(module, 'registry', None)
+        function = registry and registry.get(name, discover)
+    return function
+
+
+def serialized(function):
+    """Wraps a function that isn't thread safe to run one call at a time
+    
+    Calls are serialized across every plan the function is bound in.
+    The wrapper declares the same input as the function.
+    """
+    with _locks_lock:
+        lock = _locks.setdefault(function, threading.Lock())
+    
+    def call(*args):
+        with lock:
+            return function(*args)
+    
+    call.needs = declared(function)[0]
+    call.thread_safe = True
+    call.function = function
+    call.lock = lock
+    return call
+
+
+def bind_step(module, function, arg, compile_arg=True):
+    """Binds a function of a scrapers/filters module to its argument
+    
+    Returns a (function, argument) pair, or None if the module has
+    no such function. If the module also exposes 'compile_<function>',
+    it's used to pre-parse the argument. Arguments that fail to
+    compile are passed on as-is, and fail when the plan is called.
+    Lazily imported functions are loaded here, and bound as-is, and
+    functions that don't declare themselves thread safe are bound
+    serialized.
+    """
+    name = function
+    function = lookup(module, name)
+    if function is None:
+        return None
+    if isinstance(function, LazyFunction):
+        function = function.resolve()
+    if not declared(function)[1]:
+        function = serialized(function)
+    
+    # Plugins' compilers were registered when the function was discovered
+    compiler = compile_arg and lookup(module, 'compile_' + name, discover=False)
+    if compiler:
+        try:
+            arg = compiler(arg)
+        except Exception:
+            pass
+    
+    return (function, arg)
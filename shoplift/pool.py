@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+shoplift.pool
+-------------
+
+Thread pools & futures used for batch and asynchronous extraction
+"""
+
+import sys
+import threading
+import traceback
+import Queue
+
+from .exceptions import TimeoutException
+
+# Marks the end of the task & result streams
+_DONE = object()
+
+# Seconds to block on a queue before re-checking for cancellation
+POLL_INTERVAL = 0.1
+
+
+
+def _put(queue, item, stop):
+    """Puts item in the queue, giving up once stop is set
+    
+    Returns True if the item was queued
+    """
+    while not stop.is_set():
+        try:
+            queue.put(item, True, POLL_INTERVAL)
+            return True
+        except Queue.Full:
+            pass
+    return False
+
+
+
+def imap_unordered(function, iterable, workers=4):
+    """Applies function to every item of iterable over a pool of threads
+    
+    Yields (item, result, error) tuples in completion order, where
+    error is the exception raised by function(item), or None.
+    At most 2 * workers items are read ahead of the consumer, so
+    arbitrarily long (or lazy) iterables run in bounded memory.
+    Exceptions raised while iterating over iterable are re-raised
+    after all the items read so far have been yielded.
+    """
+    
+    workers = max(1, int(workers))
+    tasks = Queue.Queue(maxsize=workers * 2)
+    results = Queue.Queue(maxsize=workers * 2)
+    stop = threading.Event()
+    failure = []
+    
+    def feed():
+        try:
+            for item in iterable:
+                if not _put(tasks, item, stop):
+                    return
+        except Exception:
+            failure.append(sys.exc_info())
+        finally:
+            for x in xrange(workers):
+                _put(tasks, _DONE, stop)
+    
+    def work():
+        while True:
+            try:
+                item = tasks.get(True, POLL_INTERVAL)
+            except Queue.Empty:
+                if stop.is_set():
+                    return
+                continue
+            if item is _DONE:
+                break
+            try:
+                result = (item, function(item), None)
+            except Exception as e:
+                result = (item, None, e)
+            if not _put(results, result, stop):
+                return
+        _put(results, _DONE, stop)
+    
+    threads = [threading.Thread(target=feed)] + [threading.Thread(target=work) for x in xrange(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    
+    try:
+        running = workers
+        while running:
+            try:
+                result = results.get(True, POLL_INTERVAL)
+            except Queue.Empty:
+                continue
+            if result is _DONE:
+                running -= 1
+            else:
+                yield result
+    finally:
+        # Release the threads if the consumer stops early
+        stop.set()
+    
+    if failure:
+        exc_type, exc_value, exc_traceback = failure[0]
+        raise exc_type, exc_value, exc_traceback
+
+
+
+class Future(object):
+    """The eventual result of an asynchronous call"""
+    
+    def __init__(self):
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._result = None
+        self._error = None
+    
+    def done(self):
+        """Returns True once the result or error is set"""
+        return self._done.is_set()
+    
+    def result(self, timeout=None):
+        """Waits for & returns the result, or raises the call's error
+        
+        Raises TimeoutException if the result isn't ready in time
+        """
+        if not self._done.wait(timeout):
+            raise TimeoutException
+        if self._error is not None:
+            raise self._error
+        return self._result
+    
+    def exception(self, timeout=None):
+        """Waits for & returns the call's error, or None"""
+        if not self._done.wait(timeout):
+            raise TimeoutException
+        return self._error
+    
+    def add_done_callback(self, callback):
+        """Calls callback(future) once done, right away if already done
+        
+        Callbacks run in the thread that completes the future
+        """
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+    
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+    
+    def set_exception(self, error):
+        self._error = error
+        self._finish()
+    
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception:
+                # Report, like an uncaught error in a thread, and carry on
+                traceback.print_exc()
+
+
+
+class ThreadPool(object):
+    """A fixed set of daemon threads running submitted calls
+    
+    Calls are queued without bound, so submitting never blocks.
+    """
+    
+    def __init__(self, workers=32):
+        self.tasks = Queue.Queue()
+        self.threads = [threading.Thread(target=self.work) for x in xrange(max(1, int(workers)))]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+    
+    def submit(self, function, *args):
+        """Schedules function(*args), and returns a Future for its result"""
+        future = Future()
+        self.tasks.put((future, function, args))
+        return future
+    
+    def work(self):
+        while True:
+            future, function, args = self.tasks.get()
+            try:
+                result = function(*args)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+shoplift.registry
+-----------------
+
+Lazily imported scrapers & filters, and their plugins
+
+The scrapers and filters packages register their functions by name
+along with the module defining them, which is only imported when the
+function is first called or bound into an extraction plan. Importing
+shoplift hence doesn't import the dependencies of the scrapers and
+filters that the loaded platform configs don't use.
+
+Scrapers & filters of other distributions are registered through
+the 'shoplift.scrapers' & 'shoplift.filters' entry points, eg. in
+their setup.py:
+    entry_points={'shoplift.scrapers': ['jsonld = shoplift_jsonld:jsonld_extract']}
+and are then available to configs by name, as in `name = jsonld.name`.
+
+Each function declares the input it needs, see declare, so that the
+Extractor knows what of a page its platforms use.
+"""
+
+import sys
+import importlib
+import threading
+
+# Inputs scrapers & filters may need, see declare
+BYTES = 'bytes'             # the raw body of the page
+TREE = 'tree'               # the lxml tree of the page
+MICRODATA = 'microdata'     # the microdata items of the page
+OPENGRAPH = 'opengraph'     # the OpenGraph properties of the page
+URL = 'url'                 # only the URL, eg. to query an API
+VALUE = 'value'             # the value scraped by the previous step
+
+INPUTS = (BYTES, TREE, MICRODATA, OPENGRAPH, URL, VALUE)
+PAGE_INPUTS = (BYTES, TREE, MICRODATA, OPENGRAPH)
+
+
+
+class LazyFunction(object):
+    """Function of a module imported on first use
+    
+    Calling it imports the module, then calls the function; resolve()
+    returns the function itself, so that callers holding on to it
+    skip this indirection. `name` is the package attribute exposing it.
+    """
+    
+    _lock = threading.Lock()
+    
+    def __init__(self, package, module, function, name=None):
+        self.package = package
+        self.module = module
+        self.__name__ = function
+        self.name = name or function
+        self.function = None
+    
+    def resolve(self):
+        """Imports the module if need be, and returns the function"""
+        if self.function is None:
+            with self._lock:
+                if self.function is None:
+                    package = self.package and sys.modules[self.package]
+                    exposed = getattr(package, self.name, None) is self
+                    module = importlib.import_module(self.module, self.package)
+                    self.function = getattr(module, self.__name__)
+                    
+                    # Importing a submodule rebinds the package attribute
+                    # of the same name to it
+                    if exposed and getattr(package, self.name, None) is module:
+                        setattr(package, self.name, self)
+        return self.function
+    
+    def __call__(self, *args, **kwargs):
+        return (self.function or self.resolve())(*args, **kwargs)
+    
+    def __repr__(self):
+        return '<lazy %s:%s%s>' % (
+            self.module, self.__name__, self.function is None and ' (not loaded)' or ''
+        )
+
+
+
+class Registry(object):
+    """Functions of a package by name, see LazyFunction
+    
+    Lookups through the registry are unaffected by the package's
+    attributes, which importing a submodule of the same name as a
+    function (eg. filters.tuple) rebinds to the submodule. Names that
+    aren't registered are looked up in the `group` entry points.
+    """
+    
+    def __init__(self, package, group=None):
+        self.package = package
+        self.group = group
+        self.functions = {}
+        self.discovered = False
+    
+    def register(self, name, module, function):
+        """Registers function of module (relative to the package) as name
+        
+        Returns the LazyFunction, for the package to expose.
+        """
+        lazy = self.functions[name] = LazyFunction(self.package, module, function, name)
+        return lazy
+    
+    def get(self, name, discover=True):
+        """Returns the LazyFunction registered as name, or None
+        
+        Unless discover is False, the entry points are looked up
+        the first time a name isn't registered.
+        """
+        if discover and name not in self.functions and not self.discovered:
+            self.discover()
+        return self.functions.get(name)
+    
+    def discover(self):
+        """Registers the functions of the group's entry points
+        
+        Requires setuptools' pkg_resources, which is only imported
+        here as it takes a while. Plugins don't replace the functions
+        of the package, and their modules are imported when used.
+        """
+        self.discovered = True
+        if not self.group:
+            return
+        
+        try:
+            import pkg_resources
+        except ImportError:
+            return
+        
+        for entry_point in pkg_resources.iter_entry_points(self.group):
+            if entry_point.name not in self.functions and len(entry_point.attrs) == 1:
+                self.functions[entry_point.name] = LazyFunction(
+                    None, entry_point.module_name, entry_point.attrs[0], entry_point.name
+                )
+
+
+
+def after_fork():
+    """Drops the lock held by the parent's threads, see web.after_fork"""
+    LazyFunction._lock = threading.Lock()
+
+
+def declare(needs, thread_safe=True):
+    """Declares the input a scraper or filter needs, as a decorator
+    
+    needs is one of INPUTS. Functions that aren't thread_safe are
+    never run by two threads at once, see plan.bind_step.
+    """
+    if needs not in INPUTS:
+        raise ValueError('Unknown input: %r' % (needs,))
+    
+    def decorator(function):
+        function.needs = needs
+        function.thread_safe = thread_safe
+        return function
+    return decorator
+
+
+def declared(function):
+    """Returns the (needs, thread_safe) declared by a function
+    
+    Functions that declare nothing need an unknown input (None),
+    and aren't thread safe.
+    """
+    needs = getattr(function, 'needs', None)
+    return (
+        needs in INPUTS and needs or None,
+        getattr(function, 'thread_safe', False) is True,
+    )
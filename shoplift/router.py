@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+shoplift.router
+---------------
+
+Maps URLs to the platform configs that support them
+"""
+
+import re
+import urlparse
+
+# Trie key under which the platforms of a domain are stored
+_PLATFORMS = None
+
+
+
+def domain_labels(domain):
+    """Returns the labels of a domain name, top-level domain first"""
+    return domain.strip().strip('.').lower().split('.')[::-1]
+
+
+
+class Router(object):
+    """Finds the platform for a URL from its host & path
+    
+    Platform domains are stored in a trie keyed by their labels in
+    reverse order (com -> amazon -> www), and path patterns are
+    compiled once when a platform is added. A lookup walks at most
+    as many trie nodes as the host has labels, so its cost doesn't
+    grow with the number of platforms.
+    """
+    
+    def __init__(self):
+        self.trie = {}
+    
+    def add(self, name, domains, path):
+        """Adds a platform serving the given domains & path pattern
+        
+        The pattern may be compiled already. Returns the compiled
+        pattern, for routers of later versions of the config to
+        reuse. Platforms with an invalid path pattern can never
+        match, and are ignored.
+        """
+        try:
+            pattern = hasattr(path, 'search') and path or re.compile(path)
+        except re.error:
+            return None
+        
+        for domain in domains:
+            node = self.trie
+            for label in domain_labels(domain):
+                node = node.setdefault(label, {})
+            node.setdefault(_PLATFORMS, []).append((name, pattern))
+        return pattern
+    
+    def candidates(self, host):
+        """Returns the (name, pattern) of platforms serving the host
+        
+        Platforms of the most specific matching domain come first,
+        followed by the ones of its parent domains.
+        """
+        candidates = []
+        node = self.trie
+        for label in domain_labels(host):
+            node = node.get(label)
+            if node is None:
+                break
+            candidates[0:0] = node.get(_PLATFORMS, ())
+        return candidates
+    
+    def match(self, url):
+        """Returns the name of the first platform matching the URL, or None
+        
+        Expects a URL split by urlparse.urlsplit. The path pattern
+        is searched for in the URL from the path onwards.
+        """
+        candidates = self.candidates(url.hostname or '')
+        if candidates:
+            # Reconstruct the URL from the path onwards
+            path = urlparse.urlunsplit(('','') + tuple(url[2:]))
+            for name, pattern in candidates:
+                if pattern.search(path):
+                    return name
+        return None
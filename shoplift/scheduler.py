@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+shoplift.scheduler
+------------------
+
+Schedules page fetches politely over a shared pool of I/O threads
+"""
+
+import time
+import threading
+import urlparse
+from collections import deque
+
+from .pool import ThreadPool, Future
+from .router import domain_labels
+
+# Defaults for the number of I/O threads, concurrent fetches
+# per host and seconds to wait for a server to respond
+DEFAULT_WORKERS = 32
+DEFAULT_PER_HOST = 4
+DEFAULT_TIMEOUT = 30
+
+
+
+class HostQueue(object):
+    """Fetches waiting for a host (or domain), with its limits & metrics"""
+    
+    def __init__(self, concurrency, rate=None):
+        self.waiting = deque()
+        self.running = 0
+        self.next_start = 0
+        self.wakeup = None
+        self.fetched = 0
+        self.coalesced = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.set_limit(concurrency, rate)
+    
+    def set_limit(self, concurrency, rate=None):
+        self.concurrency = concurrency
+        # Seconds between the start of consecutive fetches
+        self.interval = rate and 1.0 / rate or 0
+    
+    @property
+    def stats(self):
+        """Get the queue depth, fetches in flight & the time fetches waited"""
+        return {
+            'queued': len(self.waiting),
+            'running': self.running,
+            'fetched': self.fetched,
+            'coalesced': self.coalesced,
+            'wait_total': self.wait_total,
+            'wait_max': self.wait_max,
+            'wait_mean': self.fetched and self.wait_total / self.fetched or 0.0,
+        }
+
+
+
+class HostScheduler(object):
+    """Runs fetches in the background, politely for each host
+    
+    Fetches are queued per host, or per domain for the hosts of a
+    domain limited by set_limit. Each queue starts at most
+    `concurrency` fetches at once, and at most `rate` per second;
+    further fetches wait without occupying a thread, so any number
+    can be in flight. Fetches go through the given requests session,
+    whose connection pools keep connections to each host warm.
+    
+    Fetches of a URL already queued or running with the same options
+    are coalesced: they share the Future of the fetch in flight
+    instead of sending a request of their own.
+    
+    The queue of a host without limits is dropped once it has no
+    fetch queued or running, so that the queues of the hosts of a
+    long job don't pile up.
+    """
+    
+    def __init__(self, session, workers=DEFAULT_WORKERS, per_host=DEFAULT_PER_HOST, timeout=DEFAULT_TIMEOUT):
+        self.session = session
+        self.per_host = per_host
+        self.timeout = timeout
+        self.pool = ThreadPool(workers)
+        self.lock = threading.Lock()
+        self.limits = {}
+        self.queues = {}
+        # Futures of the fetches queued or running, by flight_key
+        self.flights = {}
+    
+    def set_limit(self, domain, rate=None, concurrency=None):
+        """Limits the fetches for a domain & its subdomains
+        
+        rate is the maximum number of fetches started per second,
+        and concurrency the maximum number of fetches at once.
+        """
+        domain = '.'.join(reversed(domain_labels(domain)))
+        limit = (concurrency or self.per_host, rate)
+        with self.lock:
+            self.limits[domain] = limit
+            if domain in self.queues:
+                self.queues[domain].set_limit(*limit)
+    
+    def clear_limit(self, domain):
+        """Lifts the limits set for a domain by set_limit
+        
+        Later fetches are queued per host again. Fetches already
+        queued for the domain still go through its queue, at the
+        default concurrency & no rate limit.
+        """
+        domain = '.'.join(reversed(domain_labels(domain)))
+        with self.lock:
+            if self.limits.pop(domain, None) is None:
+                return
+            queue = self.queues.get(domain)
+            if queue is not None:
+                queue.set_limit(self.per_host)
+                queue.next_start = 0
+                if queue.waiting or queue.running:
+                    self.dispatch(domain)
+                else:
+                    del self.queues[domain]
+    
+    def queue_key(self, host):
+        """Returns the most specific limited domain of host, or host itself"""
+        labels = domain_labels(host or '')
+        for i in xrange(len(labels), 0, -1):
+            domain = '.'.join(reversed(labels[:i]))
+            if domain in self.limits:
+                return domain
+        return host
+    
+    def flight_key(self, url, timeout, options):
+        """Returns the key of the fetches that can share a single request"""
+        return (url, timeout, repr(sorted(options.iteritems())))
+    
+    def fetch(self, url, timeout=None, **options):
+        """Queues a fetch of url, and returns a Future for the response
+        
+        Extra options are passed on to the session's get method. If
+        the same fetch is already in flight, returns its Future.
+        """
+        
+        # Invalid URLs are queued too, and fail when fetched
+        host = isinstance(url, basestring) and urlparse.urlsplit(url).hostname or None
+        timeout = timeout or self.timeout
+        flight = self.flight_key(url, timeout, options)
+        
+        with self.lock:
+            key = self.queue_key(host)
+            if key not in self.queues:
+                self.queues[key] = HostQueue(*self.limits.get(key, (self.per_host, None)))
+            
+            future = self.flights.get(flight)
+            if future is not None:
+                self.queues[key].coalesced += 1
+                return future
+            
+            future = self.flights[flight] = Future()
+            self.queues[key].waiting.append((url, timeout, options, future, time.time()))
+            self.dispatch(key)
+        
+        return future
+    
+    def dispatch(self, key):
+        """Starts as many fetches of a queue as its limits allow
+        
+        Must be called with the lock held
+        """
+        queue = self.queues[key]
+        while queue.waiting and queue.running < queue.concurrency:
+            now = time.time()
+            if queue.next_start > now:
+                # Come back once the rate limit allows the next fetch
+                if not queue.wakeup:
+                    queue.wakeup = threading.Timer(queue.next_start - now, self.wake, (key,))
+                    queue.wakeup.daemon = True
+                    queue.wakeup.start()
+                return
+            
+            url, timeout, options, future, queued = queue.waiting.popleft()
+            queue.running += 1
+            queue.next_start = now + queue.interval
+            queue.wait_total += now - queued
+            queue.wait_max = max(queue.wait_max, now - queued)
+            self.pool.submit(self.run, key, url, timeout, options, future)
+    
+    def wake(self, key):
+        with self.lock:
+            if key in self.queues:
+                self.queues[key].wakeup = None
+                self.dispatch(key)
+    
+    def run(self, key, url, timeout, options, future):
+        """Fetches url into future, then lets the next fetch start"""
+        
+        try:
+            response, error = self.session.get(url, timeout=timeout, **options), None
+        except Exception as e:
+            response, error = None, e
+        
+        # Free the slot before running the future's callbacks
+        self.release(key, self.flight_key(url, timeout, options))
+        if error:
+            future.set_exception(error)
+        else:
+            future.set_result(response)
+    
+    def release(self, key, flight):
+        with self.lock:
+            # Later fetches of the URL get a request of their own
+            del self.flights[flight]
+            queue = self.queues[key]
+            queue.running -= 1
+            queue.fetched += 1
+            self.dispatch(key)
+            if not (queue.waiting or queue.running or key in self.limits):
+                del self.queues[key]
+    
+    def stats(self):
+        """Returns the metrics of every queue, by host or domain
+        
+        Hosts without limits are only reported while they have
+        fetches queued or running, see HostScheduler.
+        """
+        with self.lock:
+            return dict((key, queue.stats) for key, queue in self.queues.iteritems())
@@ -1,13 +1,19 @@
 #!/usr/bin/env python
 # -*- coding: UTF-8 -*-
 
-import microdata as microdata_library
-from microdata_scraper import microdata_extract as microdata
+# Scrapers are imported when first used, see shoplift.registry
 
-import opengraph as opengraph_library
-from opengraph_scraper import opengraph_extract as opengraph
+from ..registry import Registry
 
-from xpath_scraper import xpath_extract as xpath
-from amazon_api import amazon_api as amazon_api
+registry = Registry(__name__, 'shoplift.scrapers')
+
+microdata = registry.register('microdata', '.microdata_scraper', 'microdata_extract')
+compile_microdata = registry.register('compile_microdata', '.microdata_scraper', 'parse_itemprop')
+
+opengraph = registry.register('opengraph', '.opengraph_scraper', 'opengraph_extract')
+
+xpath = registry.register('xpath', '.xpath_scraper', 'xpath_extract')
+compile_xpath = registry.register('compile_xpath', '.xpath_scraper', 'compile_xpath')
+amazon_api = registry.register('amazon_api', '.amazon_api_scraper', 'amazon_api_extract')
 
 #__all__ = ["xpath", "opengraph", "amazon_api"]
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+Scrapes Amazon products off the Product Advertising API
+
+Products are looked up by the ASIN in their URL, through ItemLookup
+calls of up to BATCH_SIZE ASINs: the lookups of concurrent extractions
+started within BATCH_WINDOW seconds of each other share a call. Each
+product is memoized, so that the attributes of a product (title, price,
+image, ...) are all served by a single lookup.
+
+Requires python-amazon-simple-product-api, and the credentials of an
+Amazon Associates account in the AMAZON_ACCESS_KEY, AMAZON_SECRET_KEY
+& AMAZON_ASSOC_TAG environment variables.
+"""
+
+import os
+import re
+import sys
+import time
+import urlparse
+import threading
+
+try:
+    from amazon.api import AmazonAPI, AsinNotFound
+except ImportError:
+    AmazonAPI = None
+
+from ..web import Resource
+from ..pool import Future
+from ..registry import declare, URL
+from ..exceptions import ShopliftException
+
+# The ASIN in the path of a product's URL, eg. /dp/059035342X
+ASIN_PATH = re.compile(r'/(?:dp|gp/product|o/ASIN)/([A-Z0-9]{10})(?:[/?]|$)', re.I)
+
+# API regions by the domain of the store, others are looked up in the US
+REGIONS = {
+    'amazon.ca': 'CA', 'amazon.cn': 'CN', 'amazon.de': 'DE', 'amazon.es': 'ES',
+    'amazon.fr': 'FR', 'amazon.in': 'IN', 'amazon.it': 'IT', 'amazon.co.jp': 'JP',
+    'amazon.co.uk': 'UK', 'amazon.com': 'US',
+}
+DEFAULT_REGION = 'US'
+
+CREDENTIALS = ('AMAZON_ACCESS_KEY', 'AMAZON_SECRET_KEY', 'AMAZON_ASSOC_TAG')
+
+# ItemLookup takes up to 10 ASINs, and a lookup waits up to
+# BATCH_WINDOW seconds for others to share its call
+BATCH_SIZE = 10
+BATCH_WINDOW = 0.05
+
+# Products are memoized for PRODUCT_MAX_AGE seconds, up to MAX_PRODUCTS
+PRODUCT_MAX_AGE = 300
+MAX_PRODUCTS = 10000
+
+
+
+class AmazonAPIException(ShopliftException):
+    """Raised when the Product Advertising API can't be queried"""
+
+
+
+class ProductAPI(object):
+    """ItemLookup of a region through python-amazon-simple-product-api"""
+    
+    def __init__(self, region):
+        if AmazonAPI is None:
+            raise AmazonAPIException('amazon_api requires python-amazon-simple-product-api')
+        missing = [name for name in CREDENTIALS if not os.environ.get(name)]
+        if missing:
+            raise AmazonAPIException('Missing Amazon credentials: ' + ', '.join(missing))
+        self.api = AmazonAPI(*[os.environ[name] for name in CREDENTIALS], region=region)
+    
+    def lookup(self, asins):
+        """Returns the products found of a list of ASINs, by ASIN"""
+        try:
+            products = self.api.lookup(ItemId=','.join(asins))
+        except AsinNotFound:
+            return {}
+        if not isinstance(products, list):
+            products = [products]
+        return dict((product.asin, product) for product in products)
+
+
+
+class BatchLookup(object):
+    """Looks products up in batches, memoizing them
+    
+    `api` is an object whose lookup(asins) method returns the products
+    found, by ASIN. The first lookup of a batch waits `window` seconds
+    for others, unless `size` ASINs are pending before. Lookups of an
+    ASIN already pending share its batch.
+    """
+    
+    def __init__(self, api, size=BATCH_SIZE, window=BATCH_WINDOW):
+        self.api = api
+        self.size = size
+        self.window = window
+        self.lock = threading.Lock()
+        # Futures of the ASINs in flight, and of those not yet sent
+        self.futures = {}
+        self.pending = []
+        # (product, time looked up) by ASIN, None for products not found
+        self.products = {}
+        self.calls = 0
+    
+    def get(self, asin):
+        """Returns the product of an ASIN, or None if there's none"""
+        
+        batch = None
+        with self.lock:
+            memoized = self.products.get(asin)
+            if memoized and time.time() - memoized[1] < PRODUCT_MAX_AGE:
+                return memoized[0]
+            
+            future = self.futures.get(asin)
+            leader = False
+            if future is None:
+                future = self.futures[asin] = Future()
+                self.pending.append(asin)
+                if len(self.pending) >= self.size:
+                    batch, self.pending = self.pending, []
+                else:
+                    # The first lookup of a batch sends it when the window closes
+                    leader = len(self.pending) == 1
+        
+        if leader:
+            time.sleep(self.window)
+            with self.lock:
+                batch, self.pending = self.pending, []
+        if batch:
+            self.send(batch)
+        
+        return future.result()
+    
+    def send(self, batch):
+        """Looks a batch of ASINs up, and resolves their futures"""
+        
+        with self.lock:
+            self.calls += 1
+        try:
+            products = self.api.lookup(batch)
+        except Exception as e:
+            with self.lock:
+                futures = [self.futures.pop(asin) for asin in batch]
+            for future in futures:
+                future.set_exception(e)
+            return
+        
+        now = time.time()
+        with self.lock:
+            if len(self.products) + len(batch) > MAX_PRODUCTS:
+                self.products.clear()
+            futures = []
+            for asin in batch:
+                product = products.get(asin)
+                self.products[asin] = (product, now)
+                futures.append((self.futures.pop(asin), product))
+        for future, product in futures:
+            future.set_result(product)
+
+
+
+# Batched lookups by region, and how they're built, see use_api
+_lookups = {}
+_lookups_lock = threading.Lock()
+_api = (ProductAPI, BATCH_SIZE, BATCH_WINDOW)
+
+def use_api(factory, size=BATCH_SIZE, window=BATCH_WINDOW):
+    """Looks products up with factory(region).lookup(asins) from now on
+    
+    eg. to look them up in a stand-in for the API, in batches of up
+    to `size` ASINs. Products memoized so far are dropped.
+    """
+    global _api
+    with _lookups_lock:
+        _api = (factory, size, window)
+        _lookups.clear()
+
+def after_fork():
+    """Drops the lookups of the parent process, whose threads held their locks"""
+    global _lookups_lock
+    _lookups_lock = threading.Lock()
+    _lookups.clear()
+
+def get_lookup(region):
+    """Returns the BatchLookup of a region"""
+    with _lookups_lock:
+        if region not in _lookups:
+            factory, size, window = _api
+            _lookups[region] = BatchLookup(factory(region), size, window)
+        return _lookups[region]
+
+def get_asin(url):
+    """Returns the (ASIN, API region) of an Amazon product URL, or None"""
+    
+    if not isinstance(url, basestring):
+        return None
+    parts = urlparse.urlsplit(url)
+    match = ASIN_PATH.search(parts.path)
+    if not match:
+        return None
+    
+    host = parts.hostname or ''
+    region = DEFAULT_REGION
+    for domain, domain_region in REGIONS.iteritems():
+        if host == domain or host.endswith('.' + domain):
+            region = domain_region
+    return match.group(1).upper(), region
+
+@declare(URL)
+def amazon_api_extract(url_or_resource, attribute):
+    """Extracts an attribute of the Amazon product at a URL
+    
+    eg. 'title', 'price_and_currency' or 'large_image_url', see the
+    AmazonProduct of python-amazon-simple-product-api. Only the URL
+    is used: the page isn't fetched.
+    """
+    
+    url = isinstance(url_or_resource, Resource) and url_or_resource.url or url_or_resource
+    asin = get_asin(url)
+    if not asin or not attribute or attribute.startswith('_'):
+        return None
+    
+    product = get_lookup(asin[1]).get(asin[0])
+    value = getattr(product, attribute, None)
+    return not callable(value) and value or None
+
+
+
+if __name__ == "__main__" and len(sys.argv) >= 3:
+    url = sys.argv[1]
+    attribute = sys.argv[2]
+    print amazon_api_extract(url, attribute)
@@ -2,15 +2,32 @@
 # -*- coding: UTF-8 -*-
 
 import sys
+import lxml.etree
+from ..web import Resource
+from ..registry import declare, MICRODATA
+
+def parse_itemprop(itemprop):
+    """Splits an itemprop path into a tuple of keys & list indexes
+    
+    eg: '/properties/offers/0/properties/price/0' becomes
+        ('properties', 'offers', 0, 'properties', 'price', 0)
+    """
+    
+    itemprop_list = []
+    for tag in itemprop.split('/'):
+        # Removing empty keys
+        if not tag:
+            continue
+        try:
+            itemprop_list.append(int(tag))
+        except ValueError:
+            itemprop_list.append(tag)
+    
+    return tuple(itemprop_list)
 
-try:
-    from . import microdata_library
-except ValueError:
-    import microdata as microdata_library
 
-import json
-from ..web import Resource
 
+@declare(MICRODATA)
 def microdata_extract(url_or_resource, itemprop):
     """
     Extracts via microdata scraping
@@ -21,52 +38,31 @@ def microdata_extract(url_or_resource, itemprop):
     resource = isinstance(url_or_resource, Resource) and url_or_resource or Resource(url_or_resource)
     
     try:
-        # Calling get_contents to get the html contents
-        html_content = resource.get_contents_as_file()
-        items = microdata_library.get_items(html_content)
-    except ValueError:
+        # Use the microdata items read once per page off its lxml tree
+        items = resource.document.microdata
+    except (ValueError, lxml.etree.ParserError):
         return None
     
-    try:
-        # Getting json data from the html content
-        item = items[0]
-        
-        item_data = item.json()
-        json_item_data = json.loads(item_data)
+    # Accept pre-parsed paths as well as path strings
+    if not isinstance(itemprop, tuple):
         try:
-            itemprop = itemprop.split('/')
+            itemprop = parse_itemprop(itemprop)
         except AttributeError:
             return None
-        
-        # Removing empty lists
-        itemprop = [key for key in itemprop if key]
-        
-        itemprop_list = []
-        for tag in itemprop:
-            try:
-                tag = int(tag)
-                itemprop_list.append(tag)
-            except ValueError:
-                itemprop_list.append(tag)
-                pass
-        
-        try:
-            def f(iterable, key):
-                return iterable[key]
-            
-            #Reducing the json data to required value   
-            return reduce(f, itemprop_list, json_item_data)
-        except IndexError:
-            return None
-        except KeyError:
-            return None
     
-    # Exception incase there is no microdata in the html content
-    except IndexError:
+    try:
+        # Walking the first item's property tree down the path
+        value = items[0]
+        for key in itemprop:
+            value = value[key]
+        return value
+    
+    # Exception incase there is no microdata in the html content,
+    # or the path doesn't exist in it
+    except (IndexError, KeyError, TypeError):
         return None
 
 
-
 if __name__ == "__main__" and len(sys.argv) >= 3:
     url = sys.argv[1]
     itemprop = sys.argv[2]
@@ -5,22 +5,46 @@ import sys
 import lxml, lxml.html
 import requests
 from ..web import Resource
+from ..registry import declare, TREE
 
+# Compiled expressions by expression string, cleared when full
+_expressions = {}
+MAX_EXPRESSIONS = 1000
+
+def compile_xpath(xpath_str):
+    """Compiles an xpath_extract expression once, for reuse across pages
+    
+    Identical expressions share the compiled one. Raises XPathSyntaxError
+    if the expression is invalid.
+    """
+    try:
+        return _expressions[xpath_str]
+    except KeyError:
+        if len(_expressions) >= MAX_EXPRESSIONS:
+            _expressions.clear()
+        compiled = _expressions[xpath_str] = lxml.etree.XPath(xpath_str, smart_strings=False)
+        return compiled
+
+@declare(TREE)
 def xpath_extract(url_or_resource, xpath_str):
-    """Extracts via xpath scraping"""
+    """Extracts via xpath scraping
+    
+    The expression may be a string or compiled with compile_xpath.
+    It's evaluated once per page, see web.Document.xpath.
+    """
     
     resource = isinstance(url_or_resource, Resource) and url_or_resource or Resource(url_or_resource)
     
     # Exceptions catching for missing schema
     try:
-        page = resource.get_contents()
+        document = resource.document
     except requests.exceptions.MissingSchema:
         return None
-    tree = lxml.html.fromstring(page)
     
-    # Handling error in case the given xpath is invalid
+    # Handling error in case the given xpath is invalid. Plain strings
+    # are returned, as lxml's smart strings keep the whole tree alive
     try:
-        product_val = tree.xpath(xpath_str)
+        product_val = document.xpath(xpath_str)
         if isinstance(product_val, list) and len(product_val) <= 1:
             return len(product_val) and product_val[0] or None
         return product_val
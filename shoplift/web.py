@@ -3,33 +3,196 @@
 
 import sys
 import re
+import threading
 import urlparse
 
 import requests
-from cachecontrol import CacheControl
-from cachecontrol.caches import FileCache
+from cachecontrol.adapter import CacheControlAdapter
+
+import lxml, lxml.html
 
 try:
     from cStringIO import StringIO
 except:
     from StringIO import StringIO
 
-session = CacheControl(
-    requests.Session(),
-    cache = FileCache('.webcache')
+from .cache import build_cache
+from .scheduler import HostScheduler
+from .microdata import get_items
+from . import instrument
+
+# OpenGraph tags in the <head> of a page
+OPENGRAPH_XPATH = '//head//*[starts-with(@property, "og:")][@content]'
+
+# Pages are streamed in chunks of CHUNK_BYTES, and no more than
+# MAX_BODY_BYTES of a page's body are read by default
+CHUNK_BYTES = 16 * 1024
+MAX_BODY_BYTES = 4 * 1024 * 1024
+
+# The end of a page's <head>, split across at most HEAD_END_BYTES
+HEAD_END = re.compile(r'</head\s*>|<body[\s>]', re.I)
+HEAD_END_BYTES = 16
+
+# Query parameters only used to track visits, dropped off any URL
+TRACKING_PARAMS = re.compile(r'(?:utm_\w+|gclid|fbclid|dclid|mc_cid|mc_eid)$')
+
+# Guards the Documents shared by the Resources of a response
+_documents_lock = threading.Lock()
+
+# Sanitized URLs by URL, cleared when full
+_sanitized = {}
+MAX_SANITIZED_URLS = 10000
+
+# Validators of a page by name: the response header carrying it,
+# and the request header to revalidate the page with
+VALIDATORS = (
+    ('etag',            'ETag',             'If-None-Match'),
+    ('last_modified',   'Last-Modified',    'If-Modified-Since'),
 )
 
+# Number of hosts to keep connection pools for,
+# and of idle connections kept open per host
+POOL_HOSTS = 100
+POOL_CONNECTIONS = 32
+
+
+
+def read_body(response, max_bytes=MAX_BODY_BYTES, head_only=False):
+    """Streams the body of a response into response.content
+    
+    Stops reading once more than max_bytes have been read, or with
+    head_only, as soon as the end of the page's <head> is seen. The
+    connection of a response read partially is dropped, and
+    response.truncated is set; truncated bodies are never cached.
+    """
+    
+    chunks, size, tail = [], 0, ''
+    response.truncated = False
+    for chunk in response.iter_content(CHUNK_BYTES):
+        chunks.append(chunk)
+        size += len(chunk)
+        
+        if max_bytes and size > max_bytes or head_only and HEAD_END.search(tail + chunk):
+            response.truncated = True
+            response.raw.close()
+            break
+        tail = chunk[-HEAD_END_BYTES:]
+    
+    response._content = ''.join(chunks)[:max_bytes or None]
+    response._content_consumed = True
+    return response
+
+
+
+class Session(requests.Session):
+    """A requests session that can stream page bodies with a size cap"""
+    
+    def get(self, url, max_bytes=None, head_only=False, **kwargs):
+        """Sends a GET request, reading the body as read_body does"""
+        
+        if not (max_bytes or head_only):
+            return super(Session, self).get(url, **kwargs)
+        
+        kwargs['stream'] = True
+        return read_body(super(Session, self).get(url, **kwargs), max_bytes, head_only)
+
+
+
+session = Session()
+
+# All fetches are queued per host, and run by the scheduler
+scheduler = HostScheduler(session, workers=POOL_CONNECTIONS)
+
+
+
+def mount_cache(cache):
+    """Mounts a caching adapter with a warm connection pool per host on the session"""
+    
+    adapter = CacheControlAdapter(cache, pool_connections=POOL_HOSTS, pool_maxsize=POOL_CONNECTIONS)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+
+def configure_cache(**options):
+    """Replaces the cache stack of the web session
+    
+    Accepts the options of shoplift.cache.build_cache, eg:
+        configure_cache(backend='sqlite', location='web.db', memory_bytes=2**26, ttl=600)
+    and returns the new cache
+    """
+    
+    cache = build_cache(**options)
+    mount_cache(cache)
+    return cache
+
+
+def cache_stats():
+    """Returns the hit/miss/eviction counters of the session's cache"""
+    
+    cache = session.get_adapter('http://').cache
+    return getattr(cache, 'stats', {})
+
+
+def fetch_stats():
+    """Returns the queue depth & wait time metrics of the scheduler, per host"""
+    
+    return scheduler.stats()
+
+
+# Cache responses in memory, in front of the .webcache directory
+mount_cache(build_cache(backend='file', location='.webcache'))
+
+
+def after_fork():
+    """Gives a forked process a session & scheduler of its own
+    
+    The parent's threads aren't forked along, so the locks they held
+    at the time, eg. the scheduler's, would never be released in the
+    child. The new session caches responses in memory only.
+    """
+    
+    global session, scheduler, _documents_lock
+    _documents_lock = threading.Lock()
+    session = Session()
+    scheduler = HostScheduler(session, workers=POOL_CONNECTIONS)
+    mount_cache(build_cache(backend=None))
+
+
+
+def build_response(url, content, encoding=None):
+    """Builds the response of a page downloaded elsewhere, from its body"""
+    
+    response = requests.Response()
+    response.url = url
+    response.status_code = 200
+    response.encoding = encoding
+    response._content = content
+    response._content_consumed = True
+    return response
+
 
 
 def sanitize_url(url):
     """Returns a sanitized and normalized version of the URL passed
     
-    Adds missing scheme, lowercases the scheme and domain,
-    and strips surrounding whitespace.
+    Adds missing scheme, lowercases the scheme and domain, strips
+    surrounding whitespace & the fragment, and sorts the query
+    parameters. URLs are sanitized once, then memoized.
     """
-    # TODO: strip fragment
-    # TODO: canonical (sorted) query params
     
+    try:
+        return _sanitized[url]
+    except KeyError:
+        pass
+    
+    sanitized = _sanitize_url(url)
+    if len(_sanitized) >= MAX_SANITIZED_URLS:
+        _sanitized.clear()
+    _sanitized[url] = sanitized
+    return sanitized
+
+
+def _sanitize_url(url):
     # Remove whitespaces
     url = str(url).strip()
     
@@ -48,18 +211,181 @@ def sanitize_url(url):
         url = 'http://' + url.lstrip(':/')
         parsed = urlparse.urlsplit(url)
     
-    # Lowercase scheme + domain
-    parsed = list(parsed)
-    parsed = map(str.lower, parsed[0:2]) + parsed[2:]
-    url = urlparse.urlunsplit(parsed)
+    # Lowercase scheme + domain, sort the query params, drop the fragment
+    scheme, netloc, path, query, fragment = parsed
+    query = '&'.join(sorted(param for param in query.split('&') if param))
+    url = urlparse.urlunsplit((scheme.lower(), netloc.lower(), path, query, ''))
     
     return url
 
 
+def canonical_url(url, drop_params=None):
+    """Returns a sanitized URL without its tracking query parameters
+    
+    Drops the TRACKING_PARAMS, and the params whose whole name
+    matches the drop_params pattern, if any.
+    """
+    
+    scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
+    if not query:
+        return url
+    
+    params = []
+    for param in query.split('&'):
+        name = param.split('=', 1)[0]
+        if not (TRACKING_PARAMS.match(name) or drop_params and drop_params.match(name)):
+            params.append(param)
+    return urlparse.urlunsplit((scheme, netloc, path, '&'.join(params), ''))
+
+
+def reduce_url(url, pattern):
+    """Reduces a URL to its host and the part matching pattern, or None
+    
+    The pattern is searched for in the URL from the path onwards;
+    its first group, or the whole match, makes up the reduced path.
+    eg. (/dp/\w+) reduces http://amazon.in/Kindle/dp/B00KDRTG8M/ref=sr_1
+    to http://amazon.in/dp/B00KDRTG8M
+    """
+    
+    scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
+    match = pattern.search(urlparse.urlunsplit(('', '', path, query, '')))
+    if not match:
+        return None
+    return urlparse.urlunsplit((scheme, netloc, '', '', '')) + (match.groups() and match.group(1) or match.group(0))
+
+
+
+def get_validators(response):
+    """Returns the validators of a response by name, see VALIDATORS"""
+    return dict(
+        (name, response.headers[header])
+        for name, header, request_header in VALIDATORS
+        if response.headers.get(header)
+    )
+
+
+def conditional_headers(validators):
+    """Returns the request headers to revalidate a page with its validators
+    
+    The request also asks caches on the way, including the session's
+    own HTTP cache, to revalidate the page rather than serve it fresh.
+    """
+    headers = {'Cache-Control': 'max-age=0'}
+    for name, header, request_header in VALIDATORS:
+        if validators.get(name):
+            headers[request_header] = validators[name]
+    return headers
+
+
+
+class Document(object):
+    """Parsed representations of a web page's contents
+    
+    Each representation (lxml tree, microdata items, OpenGraph dict)
+    is built on first access and memoized, so that every scraper
+    invoked for the same page shares a single parse, as are the
+    results of XPath expressions over the tree. Building is
+    serialized by a lock, so a Document can be shared by threads.
+    The contents are dropped once parsed into the tree.
+    """
+    
+    def __init__(self, contents):
+        self.contents = contents
+        # Number of full-document parses performed so far
+        self.parse_count = 0
+        self.lock = threading.RLock()
+        # Results of the XPath expressions evaluated, by expression
+        self.xpath_results = {}
+    
+    def parse(self, parser, *args):
+        """Run a parser over the contents and count the parse"""
+        self.parse_count += 1
+        with instrument.span(instrument.PARSE):
+            return parser(*args)
+    
+    @property
+    def tree(self):
+        """Get the lxml element tree of the document"""
+        with self.lock:
+            if not hasattr(self, '_tree'):
+                self._tree = self.parse(lxml.html.fromstring, self.contents)
+                self.contents = None
+        return self._tree
+    
+    @property
+    def microdata(self):
+        """Get the list of microdata items found in the document
+        
+        Items are read off the lxml tree, as dicts of their properties,
+        see shoplift.microdata
+        """
+        with self.lock:
+            if not hasattr(self, '_microdata'):
+                tree = self.tree
+                with instrument.span(instrument.PARSE):
+                    self._microdata = get_items(tree)
+        return self._microdata
+    
+    @property
+    def opengraph(self):
+        """Get the dict of OpenGraph properties found in the document
+        
+        Read off the og:* tags in the <head> of the lxml tree, eg:
+            <meta property="og:title" content="..." /> becomes 'title'
+        """
+        with self.lock:
+            if not hasattr(self, '_opengraph'):
+                self._opengraph = dict(
+                    (tag.get('property')[3:], tag.get('content'))
+                    for tag in self.tree.xpath(OPENGRAPH_XPATH)
+                )
+        return self._opengraph
+    
+    def xpath(self, expression):
+        """Get the results of an XPath expression over the lxml tree
+        
+        The expression may be a string or a compiled lxml.etree.XPath.
+        Each expression is evaluated once per document, so that the
+        attributes scraped with the same expression share its results.
+        Lists of results are copied, for callers to own. Strings are
+        returned as plain strings, not smart strings.
+        """
+        tree = self.tree
+        key = getattr(expression, 'path', expression)
+        with self.lock:
+            if key not in self.xpath_results:
+                if isinstance(expression, basestring):
+                    results = tree.xpath(expression, smart_strings=False)
+                else:
+                    results = expression(tree)
+                self.xpath_results[key] = results
+            results = self.xpath_results[key]
+        
+        if isinstance(results, list):
+            return list(results)
+        return results
+
+
 
 class Resource(object):
+    """A web page, fetched & parsed on first use
+    
+    The response (whose body is kept as bytes, and only decoded to
+    be parsed) and the parsed Document live as long as the resource,
+    unless it's released, see release.
+    """
+    
+    __slots__ = ('_lock', 'fetch_options', 'previous_validators', '_url', '_response', '_document')
     
-    def __init__(self, url):
+    def __init__(self, url, max_bytes=MAX_BODY_BYTES, head_only=False, validators=None):
+        # Guards the lazy fetch & parse, for resources shared by threads
+        self._lock = threading.RLock()
+        # Limits on how much of the page is downloaded, see read_body
+        self.fetch_options = {'max_bytes': max_bytes, 'head_only': head_only}
+        # Validators of an earlier fetch of the page, see unchanged
+        self.previous_validators = validators or {}
+        if validators:
+            self.fetch_options['headers'] = conditional_headers(validators)
         self.url = url
     
     @property
@@ -79,27 +405,148 @@ class Resource(object):
     @property
     def response(self):
         """Get the request.Response object for the resource"""
-        if not hasattr(self, '_response') or not self._response:
-            self._response = session.get(self.url)
+        with self._lock:
+            # Not `not self._response`: 304 & other error responses are falsy
+            if getattr(self, '_response', None) is None:
+                self._response = self.fetch()
         return self._response
     
     @response.setter
     def response(self, new_response):
         """Set the resource's response object"""
         self._response = new_response
+        del self.document
     
     @response.deleter
     def response(self):
         """Reset the response object"""
         if hasattr(self, '_response'):
             del self._response
+        del self.document
+    
+    @property
+    def document(self):
+        """Get the memoized, parsed Document for the resource's contents
+        
+        The Document is kept on the response, so the Resources of a
+        response, eg. the ones whose fetches were coalesced by the
+        scheduler, share a single parse of the page.
+        """
+        with self._lock:
+            if not hasattr(self, '_document'):
+                response = self.response
+                with _documents_lock:
+                    document = response.__dict__.get('document')
+                    if document is None:
+                        document = response.document = Document(self.get_contents())
+                self._document = document
+        return self._document
+    
+    @document.deleter
+    def document(self):
+        """Reset the parsed document"""
+        if hasattr(self, '_document'):
+            del self._document
+    
+    @property
+    def validators(self):
+        """Get the ETag & Last-Modified validators of the response"""
+        return get_validators(self.response)
+    
+    @property
+    def unchanged(self):
+        """Whether the page is unchanged since the validators it was created with
+        
+        True if the server answered 304 Not Modified, or with the same
+        validators, as the HTTP cache does once it has revalidated a
+        cached page: the same ETag if both have one, or else the same
+        values of every validator both have. Always False for resources
+        without validators.
+        """
+        if not self.previous_validators:
+            return False
+        if self.response.status_code == 304:
+            return True
+        
+        validators = self.validators
+        if 'etag' in validators and 'etag' in self.previous_validators:
+            return validators['etag'] == self.previous_validators['etag']
+        shared = set(validators) & set(self.previous_validators)
+        return bool(shared) and all(validators[name] == self.previous_validators[name] for name in shared)
+    
+    def fetch(self):
+        """Fetch and return the response for the resource's URL
+        
+        Waits for the fetch to be run by the scheduler
+        """
+        with instrument.span(instrument.FETCH):
+            return scheduler.fetch(self.url, **self.fetch_options).result()
     
     def get_contents(self):
         return self.response.text
     
     def get_contents_as_file(self):
-        return StringIO(self.get_contents())
+        """Returns a file-like object over the page's bytes, without copying them"""
+        return StringIO(self.response.content)
+    
+    def release(self):
+        """Drops the resource's references to its response & parsed document
+        
+        Frees the page's body & tree as soon as scraping is done,
+        rather than whenever the resource is garbage collected, unless
+        other resources share the response: the Document kept on it
+        is freed along with the response, once the last one lets go.
+        The page is fetched again if the resource is used after.
+        Resources are released on leaving a `with` block as well.
+        """
+        with self._lock:
+            del self.response
     
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+
+class AsyncResource(Resource):
+    """A Resource whose page is fetched in the background
+    
+    The fetch is started through the shared scheduler as soon as
+    the resource is created, and `future` completes with the
+    response. The blocking API (response, document, ...) stays
+    available, and waits for the fetch to finish.
+    """
+    
+    __slots__ = ('timeout', '_future', '_future_url')
+    
+    def __init__(self, url, timeout=None, **fetch_options):
+        self.timeout = timeout
+        super(AsyncResource, self).__init__(url, **fetch_options)
+        # Start fetching right away
+        self.future
+    
+    @property
+    def future(self):
+        """Get the Future of the response for the resource's current URL"""
+        with self._lock:
+            if getattr(self, '_future_url', None) != self.url or not hasattr(self, '_future'):
+                self._future = scheduler.fetch(self.url, self.timeout, **self.fetch_options)
+                self._future_url = self.url
+        return self._future
+    
+    def fetch(self):
+        """Wait for and return the response fetched in the background"""
+        return self.future.result()
+    
+    def release(self):
+        """Drops the response & parsed document, along with the fetch's Future"""
+        with self._lock:
+            super(AsyncResource, self).release()
+            if hasattr(self, '_future'):
+                del self._future, self._future_url
+
 
 if __name__ == "__main__":
    url = sys.argv[1]
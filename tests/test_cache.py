@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+'''Unit tests for shoplift.cache'''
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from shoplift.cache import MemoryCache, SQLiteCache, LayeredCache, ResultCache, build_cache
+from shoplift import web
+
+
+
+class TestMemoryCache(unittest.TestCase):
+    
+    def testGetSet(self):
+        """Values should be returned until deleted"""
+        cache = MemoryCache()
+        self.assertIsNone(cache.get('a'))
+        cache.set('a', 'abc')
+        self.assertEqual(cache.get('a'), 'abc')
+        cache.delete('a')
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats, {
+            'hits': 1, 'misses': 2, 'evictions': 0, 'expirations': 0,
+            'entries': 0, 'bytes': 0,
+        })
+    
+    def testByteSizeCap(self):
+        """Least recently used values should be evicted to honour max_bytes"""
+        cache = MemoryCache(max_bytes=10)
+        cache.set('a', 'xxxx')
+        cache.set('b', 'xxxx')
+        cache.get('a')
+        cache.set('c', 'xxxx')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 'xxxx')
+        self.assertEqual(cache.get('c'), 'xxxx')
+        self.assertEqual(cache.stats['evictions'], 1)
+        self.assertEqual(cache.stats['bytes'], 8)
+        
+        # Values larger than the cache are never stored
+        cache.set('d', 'x' * 11)
+        self.assertIsNone(cache.get('d'))
+        self.assertEqual(cache.stats['entries'], 2)
+    
+    def testOverwrite(self):
+        """Overwriting a key should account for the new value's size only"""
+        cache = MemoryCache(max_bytes=10)
+        cache.set('a', 'xxxxxx')
+        cache.set('a', 'xx')
+        self.assertEqual(cache.stats['bytes'], 2)
+    
+    def testTTL(self):
+        """Values older than the ttl should expire"""
+        cache = MemoryCache(ttl=0.05)
+        cache.set('a', 'abc')
+        self.assertEqual(cache.get('a'), 'abc')
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats['expirations'], 1)
+        self.assertEqual(cache.stats['bytes'], 0)
+
+
+
+class TestPersistentCaches(unittest.TestCase):
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    def testSQLiteCache(self):
+        """SQLiteCache should persist binary values across instances"""
+        path = os.path.join(self.directory, 'web.db')
+        value = '\x00\xffbinary'
+        SQLiteCache(path).set('http://example.com', value)
+        
+        cache = SQLiteCache(path)
+        self.assertEqual(cache.get('http://example.com'), value)
+        cache.delete('http://example.com')
+        self.assertIsNone(cache.get('http://example.com'))
+    
+    def testResultCache(self):
+        """ResultCache should only hit for the same URL, config & body"""
+        path = os.path.join(self.directory, 'results.db')
+        product = {'name': u'Hobbit', 'price': u'250'}
+        ResultCache(path).set(('http://example.com/p/1', 'config', 'body'), product)
+        
+        cache = ResultCache(path)
+        self.assertEqual(cache.stats['entries'], 1)
+        self.assertEqual(cache.get(('http://example.com/p/1', 'config', 'body')), product)
+        self.assertIsNone(cache.get(('http://example.com/p/1', 'config', 'changed body')))
+        self.assertIsNone(cache.get(('http://example.com/p/1', 'changed config', 'body')))
+        self.assertEqual((cache.stats['hits'], cache.stats['misses']), (1, 2))
+        
+        # A new body replaces the product of the old one
+        cache.set(('http://example.com/p/1', 'config', 'changed body'), {'name': u'Silmarillion'})
+        self.assertEqual(cache.stats['entries'], 1)
+        self.assertIsNone(cache.get(('http://example.com/p/1', 'config', 'body')))
+        cache.clear()
+        self.assertEqual(cache.stats['entries'], 0)
+        
+        # Products that aren't JSON serializable aren't stored
+        self.assertFalse(cache.set(('http://example.com/p/1', 'config', 'body'), {'name': object()}))
+        self.assertEqual(cache.stats['entries'], 0)
+    
+    def testResultCacheEviction(self):
+        """ResultCache should evict the least recently used products"""
+        cache = ResultCache(os.path.join(self.directory, 'results.db'), max_entries=2)
+        cache.set(('a', 'config', 'body'), {'name': 'a'})
+        time.sleep(0.01)
+        cache.set(('b', 'config', 'body'), {'name': 'b'})
+        time.sleep(0.01)
+        cache.get(('a', 'config', 'body'))
+        cache.set(('c', 'config', 'body'), {'name': 'c'})
+        
+        self.assertEqual(cache.stats['evictions'], 1)
+        self.assertEqual(cache.stats['entries'], 2)
+        self.assertIsNone(cache.get(('b', 'config', 'body')))
+        self.assertEqual(cache.get(('a', 'config', 'body')), {'name': 'a'})
+    
+    def testLayeredCache(self):
+        """Backend hits should be promoted to the front cache"""
+        backend = SQLiteCache(os.path.join(self.directory, 'web.db'))
+        backend.set('a', 'abc')
+        cache = LayeredCache(MemoryCache(), backend)
+        
+        self.assertEqual(cache.get('a'), 'abc')
+        self.assertEqual(cache.get('a'), 'abc')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.front.get('a'), 'abc')
+        
+        stats = cache.stats
+        self.assertEqual(stats['backend_hits'], 1)
+        self.assertEqual(stats['backend_misses'], 1)
+        self.assertEqual(stats['hits'], 2)
+        
+        cache.set('c', 'xyz')
+        self.assertEqual(backend.get('c'), 'xyz')
+        cache.delete('c')
+        self.assertIsNone(backend.get('c'))
+        # Deleting keys the backend doesn't have is fine
+        cache.delete('missing')
+    
+    def testBuildCache(self):
+        """build_cache should stack the configured layers"""
+        location = os.path.join(self.directory, 'web.db')
+        
+        cache = build_cache(backend='sqlite', location=location, memory_bytes=100, ttl=5)
+        self.assertIsInstance(cache, LayeredCache)
+        self.assertIsInstance(cache.backend, SQLiteCache)
+        self.assertEqual((cache.front.max_bytes, cache.front.ttl), (100, 5))
+        
+        self.assertIsInstance(build_cache(backend='sqlite', location=location, memory_bytes=0), SQLiteCache)
+        self.assertIsInstance(build_cache(backend=None), MemoryCache)
+        self.assertRaises(KeyError, build_cache, backend='memcached')
+    
+    def testConfigureSession(self):
+        """configure_cache should swap the web session's cache"""
+        original = web.session.get_adapter('http://').cache
+        try:
+            cache = web.configure_cache(backend=None, memory_bytes=100)
+            self.assertIs(web.session.get_adapter('https://').cache, cache)
+            cache.set('a', 'abc')
+            cache.get('a')
+            self.assertEqual(web.cache_stats()['hits'], 1)
+        finally:
+            web.mount_cache(original)
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+'''Unit tests for shoplift.cli'''
+
+import os
+import json
+import thread
+import shutil
+import tempfile
+import unittest
+import threading
+from textwrap import dedent
+
+from mock import MagicMock, patch
+
+from shoplift.cli import Progress, main
+from shoplift.pool import Future
+
+
+
+class TestProgress(unittest.TestCase):
+    
+    def testOutOfOrder(self):
+        """Only the leading lines all handled should count as done"""
+        progress = Progress()
+        urls = list(progress.urls(['http://a.com/1\n', '\n', 'http://a.com/2\n', 'http://a.com/1\n']))
+        self.assertEqual(urls, ['http://a.com/1', 'http://a.com/2', 'http://a.com/1'])
+        
+        progress.extracted_url('http://a.com/2')
+        self.assertEqual(progress.lines, 0)
+        progress.extracted_url('http://a.com/1', error=True)
+        self.assertEqual(progress.lines, 3)
+        progress.extracted_url('http://a.com/1')
+        self.assertEqual(progress.lines, 4)
+        self.assertEqual((progress.extracted, progress.errors, progress.pending), (3, 1, {}))
+        
+        # Lines handled before resuming are skipped
+        progress = Progress(1, [2])
+        self.assertEqual(list(progress.urls(['http://a.com/1\n', '\n', 'http://a.com/2\n', 'http://a.com/3\n'])), ['http://a.com/3'])
+        self.assertEqual(progress.lines, 3)
+
+
+
+class TestMain(unittest.TestCase):
+    
+    config = dedent("""
+        [example]
+        url.domains    = example.com
+        url.path       = /p/.*
+        name           = xpath.//h1//text()
+    """)
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = lambda name: os.path.join(self.directory, name)
+        with open(self.path('config.ini'), 'w') as config:
+            config.write(self.config)
+        with open(self.path('urls.txt'), 'w') as urls:
+            urls.write('http://example.com/p/1\n\nhttp://example.org/p/2\nhttp://example.com/p/broken\n')
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    def fetch(self, url, timeout=None, **options):
+        future = MagicMock()
+        if 'broken' in url:
+            future.result.side_effect = IOError('unreachable')
+        else:
+            future.result.return_value = MagicMock(text='<html><h1>Item %s</h1></html>' % url[-1])
+        return future
+    
+    def run_main(self, *args):
+        with patch('shoplift.web.scheduler') as scheduler:
+            scheduler.fetch.side_effect = self.fetch
+            status = main(['-c', self.path('config.ini'), '-o', self.path('out.jsonl')] + list(args))
+        with open(self.path('out.jsonl')) as output:
+            return status, dict((result['url'], result) for result in map(json.loads, output))
+    
+    def testJSONLines(self):
+        """Every URL should get a line with its product or error"""
+        status, results = self.run_main('-w', '2', '--checkpoint', self.path('job.json'), self.path('urls.txt'))
+        self.assertEqual(status, 0)
+        self.assertEqual(results, {
+            'http://example.com/p/1': {'url': 'http://example.com/p/1', 'product': {'url': 'http://example.com/p/1', 'name': 'Item 1'}},
+            'http://example.org/p/2': {'url': 'http://example.org/p/2', 'product': {}},
+            'http://example.com/p/broken': {'url': 'http://example.com/p/broken', 'error': 'IOError: unreachable'},
+        })
+        with open(self.path('job.json')) as checkpoint:
+            saved = json.load(checkpoint)
+        self.assertEqual(saved, {'lines': 4, 'handled': [], 'extracted': 3, 'errors': 1, 'output': saved['output']})
+        self.assertEqual(saved['output'], os.path.getsize(self.path('out.jsonl')))
+    
+    def testResume(self):
+        """Resumed jobs should skip the lines handled, and append to the output"""
+        with open(self.path('out.jsonl'), 'w') as output:
+            output.write('{"url": "http://example.com/p/1", "product": {}}\n')
+        with open(self.path('job.json'), 'w') as checkpoint:
+            json.dump({'lines': 3}, checkpoint)
+        
+        status, results = self.run_main('--checkpoint', self.path('job.json'), '--resume', self.path('urls.txt'))
+        self.assertEqual(sorted(results), ['http://example.com/p/1', 'http://example.com/p/broken'])
+        self.assertEqual(results['http://example.com/p/1']['product'], {})
+        with open(self.path('job.json')) as checkpoint:
+            self.assertEqual(json.load(checkpoint)['lines'], 4)
+    
+    def testResumeOutOfOrder(self):
+        """Resumed jobs should skip the lines handled out of order, and drop the results after the checkpoint"""
+        handled = '{"url": "http://example.org/p/2", "product": {}}\n'
+        with open(self.path('out.jsonl'), 'w') as output:
+            output.write(handled + '{"url": "http://example.com/p/broken", "error": "stale"}\n')
+        with open(self.path('job.json'), 'w') as checkpoint:
+            json.dump({'lines': 0, 'handled': [2], 'output': len(handled)}, checkpoint)
+        
+        status, results = self.run_main('--checkpoint', self.path('job.json'), '--resume', self.path('urls.txt'))
+        with open(self.path('out.jsonl')) as output:
+            self.assertEqual(len(output.readlines()), 3)
+        self.assertEqual(results['http://example.com/p/broken']['error'], 'IOError: unreachable')
+        self.assertEqual(results['http://example.com/p/1']['product']['name'], 'Item 1')
+        with open(self.path('job.json')) as checkpoint:
+            self.assertEqual(json.load(checkpoint)['lines'], 4)
+    
+    def testInterruptProcesses(self):
+        """Interrupted --processes jobs should exit with 130 and checkpoint what they wrote"""
+        with open(self.path('urls.txt'), 'w') as urls:
+            urls.write('http://example.com/p/1\nhttp://example.com/p/hang\n')
+        
+        def fetch(url, timeout=None, **options):
+            future = Future()
+            if 'hang' in url:
+                # Ctrl-C while the job waits for a page that never arrives
+                threading.Timer(0.2, thread.interrupt_main).start()
+            else:
+                future.set_result(MagicMock(content='<html><h1>Item %s</h1></html>' % url[-1], encoding='utf-8'))
+            return future
+        self.fetch = fetch
+        
+        # One URL at a time, so that the first one is written before the second is fetched
+        status, results = self.run_main('-p', '1', '-w', '1', '--checkpoint', self.path('job.json'), self.path('urls.txt'))
+        self.assertEqual(status, 130)
+        self.assertEqual(results.keys(), ['http://example.com/p/1'])
+        with open(self.path('job.json')) as checkpoint:
+            saved = json.load(checkpoint)
+        self.assertEqual(saved, {'lines': 1, 'handled': [], 'extracted': 1, 'errors': 0, 'output': os.path.getsize(self.path('out.jsonl'))})
+    
+    def testResumeRequiresCheckpoint(self):
+        with patch('sys.stderr'):
+            self.assertRaises(SystemExit, main, ['--resume'])
+
+
+
+if __name__ == "__main__":
+    unittest.main()
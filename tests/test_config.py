@@ -2,15 +2,26 @@
 # -*- coding: UTF-8 -*-
 
 import os
+import re
+import thread
+import signal
 import unittest
+import threading
 import ConfigParser
 from textwrap import dedent
 from StringIO import StringIO
 
-from mock import MagicMock, patch
+from mock import MagicMock, patch, call
 
 from shoplift.config import *
+from shoplift.config import _init_process
 from shoplift.exceptions import ConfigDoesNotExistException
+from shoplift.pool import Future
+from shoplift.scheduler import HostScheduler
+from shoplift.cache import ResultCache
+from shoplift.scrapers.microdata_scraper import microdata_extract
+from shoplift.scrapers.amazon_api_scraper import use_api, ProductAPI
+from shoplift.filters.regex import regex_filter
 
 BASE_CONFIG_TESTFILE = os.path.join(os.path.dirname(__file__), 'test_config.ini')
 
@@ -345,6 +356,513 @@ class TestExtractor(unittest.TestCase):
     
     
     
+    def testExtractParsesOnce(self):
+        '''Test that all attributes share a single parse of the page'''
+        
+        ext = Extractor(StringIO(dedent("""
+            [example]
+            url.domains    = example.com
+            url.path       = /p/.*
+            name           = xpath.//h1//text()
+            price          = xpath.//span[@class="price"]//text()
+            price.filter   = regex.(\d+)
+            currency       = xpath.//span[@class="price"]//text()
+            currency.filter= regex.^(\D+)
+        """)))
+        resource = Resource('http://example.com/p/123')
+        resource.response = MagicMock(text='<html><body><h1>Hobbit</h1><span class="price">Rs. 250</span></body></html>')
+        
+        product = ext.extract(resource)
+        self.assertEqual(product, {
+            'url': 'http://example.com/p/123',
+            'name': 'Hobbit',
+            'price': '250',
+            'currency': 'Rs. ',
+        })
+        self.assertEqual(resource.document.parse_count, 1)
+    
+    
+    
+    @patch('shoplift.web.scheduler')
+    def testResultCache(self, scheduler):
+        '''Test that unchanged pages are not scraped again with a result cache'''
+        
+        section = dedent("""
+            [example]
+            url.domains    = example.com
+            url.path       = /p/.*
+            name           = xpath.//h1//text()
+        """)
+        body = '<html><body><h1>Hobbit</h1></body></html>'
+        scheduler.fetch.return_value.result.return_value = MagicMock(text=body, content=body, headers={})
+        
+        results = ResultCache(':memory:')
+        ext = Extractor(StringIO(section), result_cache=results)
+        self.assertEqual(ext.extract('http://example.com/p/1'), { 'url': 'http://example.com/p/1', 'name': 'Hobbit' })
+        with patch('shoplift.web.Document.parse') as parse:
+            self.assertEqual(ext.extract('http://example.com/p/1'), { 'url': 'http://example.com/p/1', 'name': 'Hobbit' })
+            self.assertFalse(parse.called)
+        self.assertEqual(results.stats['hits'], 1)
+        
+        # Changing the page or the platform's config invalidates the product
+        body = '<html><body><h1>Silmarillion</h1></body></html>'
+        scheduler.fetch.return_value.result.return_value = MagicMock(text=body, content=body, headers={})
+        self.assertEqual(ext.extract('http://example.com/p/1')['name'], 'Silmarillion')
+        ext = Extractor(StringIO(section + 'name.filter = regex.(\\w+)'), result_cache=results)
+        self.assertNotEqual(ext.config_digests['example'], Extractor(StringIO(section)).config_digests['example'])
+        self.assertEqual(ext.extract('http://example.com/p/1')['name'], 'Silmarillion')
+        self.assertEqual(results.stats['misses'], 3)
+        
+        # Products that can't be stored are still extracted
+        body = '<html><body><ul><li>Hobbit</li><li>Silmarillion</li></ul></body></html>'
+        scheduler.fetch.return_value.result.return_value = MagicMock(text=body, content=body, headers={})
+        ext = Extractor(StringIO(section.replace('//h1//text()', '//li')), result_cache=results)
+        entries = results.stats['entries']
+        self.assertEqual(len(ext.extract('http://example.com/p/2')['name']), 2)
+        self.assertEqual(results.stats['entries'], entries)
+    
+    
+    
+    @patch('shoplift.web.scheduler')
+    def testRefresh(self, scheduler):
+        '''Test that refreshing unchanged pages returns the stored product'''
+        
+        ext = Extractor(StringIO(dedent("""
+            [example]
+            url.domains    = example.com
+            url.path       = /p/.*
+            name           = xpath.//h1//text()
+        """)), result_cache=ResultCache(':memory:'))
+        body = '<html><body><h1>Hobbit</h1></body></html>'
+        scheduler.fetch.return_value.result.return_value = MagicMock(
+            status_code=200, text=body, content=body, headers={'ETag': '"v1"'}
+        )
+        self.assertEqual(ext.refresh('http://example.com/p/1'), (True, { 'url': 'http://example.com/p/1', 'name': 'Hobbit' }))
+        
+        scheduler.fetch.return_value.result.return_value = MagicMock(status_code=304, headers={})
+        with patch('shoplift.web.Document.parse') as parse:
+            self.assertEqual(ext.refresh('http://example.com/p/1'), (False, { 'url': 'http://example.com/p/1', 'name': 'Hobbit' }))
+            self.assertFalse(parse.called)
+        self.assertEqual(scheduler.fetch.call_args[1]['headers']['If-None-Match'], '"v1"')
+        
+        body = '<html><body><h1>Silmarillion</h1></body></html>'
+        scheduler.fetch.return_value.result.return_value = MagicMock(
+            status_code=200, text=body, content=body, headers={'ETag': '"v2"'}
+        )
+        self.assertEqual(dict(ext.refresh_many(['http://example.com/p/1', 'http://example.org/p/1'])), {
+            'http://example.com/p/1': (True, { 'url': 'http://example.com/p/1', 'name': 'Silmarillion' }),
+            'http://example.org/p/1': (True, {}),
+        })
+    
+    
+    
+    @patch('shoplift.web.scheduler')
+    def testCanonicalURL(self, scheduler):
+        '''Test that the URLs of a product are fetched from one canonical URL'''
+        
+        ext = Extractor(StringIO(dedent("""
+            [amazon]
+            url.domains    = amazon.in
+            url.path       = /dp/.*
+            url.canonical  = (/dp/\w{10})
+            name           = xpath.//h1//text()
+            
+            [flipkart]
+            url.domains    = flipkart.com
+            url.path       = /p/.*
+            url.drop_params= affid|srno
+            url.canonical  = /invalid/(
+            name           = xpath.//h1//text()
+        """)))
+        self.assertEqual(ext.canonical_url('http://www.amazon.in/Kindle/dp/B00KDRTG8M/ref=sr_1_1?tag=x#top'), 'http://www.amazon.in/dp/B00KDRTG8M')
+        self.assertEqual(
+            ext.canonical_url('http://www.flipkart.com/hobbit/p/itm1?srno=b_2&pid=BOOK1&affid=x&utm_source=y'),
+            'http://www.flipkart.com/hobbit/p/itm1?pid=BOOK1'
+        )
+        self.assertEqual(ext.canonical_url('http://example.com/p/1?b=2&a=1'), 'http://example.com/p/1?a=1&b=2')
+        
+        # Reduced URLs must still route to the platform
+        ext.canonical_rules['flipkart'] = (None, re.compile('(/hobbit)'))
+        self.assertEqual(ext.canonical_url('http://www.flipkart.com/hobbit/p/itm2'), 'http://www.flipkart.com/hobbit/p/itm2')
+        
+        scheduler.fetch.return_value.result.return_value = MagicMock(text='<html><h1>Kindle</h1></html>')
+        for url in ('http://www.amazon.in/Kindle/dp/B00KDRTG8M?ref=a', 'http://WWW.amazon.in/dp/B00KDRTG8M/ref=b'):
+            self.assertEqual(ext.extract(url), { 'url': 'http://www.amazon.in/dp/B00KDRTG8M', 'name': 'Kindle' })
+        self.assertEqual(
+            [args[0] for args, kwargs in scheduler.fetch.call_args_list],
+            ['http://www.amazon.in/dp/B00KDRTG8M', 'http://www.amazon.in/dp/B00KDRTG8M']
+        )
+    
+    
+    
+    @patch('shoplift.web.scheduler')
+    def testExtractAsync(self, scheduler):
+        '''Test that extract_async returns at once and extracts once fetched'''
+        
+        ext = Extractor(StringIO(dedent("""
+            [example]
+            url.domains    = example.com
+            url.path       = /p/.*
+            name           = xpath.//h1//text()
+        """)))
+        fetched = Future()
+        scheduler.fetch.return_value = fetched
+        
+        product = ext.extract_async('http://example.com/p/1', timeout=5)
+        scheduler.fetch.assert_called_once_with('http://example.com/p/1', 5, max_bytes=web.MAX_BODY_BYTES, head_only=False)
+        self.assertFalse(product.done())
+        
+        fetched.set_result(MagicMock(text='<html><body><h1>Hobbit</h1></body></html>'))
+        self.assertEqual(product.result(1), { 'url': 'http://example.com/p/1', 'name': 'Hobbit' })
+        
+        # Unsupported URLs are not fetched
+        self.assertEqual(ext.extract_async('http://example.org/p/1').result(1), {})
+        self.assertEqual(scheduler.fetch.call_count, 1)
+        
+        # Fetch errors are set on the product future
+        failed = Future()
+        scheduler.fetch.return_value = failed
+        product = ext.extract_async('http://example.com/p/2')
+        failed.set_exception(IOError('unreachable'))
+        self.assertIsInstance(product.exception(1), IOError)
+    
+    
+    
+    def testReload(self):
+        '''Test that reloading recompiles only the platforms that changed'''
+        
+        example = dedent("""
+            [example]
+            url.domains    = example.com
+            url.path       = /p/.*
+            name           = xpath.//h1//text()
+        """)
+        other = dedent("""
+            [other]
+            url.domains    = other.com
+            url.path       = /p/.*
+            name           = xpath.//h1//text()
+        """)
+        ext = Extractor(StringIO(example + other))
+        plans, route = ext.plans['example'], ext.config.routes['example']
+        ext.canonical_url('http://example.com/p/1?b=2&a=1')
+        
+        # Only plans changed: the routes & canonical URLs are kept
+        changed = other.replace('h1', 'h2')
+        self.assertEqual(ext.reload(StringIO(example + changed)), ([], ['other'], []))
+        self.assertIs(ext.plans['example'], plans)
+        self.assertIs(ext.config.routes['example'], route)
+        self.assertRaises(AttributeError, setattr, ext, 'plans', {})
+        self.assertIsNot(ext.plans['other'], plans)
+        self.assertIn('http://example.com/p/1?b=2&a=1', ext.canonical_urls)
+        
+        added = dedent("""
+            [added]
+            url.domains    = added.com
+            url.path       = /item/.*
+            name           = xpath.//h1//text()
+        """)
+        self.assertEqual(ext.reload(StringIO(example + added)), (['added'], [], ['other']))
+        self.assertIs(ext.plans['example'], plans)
+        self.assertEqual(ext.get_platform('http://added.com/item/1')[0], 'added')
+        self.assertIsNone(ext.get_platform('http://other.com/p/1'))
+        self.assertEqual(ext.canonical_urls, {})
+        self.assertEqual(ext.config_text, example + added)
+    
+    
+    
+    @patch('shoplift.web.scheduler')
+    def testReloadInFlight(self, scheduler):
+        '''Test that extractions in flight keep the config they started with'''
+        
+        section = dedent("""
+            [example]
+            url.domains    = example.com
+            url.path       = /p/.*
+            name           = xpath.//h1//text()
+        """)
+        ext = Extractor(StringIO(section))
+        fetched = Future()
+        scheduler.fetch.return_value = fetched
+        product = ext.extract_async('http://example.com/p/1')
+        
+        ext.reload(StringIO(section.replace('h1', 'h2')))
+        fetched.set_result(MagicMock(text='<html><body><h1>Hobbit</h1><h2>Tolkien</h2></body></html>'))
+        self.assertEqual(product.result(1)['name'], 'Hobbit')
+        
+        scheduler.fetch.return_value = fetched
+        self.assertEqual(ext.extract('http://example.com/p/1')['name'], 'Tolkien')
+        
+        # Within pinned, the thread keeps the version it pinned
+        with ext.pinned():
+            plans = ext.plans
+            ext.reload(StringIO(section))
+            self.assertIs(ext.plans, plans)
+            
+            # Unless it pins another version, until that block exits
+            outer = ext.config
+            with ext.pinned(ext._config):
+                self.assertIs(ext.config, ext._config)
+            self.assertIs(ext.config, outer)
+        self.assertIsNot(ext.plans, plans)
+    
+    
+    
+    def testFetchOptions(self):
+        '''Test that OpenGraph-only platforms download page heads only'''
+        
+        extractor = Extractor(StringIO(dedent("""
+            [flipkart]
+            url.domains    = flipkart.com
+            url.path       = /p/.*
+            url.max_bytes  = 65536
+            name           = microdata./properties/name/0
+            image          = opengraph.image
+            
+            [itunes]
+            url.domains    = itunes.apple.com
+            url.path       = /album/.*
+            name           = opengraph.title
+            image          = opengraph.image
+            
+            [amazon]
+            url.domains    = amazon.com
+            url.path       = /dp/.*
+            name           = opengraph.title
+            price          = amazon_api.price_and_currency
+        """)))
+        
+        self.assertEqual(extractor.needs, {
+            'flipkart': set(['microdata', 'opengraph']),
+            'itunes': set(['opengraph']),
+            'amazon': set(['opengraph', 'url']),
+        })
+        self.assertEqual(extractor.fetch_options, {
+            'flipkart': {'max_bytes': 65536},
+            'itunes': {'head_only': True},
+            'amazon': {'head_only': True},
+        })
+        self.assertTrue(extractor.needs_page('amazon'))
+        
+        with patch('shoplift.web.scheduler') as scheduler:
+            scheduler.fetch.return_value.result.return_value = MagicMock(
+                text='<html><head><meta property="og:title" content="Hits" /></head></html>'
+            )
+            product = extractor.extract('https://itunes.apple.com/album/hits/id1')
+            scheduler.fetch.assert_called_once_with('https://itunes.apple.com/album/hits/id1', max_bytes=web.MAX_BODY_BYTES, head_only=True)
+            self.assertEqual(product['name'], 'Hits')
+    
+    
+    
+    @patch('shoplift.web.scheduler')
+    def testFetchLimits(self, scheduler):
+        '''Test that url.rate & url.concurrency limit the platform's domains'''
+        
+        Extractor(StringIO(dedent("""
+            [flipkart]
+            url.domains    = flipkart.com, flipkart.in
+            url.path       = /p/.*
+            url.rate       = 2.5
+            url.concurrency= 3
+            
+            [amazon]
+            url.domains    = amazon.in
+            url.path       = /dp/.*
+            url.rate       = fast
+            
+            [apple]
+            url.domains    = apple.com
+            url.path       = /.*
+        """)))
+        
+        self.assertEqual(sorted(scheduler.set_limit.call_args_list), [
+            call('flipkart.com', rate=2.5, concurrency=3),
+            call('flipkart.in', rate=2.5, concurrency=3),
+        ])
+    
+    
+    
+    def testReloadLimits(self):
+        '''Test that reloading lifts the limits no platform sets anymore'''
+        
+        section = dedent("""
+            [example]
+            url.domains    = example.org, example.net
+            url.path       = /p/.*
+            url.rate       = 0.5
+            url.concurrency= 1
+        """)
+        with patch('shoplift.web.scheduler', HostScheduler(MagicMock())) as scheduler:
+            ext = Extractor(StringIO(section))
+            self.assertEqual(scheduler.limits, {'example.org': (1, 0.5), 'example.net': (1, 0.5)})
+            
+            ext.reload(StringIO(section.replace(', example.net', '')))
+            self.assertEqual(scheduler.limits, {'example.org': (1, 0.5)})
+            
+            unlimited = section.replace('url.rate', '#').replace('url.concurrency', '#')
+            self.assertEqual(ext.reload(StringIO(unlimited)), ([], ['example'], []))
+            self.assertEqual(scheduler.limits, {})
+            
+            # As are the limits of removed platforms
+            ext.reload(StringIO(section))
+            ext.reload(StringIO(''))
+            self.assertEqual(scheduler.limits, {})
+    
+    
+    
+    def testCompiledPlans(self):
+        '''Test that platform attributes are compiled into plans at load time'''
+        
+        plans = dict((plan.attribute, plan) for plan in self.extractor.plans['flipkart'])
+        self.assertEqual(sorted(plans), ['currency', 'image', 'name', 'price', 'url'])
+        
+        (scraper, path), (filter_function, pattern) = plans['price'].steps
+        # Plans bind the functions themselves, not their lazy stand-ins
+        self.assertIs(scraper, microdata_extract)
+        self.assertEqual(path, ('properties', 'offers', 0, 'properties', 'price', 0))
+        self.assertIs(filter_function, regex_filter)
+        self.assertEqual(pattern.pattern, '(\d+.\d+)')
+        self.assertTrue(hasattr(pattern, 'search'))
+        
+        # The url config has no methods, and resolves to the URL
+        self.assertEqual(plans['url'].steps, ())
+        self.assertEqual(plans['url']('http://www.flipkart.com/x/p/y'), 'http://www.flipkart.com/x/p/y')
+        
+        # Plans are immutable
+        self.assertRaises(AttributeError, setattr, plans['price'], 'steps', ())
+    
+    
+    
+    def testExtractMany(self):
+        '''Test that batch extraction yields every URL and captures errors'''
+        
+        ext = Extractor(BASE_CONFIG_TESTFILE)
+        
+        def extract(url):
+            if 'broken' in url:
+                raise IOError(url)
+            return { 'name': url }
+        
+        ext.extract = MagicMock(side_effect=extract)
+        urls = ['http://example.com/%d' % i for i in xrange(20)] + ['http://example.com/broken']
+        results = dict(ext.extract_many(iter(urls), workers=4))
+        
+        self.assertEqual(sorted(results), sorted(urls))
+        self.assertIsInstance(results.pop('http://example.com/broken'), IOError)
+        for url, product in results.iteritems():
+            self.assertEqual(product, { 'name': url })
+    
+    
+    
+    @patch('shoplift.web.scheduler')
+    def testExtractParallel(self, scheduler):
+        '''Test that pages fetched here are extracted in other processes'''
+        
+        ext = Extractor(StringIO(dedent("""
+            [shop]
+            url.domains    = example.com
+            url.path       = /p/.*
+            name           = xpath.//h1//text()
+            price          = xpath.//span[@class="price"]//text()
+            price.filter   = regex.(\d+)
+        """)))
+        
+        def fetch(url, timeout=None, **options):
+            future = Future()
+            if 'broken' in url:
+                future.set_exception(IOError(url))
+            else:
+                future.set_result(MagicMock(
+                    content='<html><h1>Item %s</h1><span class="price">Rs. %s</span></html>' % (url[-1], url[-1]),
+                    encoding='utf-8',
+                ))
+            return future
+        scheduler.fetch.side_effect = fetch
+        
+        urls = ['http://example.com/p/%d' % i for i in xrange(10)] + ['http://example.com/broken/p/1', 'http://unknown.com/p/1']
+        results = dict(ext.extract_parallel(iter(urls), processes=2, prefetch=3))
+        
+        self.assertEqual(sorted(results), sorted(urls))
+        self.assertIsInstance(results.pop('http://example.com/broken/p/1'), IOError)
+        self.assertEqual(results.pop('http://unknown.com/p/1'), {})
+        for url, product in results.iteritems():
+            self.assertEqual(product, { 'url': url, 'name': 'Item ' + url[-1], 'price': url[-1] })
+    
+    @patch('shoplift.web.scheduler')
+    def testExtractParallelInterrupt(self, scheduler):
+        '''Test that Ctrl-C interrupts extract_parallel while it waits for results'''
+        
+        ext = Extractor(StringIO(dedent("""
+            [shop]
+            url.domains    = example.com
+            url.path       = /p/.*
+            name           = xpath.//h1//text()
+        """)))
+        # The pages never arrive
+        scheduler.fetch.side_effect = lambda url, timeout=None, **options: Future()
+        
+        results = ext.extract_parallel(iter(['http://example.com/p/1']), processes=1)
+        timer = threading.Timer(0.2, thread.interrupt_main)
+        timer.start()
+        try:
+            self.assertRaises(KeyboardInterrupt, list, results)
+        finally:
+            timer.cancel()
+    
+    
+    
+    @patch('shoplift.web.scheduler')
+    def testExtractURLOnly(self, scheduler):
+        '''Test that the pages of platforms that only need the URL are never fetched'''
+        
+        ext = Extractor(StringIO(dedent("""
+            [amazon]
+            url.domains    = amazon.com
+            url.path       = /dp/.*
+            name           = amazon_api.title
+        """)))
+        self.assertFalse(ext.needs_page('amazon'))
+        
+        def lookup(asins):
+            return dict((asin, MagicMock(title='Item ' + asin)) for asin in asins)
+        use_api(lambda region: MagicMock(lookup=lookup), window=0)
+        try:
+            urls = ['http://www.amazon.com/dp/B00KDRTG8%d' % i for i in xrange(5)]
+            product = ext.extract_async(urls[0]).result(5)
+            self.assertEqual(product, { 'url': urls[0], 'name': 'Item B00KDRTG80' })
+            
+            results = dict(ext.extract_parallel(iter(urls), processes=2, prefetch=3))
+            self.assertEqual(results, dict((url, { 'url': url, 'name': 'Item ' + url[-10:] }) for url in urls))
+        finally:
+            use_api(ProductAPI)
+        self.assertFalse(scheduler.fetch.called)
+    
+    
+    
+    def testInitProcess(self):
+        '''Test that extraction processes don't wait on locks held when they were forked'''
+        
+        parent = HostScheduler(MagicMock())
+        with patch('shoplift.web.scheduler', parent), patch('shoplift.web.session'), patch('shoplift.web._documents_lock'), \
+                patch('shoplift.config.signal.signal') as set_handler:
+            with parent.lock:
+                started = threading.Thread(target=_init_process, args=(dedent("""
+                    [shop]
+                    url.domains    = example.com
+                    url.path       = /p/.*
+                    url.rate       = 2
+                    name           = xpath.//h1//text()
+                """),))
+                started.start()
+                started.join(5)
+                self.assertFalse(started.is_alive())
+                self.assertIsNot(web.scheduler, parent)
+                self.assertEqual(web.scheduler.limits, {'example.com': (web.scheduler.per_host, 2)})
+                # Ctrl-C is left to the parent process
+                set_handler.assert_called_once_with(signal.SIGINT, signal.SIG_IGN)
+    
+    
+    
     @patch('shoplift.scrapers.opengraph')
     def testinvoke_opengraph(self, mock_opengraph):
         '''Test for invoke_extraction call
@@ -4,6 +4,7 @@
 import unittest
 
 from shoplift.filters import *
+from shoplift.filters.regex import regex_filter_many, use_engine, ENGINES
 
 
 
@@ -47,6 +48,52 @@ class TestFilters(unittest.TestCase):
         self.assertIsNone(regex(None, ''))
     
     
+    def testCompiledRegexFilter(self):
+        """regex filter should accept precompiled patterns"""
+        
+        self.assertEqual(regex('USD 23.45', compile_regex('(\d+.\d+)')), '23.45')
+        
+        self.assertEqual(regex('abcde', compile_regex('abcde')), 'abcde')
+        
+        self.assertIsNone(regex('hoola', compile_regex('(\d+.\d+)')))
+        
+        self.assertIsNone(regex(None, compile_regex('')))
+    
+    
+    def testPatternCache(self):
+        """Patterns should be compiled once, and by the chosen engine"""
+        
+        self.assertIs(compile_regex('(\d+)'), compile_regex('(\d+)'))
+        
+        self.assertRaises(KeyError, use_engine, 'perl')
+        
+        # The regex library is imported when chosen, if installed
+        try:
+            use_engine('regex')
+        except KeyError:
+            self.assertNotIn('regex', ENGINES)
+        else:
+            try:
+                pattern = compile_regex('(\d+)')
+                self.assertIsInstance(pattern, type(ENGINES['regex'].compile('')))
+                self.assertEqual(regex('Rs. 250', pattern), '250')
+                self.assertEqual(regex('abcde', 'abcde'), 'abcde')
+            finally:
+                use_engine('re')
+    
+    
+    def testRegexFilterMany(self):
+        """regex_filter_many should filter every string"""
+        
+        self.assertEqual(regex_filter_many(['Rs. 250', None, 'free', 'USD 23.45'], '(\d+(\.\d+)?)'), ['250', None, None, '23.45'])
+        
+        self.assertEqual(regex_filter_many(['abc'], compile_regex('b')), ['b'])
+        
+        self.assertEqual(regex_filter_many(['abc', 'def'], None), [None, None])
+        
+        self.assertEqual(regex_filter_many([], '(a)'), [])
+    
+    
     def testTupleFilter(self):
         """Test tuple filter behaviour"""
         
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+'''Unit tests for shoplift.instrument'''
+
+import unittest
+from textwrap import dedent
+from StringIO import StringIO
+
+from mock import MagicMock, patch
+
+from shoplift import instrument
+from shoplift.instrument import Aggregator, Histogram, Observer, observing, span
+from shoplift.config import Extractor
+
+
+
+class Recorder(Observer):
+    """Records every span it's reported"""
+    
+    def __init__(self):
+        self.spans = []
+    
+    def span(self, stage, seconds, platform=None, attribute=None):
+        self.spans.append((stage, seconds, platform, attribute))
+
+
+
+class TestSpans(unittest.TestCase):
+    
+    def testNoObserver(self):
+        """Spans should be no-ops outside of an observed extraction"""
+        self.assertIs(span(instrument.PARSE), instrument.NO_SPAN)
+        with observing(None):
+            self.assertIs(span(instrument.PARSE), instrument.NO_SPAN)
+    
+    def testExclusiveSpans(self):
+        """Nested spans should be excluded from the time of their parent"""
+        recorder = Recorder()
+        clock = [100.0]
+        with patch('shoplift.instrument.time') as fake_time:
+            fake_time.time.side_effect = lambda: clock[0]
+            with observing(recorder, 'shop') as context:
+                context.attribute = 'name'
+                with span(instrument.SCRAPE):
+                    clock[0] += 0.02
+                    with span(instrument.FETCH):
+                        clock[0] += 0.05
+        
+        (fetch, fetched, platform, attribute), (scrape, scraped, _, _) = recorder.spans
+        self.assertEqual((fetch, scrape), (instrument.FETCH, instrument.SCRAPE))
+        self.assertEqual((platform, attribute), ('shop', 'name'))
+        self.assertAlmostEqual(fetched, 0.05)
+        self.assertAlmostEqual(scraped, 0.02)
+        self.assertIs(span(instrument.PARSE), instrument.NO_SPAN)
+    
+    def testHistogram(self):
+        """Histograms should bound the percentiles by their buckets"""
+        histogram = Histogram()
+        for i in xrange(99):
+            histogram.add(0.001)
+        histogram.add(0.5)
+        stats = histogram.stats
+        self.assertEqual(stats['count'], 100)
+        self.assertAlmostEqual(stats['total'], 0.599)
+        self.assertTrue(0.001 <= stats['p50'] < 0.002)
+        self.assertTrue(0.001 <= stats['p99'] < 0.002)
+        self.assertEqual(stats['max'], 0.5)
+        self.assertEqual(Histogram().percentile(50), 0.0)
+
+
+
+class TestExtractorInstrumentation(unittest.TestCase):
+    
+    config = dedent("""
+        [shop]
+        url.domains    = example.com
+        url.path       = /p/.*
+        name           = xpath.//h1//text()
+        price          = xpath.//span[@class="price"]//text()
+        price.filter   = regex.(\d+)
+    """)
+    
+    @patch('shoplift.web.scheduler')
+    def testStages(self, scheduler):
+        """Every stage should be reported, tagged with platform & attribute"""
+        scheduler.fetch.return_value.result.return_value = MagicMock(
+            text='<html><body><h1>Hobbit</h1><span class="price">Rs. 250</span></body></html>'
+        )
+        recorder = Recorder()
+        extractor = Extractor(StringIO(self.config), observer=recorder)
+        extractor.extract('http://example.com/p/1')
+        
+        spans = dict(((stage, attribute), platform) for stage, seconds, platform, attribute in recorder.spans)
+        self.assertEqual(set(spans.values()), set(['shop']))
+        
+        # The page is fetched & parsed for the first attribute scraped
+        first = [attribute for stage, attribute in spans if stage == instrument.FETCH]
+        self.assertIn(first, (['name'], ['price']))
+        self.assertEqual(sorted(spans), sorted([
+            (instrument.ROUTE, None),
+            (instrument.FETCH, first[0]),
+            (instrument.PARSE, first[0]),
+            (instrument.SCRAPE, 'name'),
+            (instrument.SCRAPE, 'price'),
+            (instrument.FILTER, 'price'),
+        ]))
+    
+    @patch('shoplift.web.scheduler')
+    def testAggregator(self, scheduler):
+        """The aggregator should keep histograms per platform & stage"""
+        scheduler.fetch.return_value.result.return_value = MagicMock(text='<html><h1>Hobbit</h1></html>')
+        aggregator = Aggregator()
+        extractor = Extractor(StringIO(self.config), observer=aggregator)
+        for i in xrange(3):
+            extractor.extract('http://example.com/p/%d' % i)
+        extractor.extract('http://unknown.com/p/1')
+        
+        stats = aggregator.stats()
+        self.assertEqual(sorted(stats), [None, 'shop'])
+        self.assertEqual(sorted(stats['shop']), sorted(instrument.STAGES))
+        self.assertEqual(stats['shop'][instrument.SCRAPE]['count'], 6)
+        self.assertEqual(stats[None][instrument.ROUTE]['count'], 1)
+        self.assertIn('shop', aggregator.report())
+        
+        aggregator.reset()
+        self.assertEqual(aggregator.stats(), {})
+    
+    def testNoObserver(self):
+        """Extractors should not observe extractions by default"""
+        extractor = Extractor(StringIO(self.config))
+        self.assertIsNone(extractor.observer)
+        self.assertEqual(extractor.extract('http://unknown.com/p/1'), {})
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+'''Unit tests for shoplift.microdata'''
+
+import unittest
+from textwrap import dedent
+
+import lxml.html
+
+from shoplift.microdata import get_items
+
+
+
+class TestMicrodata(unittest.TestCase):
+    
+    html = dedent("""
+        <html>
+        <head><title>The Hobbit</title></head>
+        <body>
+            <div itemscope itemtype="http://schema.org/Product http://example.com/Book" itemid="urn:isbn:0261102214">
+                <h1 itemprop="name">The <em>Hobbit</em><!-- paperback --></h1>
+                <a itemprop="url" href="/the-hobbit">The Hobbit</a>
+                <img itemprop="image" src="http://example.com/hobbit.jpg" />
+                <div itemprop="offers" itemscope itemtype="http://schema.org/Offer">
+                    <span itemprop="price">Rs. 250</span>
+                    <meta itemprop="priceCurrency" content="INR" />
+                </div>
+                <div><span itemprop="author">J. R. R. Tolkien</span></div>
+                <span itemprop="author">Christopher Tolkien</span>
+            </div>
+            <p itemscope><span itemprop="name">Another item</span></p>
+        </body>
+        </html>
+    """)
+    
+    def testItems(self):
+        """Items should be read off the tree as property dicts"""
+        items = get_items(lxml.html.fromstring(self.html))
+        self.assertEqual(items, [
+            {
+                'type': ['http://schema.org/Product', 'http://example.com/Book'],
+                'id': 'urn:isbn:0261102214',
+                'properties': {
+                    'name': ['The Hobbit'],
+                    'url': ['/the-hobbit'],
+                    'image': ['http://example.com/hobbit.jpg'],
+                    'offers': [{
+                        'type': ['http://schema.org/Offer'],
+                        'properties': {
+                            'price': ['Rs. 250'],
+                            'priceCurrency': ['INR'],
+                        },
+                    }],
+                    'author': ['J. R. R. Tolkien', 'Christopher Tolkien'],
+                },
+            },
+            {'properties': {'name': ['Another item']}},
+        ])
+    
+    def testNoItems(self):
+        """Documents without itemscopes should have no items"""
+        self.assertEqual(get_items(lxml.html.fromstring('<html><body><span itemprop="name">x</span></body></html>')), [])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
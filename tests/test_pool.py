@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+'''Unit tests for shoplift.pool'''
+
+import time
+import unittest
+
+from shoplift.pool import imap_unordered, Future, ThreadPool
+from shoplift.exceptions import TimeoutException
+
+
+
+class TestImapUnordered(unittest.TestCase):
+    
+    def testAllItemsProcessed(self):
+        """Every item should be yielded exactly once with its result"""
+        results = list(imap_unordered(lambda x: x * 2, xrange(100), workers=8))
+        self.assertEqual(sorted(results), [(x, x * 2, None) for x in xrange(100)])
+    
+    def testErrorsCaptured(self):
+        """Exceptions raised per item should be yielded, not raised"""
+        def function(x):
+            if x % 2:
+                raise ValueError(x)
+            return x
+        
+        for item, result, error in imap_unordered(function, xrange(10), workers=3):
+            if item % 2:
+                self.assertIsNone(result)
+                self.assertIsInstance(error, ValueError)
+            else:
+                self.assertEqual(result, item)
+                self.assertIsNone(error)
+    
+    def testCompletionOrder(self):
+        """Results should be yielded as soon as they are ready"""
+        def function(x):
+            time.sleep(x)
+            return x
+        
+        items = [item for item, result, error in imap_unordered(function, [0.3, 0.0], workers=2)]
+        self.assertEqual(items, [0.0, 0.3])
+    
+    def testBoundedReadAhead(self):
+        """The input iterable should not be consumed far ahead of the consumer"""
+        consumed = []
+        
+        def iterable():
+            for x in xrange(1000):
+                consumed.append(x)
+                yield x
+        
+        results = imap_unordered(lambda x: x, iterable(), workers=2)
+        next(results)
+        time.sleep(0.2)
+        results.close()
+        
+        # 1 yielded, 2 * workers queued on each side, 1 held by each worker & the feeder
+        self.assertLessEqual(len(consumed), 1 + 2 * 2 * 2 + 2 + 1)
+    
+    def testIterableFailure(self):
+        """Errors raised by the input iterable should reach the consumer"""
+        def iterable():
+            yield 1
+            raise IOError('broken input')
+        
+        results = imap_unordered(lambda x: x, iterable(), workers=2)
+        self.assertEqual(next(results), (1, 1, None))
+        self.assertRaises(IOError, list, results)
+
+
+
+
+class TestFuture(unittest.TestCase):
+    
+    def testResult(self):
+        """Futures should hand their result to waiters and callbacks"""
+        future = Future()
+        called = []
+        future.add_done_callback(called.append)
+        self.assertFalse(future.done())
+        self.assertRaises(TimeoutException, future.result, 0.01)
+        
+        future.set_result(42)
+        self.assertTrue(future.done())
+        self.assertEqual(future.result(), 42)
+        self.assertIsNone(future.exception())
+        self.assertEqual(called, [future])
+        
+        # Callbacks added once done run right away
+        future.add_done_callback(called.append)
+        self.assertEqual(called, [future, future])
+    
+    def testException(self):
+        """Futures should raise the error of the call"""
+        future = Future()
+        future.set_exception(IOError('broken'))
+        self.assertRaises(IOError, future.result)
+        self.assertIsInstance(future.exception(), IOError)
+    
+    def testThreadPool(self):
+        """ThreadPool should run submitted calls in the background"""
+        pool = ThreadPool(4)
+        futures = [pool.submit(lambda x: x * 2, i) for i in xrange(20)]
+        self.assertEqual([future.result(5) for future in futures], range(0, 40, 2))
+        self.assertIsInstance(pool.submit(int, 'x').exception(5), ValueError)
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+'''Unit tests for shoplift.registry'''
+
+import os
+import sys
+import types
+import unittest
+import subprocess
+from textwrap import dedent
+
+from mock import patch
+from pkg_resources import EntryPoint
+
+from shoplift import filters
+from shoplift.registry import Registry, LazyFunction, declare, declared, TREE
+from shoplift.plan import bind_step
+import shoplift.filters.tuple
+
+
+
+class TestRegistry(unittest.TestCase):
+    
+    def testLazyFunction(self):
+        """Functions should be loaded on first use, then bound as-is"""
+        registry = Registry('shoplift.filters')
+        lazy = registry.register('tuple', '.tuple', 'tuple_filter')
+        self.assertIs(registry.get('tuple'), lazy)
+        self.assertIsNone(registry.get('nope'))
+        self.assertIsNone(lazy.function)
+        
+        self.assertEqual(lazy(('USD', 123), 1), 123)
+        self.assertIs(lazy.resolve(), shoplift.filters.tuple.tuple_filter)
+        self.assertIs(lazy.function, shoplift.filters.tuple.tuple_filter)
+    
+    def testShadowedBySubmodule(self):
+        """Functions named like their submodule should still be bound"""
+        
+        # Importing shoplift.filters.tuple made the package attribute the submodule
+        self.assertFalse(isinstance(filters.tuple, LazyFunction))
+        function, index = bind_step(filters, 'tuple', '1')
+        self.assertIs(function, shoplift.filters.tuple.tuple_filter)
+        self.assertEqual(function(('USD', 123), index), 123)
+        self.assertIsNone(bind_step(filters, 'nope', '1'))
+    
+    def testDeclare(self):
+        """Functions should declare known inputs, and default to unknown"""
+        
+        @declare(TREE, thread_safe=False)
+        def scraper(resource, arg):
+            pass
+        
+        self.assertEqual(declared(scraper), ('tree', False))
+        self.assertEqual(declared(shoplift.filters.tuple.tuple_filter), ('value', True))
+        self.assertEqual(declared(lambda resource, arg: None), (None, False))
+        self.assertRaises(ValueError, declare, 'html')
+    
+    @patch('pkg_resources.iter_entry_points')
+    def testPlugins(self, iter_entry_points):
+        """Entry points should be registered, without replacing the package's functions"""
+        iter_entry_points.return_value = [
+            EntryPoint.parse('upper = string:upper'),
+            EntryPoint.parse('tuple = string:lower'),
+        ]
+        registry = Registry('shoplift.filters', 'shoplift.filters')
+        builtin = registry.register('tuple', '.tuple', 'tuple_filter')
+        
+        self.assertIsNone(registry.get('upper', discover=False))
+        self.assertEqual(registry.get('upper')('abc'), 'ABC')
+        self.assertIs(registry.get('tuple'), builtin)
+        iter_entry_points.assert_called_once_with('shoplift.filters')
+    
+    def testSerialized(self):
+        """Functions that aren't thread safe should be bound behind a lock"""
+        plugins = types.ModuleType('plugins')
+        plugins.upper = lambda value, arg: value.upper()
+        
+        function, arg = bind_step(plugins, 'upper', None)
+        self.assertIsNot(function, plugins.upper)
+        self.assertIs(function.function, plugins.upper)
+        self.assertEqual(declared(function), (None, True))
+        self.assertEqual(function('abc', arg), 'ABC')
+        
+        # Every plan binding the function shares its lock
+        self.assertIs(function.lock, bind_step(plugins, 'upper', None)[0].lock)
+    
+    def testImportsOnlyUsedModules(self):
+        """Loading a config should only import the scrapers & filters it uses"""
+        
+        script = dedent('''
+            import sys
+            from StringIO import StringIO
+            from shoplift.config import Extractor
+            before = set(sys.modules)
+            Extractor(StringIO("""
+            [example]
+            url.domains = example.com
+            url.path    = /.*
+            name        = xpath.//h1//text()
+            """))
+            print ' '.join(sorted(before)), '|', ' '.join(sorted(set(sys.modules) - before))
+        ''')
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.check_output([sys.executable, '-c', script], cwd=root)
+        before, loaded = [part.split() for part in output.split('|')]
+        
+        for module in ('regex', 'pkg_resources', 'shoplift.scrapers.amazon_api_scraper',
+                       'shoplift.scrapers.opengraph_scraper', 'shoplift.scrapers.microdata_scraper'):
+            self.assertNotIn(module, before + loaded)
+        self.assertNotIn('shoplift.scrapers.xpath_scraper', before)
+        self.assertIn('shoplift.scrapers.xpath_scraper', loaded)
+
+
+
+if __name__ == "__main__":
+    unittest.main()
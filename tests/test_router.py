@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+'''Unit tests for shoplift.router'''
+
+import unittest
+import urlparse
+
+from shoplift.router import Router, domain_labels
+
+
+
+class TestRouter(unittest.TestCase):
+    
+    def setUp(self):
+        self.router = Router()
+        self.router.add('amazon', ['amazon.com', 'junglee.com'], '/.*/dp/.*')
+        self.router.add('itunes', ['itunes.apple.com'], '/.*/album/.*')
+        self.router.add('apple', ['apple.com'], '/us/.*')
+    
+    def match(self, url):
+        return self.router.match(urlparse.urlsplit(url))
+    
+    def testDomainLabels(self):
+        """domain_labels should reverse the labels of a domain"""
+        self.assertEqual(domain_labels('www.Amazon.com'), ['com', 'amazon', 'www'])
+        self.assertEqual(domain_labels(' .flipkart. '), ['flipkart'])
+    
+    def testDomainMatch(self):
+        """Hosts should match their domain and its subdomains only"""
+        self.assertEqual(self.match('http://amazon.com/x/dp/1'), 'amazon')
+        self.assertEqual(self.match('http://www.amazon.com/x/dp/1'), 'amazon')
+        self.assertEqual(self.match('http://www.AMAZON.com:8080/x/dp/1'), 'amazon')
+        self.assertEqual(self.match('http://junglee.com/x/dp/1'), 'amazon')
+        self.assertIsNone(self.match('http://notamazon.com/x/dp/1'))
+        self.assertIsNone(self.match('http://amazon.com.evil.org/x/dp/1'))
+        self.assertIsNone(self.match('http://com/x/dp/1'))
+        self.assertIsNone(self.match(''))
+    
+    def testPathMatch(self):
+        """The path pattern should be searched from the path onwards"""
+        self.assertIsNone(self.match('http://amazon.com/s/'))
+        self.assertEqual(self.match('http://amazon.com/s?next=/x/dp/1'), 'amazon')
+    
+    def testMostSpecificDomainFirst(self):
+        """Platforms of a subdomain should be preferred over the parent domain's"""
+        self.assertEqual(self.match('http://itunes.apple.com/us/album/x/id1'), 'itunes')
+        self.assertEqual(self.match('http://store.apple.com/us/buy-ipad/ipad'), 'apple')
+        # Falls back to the parent domain if the subdomain's path doesn't match
+        self.assertEqual(self.match('http://itunes.apple.com/us/movie/x/id1'), 'apple')
+    
+    def testInvalidPattern(self):
+        """Platforms with an invalid path pattern should never match"""
+        self.router.add('ebay', ['ebay.com'], '*.////\s([^abc])')
+        self.assertIsNone(self.match('http://ebay.com/abc'))
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+'''Unit tests for shoplift.scheduler'''
+
+import time
+import threading
+import unittest
+from collections import defaultdict
+
+from mock import MagicMock
+
+from shoplift.scheduler import HostScheduler
+
+
+
+class FakeSession(object):
+    """Stands in for requests.Session, recording concurrency per host"""
+    
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.running = defaultdict(int)
+        self.peak = defaultdict(int)
+        self.timeouts = []
+    
+    def get(self, url, timeout=None):
+        host = url.split('/')[2]
+        with self.lock:
+            self.running[host] += 1
+            self.peak[host] = max(self.peak[host], self.running[host])
+            self.timeouts.append(timeout)
+        time.sleep(self.delay)
+        with self.lock:
+            self.running[host] -= 1
+        if 'broken' in url:
+            raise IOError(url)
+        return MagicMock(url=url)
+
+
+
+class TestHostScheduler(unittest.TestCase):
+    
+    def testPerHostConcurrency(self):
+        """No more than per_host fetches should run at once for a host"""
+        session = FakeSession()
+        scheduler = HostScheduler(session, workers=16, per_host=2)
+        urls = ['http://%s/%d' % (host, i) for i in xrange(10) for host in ('a.com', 'b.com')]
+        futures = map(scheduler.fetch, urls)
+        
+        self.assertEqual([future.result(5).url for future in futures], urls)
+        self.assertEqual(dict(session.peak), { 'a.com': 2, 'b.com': 2 })
+        
+        # Queues are dropped once the hosts go idle
+        self.assertEqual(scheduler.stats(), {})
+    
+    def testNonBlocking(self):
+        """fetch should return at once, even with more fetches than threads"""
+        released = threading.Event()
+        def get(url, timeout=None):
+            released.wait(5)
+            return MagicMock(url=url)
+        
+        # No fetch can finish before fetch has returned for every URL
+        scheduler = HostScheduler(MagicMock(get=get), workers=1, per_host=1)
+        futures = [scheduler.fetch('http://example.com/%d' % i) for i in xrange(100)]
+        self.assertFalse(any(future.done() for future in futures))
+        released.set()
+        self.assertEqual([future.result(5).url for future in futures], ['http://example.com/%d' % i for i in xrange(100)])
+    
+    def testErrorsAndTimeouts(self):
+        """Errors should be set on the future, and timeouts passed on"""
+        session = FakeSession(delay=0)
+        scheduler = HostScheduler(session, timeout=7)
+        
+        self.assertIsInstance(scheduler.fetch('http://example.com/broken').exception(5), IOError)
+        scheduler.fetch('http://example.com/ok', timeout=3).result(5)
+        self.assertEqual(session.timeouts, [7, 3])
+
+    
+    def testDomainLimits(self):
+        """Hosts of a limited domain should share its queue & limits"""
+        session = FakeSession()
+        scheduler = HostScheduler(session, workers=16, per_host=4)
+        scheduler.set_limit('.Flipkart.com', concurrency=1)
+        
+        futures = [
+            scheduler.fetch(url)
+            for url in ('http://www.flipkart.com/1', 'http://m.flipkart.com/2', 'http://flipkart.com/3')
+        ]
+        for future in futures:
+            future.result(5)
+        
+        self.assertEqual(scheduler.stats().keys(), ['flipkart.com'])
+        self.assertEqual(scheduler.stats()['flipkart.com']['fetched'], 3)
+        self.assertEqual(sum(session.peak.values()), 3)
+        self.assertEqual(max(session.peak.values()), 1)
+    
+    def testClearLimit(self):
+        """Hosts of a domain whose limits are lifted should be queued per host"""
+        session = FakeSession()
+        scheduler = HostScheduler(session, workers=16, per_host=4)
+        scheduler.set_limit('flipkart.com', rate=1, concurrency=1)
+        scheduler.fetch('http://www.flipkart.com/1').result(5)
+        
+        scheduler.clear_limit('flipkart.com')
+        scheduler.clear_limit('amazon.in')
+        self.assertEqual(scheduler.limits, {})
+        futures = [scheduler.fetch('http://www.flipkart.com/%d' % i) for i in xrange(2, 4)]
+        self.assertEqual(scheduler.stats().keys(), ['www.flipkart.com'])
+        for future in futures:
+            future.result(5)
+        self.assertEqual(scheduler.stats(), {})
+    
+    def testRateLimit(self):
+        """Fetches should start no faster than the domain's rate"""
+        session = FakeSession(delay=0)
+        scheduler = HostScheduler(session, workers=4)
+        scheduler.set_limit('example.com', rate=20)
+        
+        started = time.time()
+        futures = [scheduler.fetch('http://example.com/%d' % i) for i in xrange(5)]
+        self.assertEqual(scheduler.stats()['example.com']['queued'], 4)
+        for future in futures:
+            future.result(5)
+        
+        # 4 intervals of 50ms between the 5 fetches
+        self.assertGreaterEqual(time.time() - started, 0.19)
+        self.assertGreaterEqual(scheduler.stats()['example.com']['wait_max'], 0.19)
+    
+    def testCoalescing(self):
+        """Fetches of a URL in flight should share its request"""
+        session = FakeSession(delay=0.1)
+        scheduler = HostScheduler(session, workers=4)
+        futures = [scheduler.fetch('http://example.com/1') for i in xrange(5)]
+        other = scheduler.fetch('http://example.com/1', timeout=3)
+        
+        self.assertTrue(all(future is futures[0] for future in futures))
+        self.assertIsNot(other, futures[0])
+        stats = scheduler.stats()['example.com']
+        self.assertEqual((stats['running'], stats['coalesced']), (2, 4))
+        futures[0].result(5)
+        other.result(5)
+        
+        # Fetches once the request landed send a new one
+        self.assertIsNot(scheduler.fetch('http://example.com/1'), futures[0])
+    
+    def testInvalidURLs(self):
+        """Invalid URLs should fail when fetched, not when queued"""
+        session = MagicMock()
+        session.get.side_effect = ValueError
+        scheduler = HostScheduler(session)
+        self.assertIsInstance(scheduler.fetch(1234).exception(5), ValueError)
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,15 +7,36 @@ Test the scraping APIs exposed by the different
 scraping methods.
 '''
 
+import os
 import unittest
+import threading
+import lxml.etree
+from textwrap import dedent
+from StringIO import StringIO
+
+from mock import MagicMock, patch
 
 from shoplift.web import Resource
 from shoplift.scrapers import *
+from shoplift.pool import imap_unordered
+from shoplift.config import Extractor
+from shoplift.scrapers.amazon_api_scraper import BatchLookup, ProductAPI, use_api, get_lookup, get_asin
+from shoplift.scrapers.amazon_api_scraper import AmazonAPI, CREDENTIALS
+
+# The Product Advertising API can only be queried with an account's credentials
+HAS_AMAZON_API = AmazonAPI is not None and all(os.environ.get(name) for name in CREDENTIALS)
 
 
 
 class TestScrapers(unittest.TestCase):
     
+    def setUp(self):
+        # Amazon products are looked up in a stand-in for the API
+        use_api(StandInAPI, window=0)
+    
+    def tearDown(self):
+        use_api(ProductAPI)
+    
     def testResourceInputSupport(self):
         """web.Resource objects should be supported as input"""
         
@@ -24,7 +45,7 @@ class TestScrapers(unittest.TestCase):
                 amazon_api,
                 'http://www.amazon.com/Harry-Potter-Sorcerers-Stone-Book/dp/059035342X/ref=sr_1_1?s=books&ie=UTF8&qid=1403099669&sr=1-1&keywords=harry+potter',
                 'title',
-                r"Harry Potter and the Sorcerer's Stone \(Harry Potters\)",
+                r"Item 059035342X",
             ),
             (
                 microdata,
@@ -57,9 +78,11 @@ class TestScrapers(unittest.TestCase):
     
     
     
+    @unittest.skipUnless(HAS_AMAZON_API, 'requires python-amazon-simple-product-api & the AMAZON_* credentials')
     def testAmazonApiScraper(self):
         '''Test for amazon API scraping'''
         
+        use_api(ProductAPI)
         self.assertEqual(amazon_api('avcd', ''), None)
         
         self.assertEqual(amazon_api(1234, ''), None)
@@ -82,6 +105,19 @@ class TestScrapers(unittest.TestCase):
     
     
     
+    def testParseItemprop(self):
+        '''Test for pre-parsing microdata itemprop paths'''
+        
+        self.assertEqual(compile_microdata('/properties/offers/0/properties/price/0'), ('properties', 'offers', 0, 'properties', 'price', 0))
+        
+        self.assertEqual(compile_microdata('properties//name/'), ('properties', 'name'))
+        
+        self.assertEqual(compile_microdata(''), ())
+        
+        self.assertRaises(AttributeError, compile_microdata, 123)
+    
+    
+    
     def testMicrodataScraper(self):
         '''Test for microdata_scraper module
         
@@ -154,5 +190,176 @@ class TestScrapers(unittest.TestCase):
 
 
 
+
+class TestConcurrentScraping(unittest.TestCase):
+    '''Scrapers should be safe to run from many threads at once'''
+    
+    page = '''<html><head>
+        <meta property="og:title" content="Product %(id)d" />
+        <meta property="og:image" content="http://example.com/%(id)d.jpg" />
+    </head><body><h1>Product %(id)d</h1></body></html>'''
+    
+    def resource(self, id):
+        resource = Resource('http://example.com/p/%d' % id)
+        resource.response = MagicMock(text=self.page % {'id': id})
+        return resource
+    
+    def testOpenGraphAttribution(self):
+        '''Each Resource's tags should be attributed to that Resource only'''
+        
+        resources = [self.resource(id) for id in xrange(500)]
+        
+        def scrape(resource):
+            return opengraph(resource, 'title'), opengraph(resource, 'image'), xpath(resource, '//h1//text()')
+        
+        results = list(imap_unordered(scrape, resources, workers=16))
+        self.assertEqual(len(results), len(resources))
+        for resource, result, error in results:
+            self.assertIsNone(error)
+            id = int(resource.url.rsplit('/', 1)[1])
+            self.assertEqual(result, (
+                'Product %d' % id,
+                'http://example.com/%d.jpg' % id,
+                'Product %d' % id,
+            ))
+    
+    def testCompiledXPath(self):
+        '''Identical expressions of a platform should be compiled & evaluated once per page'''
+        
+        extractor = Extractor(StringIO(dedent("""
+            [itunes]
+            url.path       = /album/.*
+            url.domains    = itunes.apple.com
+            name           = xpath.//h1//text()
+            price          = xpath.//span[@class="price"]//text()
+            price.filter   = regex.(\d+(\.\d+)?)
+            currency       = xpath.//span[@class="price"]//text()
+            currency.filter= regex.^(\D+)
+        """)))
+        plans = dict((plan.attribute, plan) for plan in extractor.plans['itunes'])
+        self.assertIs(plans['price'].steps[0][1], plans['currency'].steps[0][1])
+        self.assertEqual(plans['price'].steps[0][1].path, '//span[@class="price"]//text()')
+        
+        resource = Resource('https://itunes.apple.com/album/hits/id1')
+        resource.response = MagicMock(text='<html><h1>Hits</h1><span class="price">$9.99</span></html>')
+        product = extractor.extract(resource)
+        self.assertEqual((product['name'], product['price'], product['currency']), ('Hits', '9.99', '$'))
+        self.assertEqual(sorted(resource.document.xpath_results), ['//h1//text()', '//span[@class="price"]//text()'])
+        
+        # Invalid expressions are bound as-is, and scrape None
+        self.assertRaises(lxml.etree.XPathSyntaxError, compile_xpath, '//h1[')
+        self.assertIsNone(xpath(resource, '//h1['))
+    
+    def testSharedResource(self):
+        '''Threads sharing a Resource should share a single parse'''
+        
+        resource = self.resource(1)
+        results = imap_unordered(lambda tag: opengraph(resource, tag), ['title', 'image'] * 50, workers=16)
+        for tag, result, error in results:
+            self.assertEqual(result, tag == 'title' and 'Product 1' or 'http://example.com/1.jpg')
+        self.assertEqual(resource.document.parse_count, 1)
+
+
+
+class StandInAPI(object):
+    """Stands in for the Product Advertising API, recording its calls"""
+    
+    def __init__(self, region):
+        self.region = region
+        self.batches = []
+        self.lock = threading.Lock()
+    
+    def lookup(self, asins):
+        with self.lock:
+            self.batches.append(list(asins))
+        if 'B000BROKEN' in asins:
+            raise IOError('ItemLookup failed')
+        return dict(
+            (asin, MagicMock(asin=asin, title='Item ' + asin, price_and_currency=(9.99, 'USD')))
+            for asin in asins if asin != 'B000MISSED'
+        )
+
+
+
+class TestAmazonAPI(unittest.TestCase):
+    '''The amazon_api scraper should batch & memoize its lookups'''
+    
+    config = dedent("""
+        [amazon.com]
+        url.path       = /dp/.*
+        url.domains    = amazon.com
+        url.canonical  = (/dp/\w{10})
+        name           = amazon_api.title
+        price          = amazon_api.price_and_currency
+        price.filter   = tuple.0
+        currency       = amazon_api.price_and_currency
+        currency.filter= tuple.1
+    """)
+    
+    def setUp(self):
+        use_api(StandInAPI, window=0.2)
+    
+    def tearDown(self):
+        use_api(ProductAPI)
+    
+    def testGetASIN(self):
+        self.assertEqual(get_asin('http://www.amazon.com/Harry-Potter/dp/059035342X/ref=sr_1_1?s=books'), ('059035342X', 'US'))
+        self.assertEqual(get_asin('http://www.amazon.co.uk/gp/product/b00b7x2ov2'), ('B00B7X2OV2', 'UK'))
+        self.assertEqual(get_asin('http://www.junglee.com/dp/B008P8ELAE?tag=x'), ('B008P8ELAE', 'US'))
+        self.assertIsNone(get_asin('ayush/dp/ayush'))
+        self.assertIsNone(get_asin('http://www.amazon.com/s/?field-keywords=dp'))
+        self.assertIsNone(get_asin(1234))
+    
+    def testOneLookupPerProduct(self):
+        '''All the attributes of a product should be served by a single lookup, without fetching the page'''
+        
+        extractor = Extractor(StringIO(self.config))
+        with patch('shoplift.web.scheduler') as scheduler:
+            product = extractor.extract('http://www.amazon.com/Harry-Potter/dp/059035342X/ref=sr_1_1')
+            self.assertFalse(scheduler.fetch.called)
+        
+        self.assertEqual(product, {
+            'url': 'http://www.amazon.com/dp/059035342X', 'name': 'Item 059035342X', 'price': 9.99, 'currency': 'USD',
+        })
+        self.assertEqual(get_lookup('US').api.batches, [['059035342X']])
+        self.assertEqual(amazon_api('http://www.amazon.com/dp/059035342X', 'title'), 'Item 059035342X')
+        self.assertEqual(get_lookup('US').calls, 1)
+    
+    def testBatching(self):
+        '''Concurrent extractions should share lookups of up to 10 ASINs'''
+        
+        extractor = Extractor(StringIO(self.config))
+        urls = ['http://www.amazon.com/dp/B%09d' % i for i in xrange(25)]
+        results = dict(extractor.extract_many(urls, workers=25))
+        
+        for url in urls:
+            self.assertEqual(results[url]['name'], 'Item ' + url[-10:])
+        batches = get_lookup('US').api.batches
+        self.assertEqual(sorted(sum(batches, [])), sorted(url[-10:] for url in urls))
+        self.assertLessEqual(max(map(len, batches)), 10)
+        self.assertLess(len(batches), 10)
+    
+    def testErrors(self):
+        '''Products not found should scrape None, and failed lookups raise for their whole batch'''
+        
+        lookup = BatchLookup(StandInAPI('US'), size=3, window=0.2)
+        self.assertIsNone(lookup.get('B000MISSED'))
+        
+        asins = ['B000000001', 'B000BROKEN', 'B000000002']
+        results = list(imap_unordered(lookup.get, asins, workers=3))
+        self.assertEqual(lookup.api.batches[1:], [asins])
+        for asin, product, error in results:
+            self.assertIsInstance(error, IOError)
+        
+        # Failed lookups aren't memoized
+        self.assertEqual(lookup.get('B000000001').title, 'Item B000000001')
+        self.assertEqual(lookup.calls, 3)
+        
+        self.assertIsNone(amazon_api('http://www.amazon.com/dp/B000MISSED', 'title'))
+        self.assertIsNone(amazon_api('http://www.amazon.com/dp/059035342X', '__class__'))
+        self.assertIsNone(amazon_api('http://www.flipkart.com/shirt/p/itmdtsh62kgrczfw', 'title'))
+
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -7,10 +7,20 @@ Tests the class for the intermediate interface
 to access web pages.
 '''
 
+import re
 import unittest
 import time
+from textwrap import dedent
 
-from shoplift.web import Resource, sanitize_url
+from mock import MagicMock, patch
+
+import requests
+import lxml.etree
+from io import BytesIO
+
+from shoplift.web import Resource, AsyncResource, Document, sanitize_url, canonical_url, reduce_url, read_body, MAX_BODY_BYTES
+from shoplift.pool import Future
+from shoplift.scrapers import xpath
 
 
 
@@ -85,6 +95,37 @@ class SanitizeURL(unittest.TestCase):
         )
         for testcase, expected_result in testcases:
             self.assertEqual(sanitize_url(testcase), expected_result)
+    
+    def testFragmentAndQuery(self):
+        """sanitize_url should drop the fragment and sort the query params"""
+        testcases = (
+            ('http://example.com/p/1#reviews', 'http://example.com/p/1'),
+            ('http://example.com/p/1?b=2&a=1', 'http://example.com/p/1?a=1&b=2'),
+            ('http://example.com/p/1?b=2&&a=1#top', 'http://example.com/p/1?a=1&b=2'),
+            ('http://example.com/p/1?a=1&b=2', 'http://example.com/p/1?a=1&b=2'),
+        )
+        for testcase, expected_result in testcases:
+            self.assertEqual(sanitize_url(testcase), expected_result)
+    
+    def testMemoized(self):
+        """sanitize_url should only sanitize a URL once"""
+        with patch('shoplift.web._sanitize_url', return_value='http://example.com') as sanitize:
+            sanitize_url('  http://Example.com/memoized')
+            sanitize_url('  http://Example.com/memoized')
+            self.assertEqual(sanitize.call_count, 1)
+    
+    def testCanonicalURL(self):
+        """canonical_url should drop tracking params, and reduce_url keep the product"""
+        self.assertEqual(
+            canonical_url('http://example.com/p/1?affid=x&pid=1&utm_source=mail', re.compile('(?:affid|srno)$')),
+            'http://example.com/p/1?pid=1'
+        )
+        self.assertEqual(canonical_url('http://example.com/p/1?utm_medium=x'), 'http://example.com/p/1')
+        self.assertEqual(
+            reduce_url('http://amazon.in/Kindle/dp/B00KDRTG8M/ref=sr_1?tag=x', re.compile(r'(/dp/\w+)')),
+            'http://amazon.in/dp/B00KDRTG8M'
+        )
+        self.assertIsNone(reduce_url('http://amazon.in/gp/help', re.compile(r'(/dp/\w+)')))
 
 
 
@@ -160,6 +201,264 @@ class GetPropertyPersistence(object):
             self.assertEqual(first_result, second_result)
     
 
+class DocumentMemoization(unittest.TestCase):
+    """Resource.document should parse the contents only once per representation"""
+    
+    html = dedent("""
+        <html>
+        <head>
+            <meta property="og:title" content="The Hobbit" />
+            <meta property="og:image" content="http://example.com/hobbit.jpg" />
+        </head>
+        <body itemscope itemtype="http://schema.org/Product">
+            <h1 itemprop="name">The Hobbit</h1>
+            <span class="price">Rs. 250</span>
+        </body>
+        </html>
+    """)
+    
+    def setUp(self):
+        self.resource = Resource('http://example.com/the-hobbit')
+        self.resource.response = MagicMock(text=self.html)
+    
+    def testSharedDocument(self):
+        """Resource.document should return the same Document every time"""
+        document = self.resource.document
+        self.assertIsInstance(document, Document)
+        self.assertIs(self.resource.document, document)
+    
+    def testSingleParse(self):
+        """Each representation should be parsed once, however often it is accessed"""
+        document = self.resource.document
+        for x in xrange(5):
+            self.assertIs(document.tree, document.tree)
+            self.assertEqual(document.opengraph['title'], 'The Hobbit')
+            self.assertEqual(document.microdata[0]['properties']['name'], ['The Hobbit'])
+        # OpenGraph tags & microdata items are read off the lxml tree
+        self.assertEqual(document.parse_count, 1)
+    
+    def testXPathResults(self):
+        """Each XPath expression should be evaluated once, compiled or not"""
+        document = self.resource.document
+        results = document.xpath('//span[@class="price"]//text()')
+        self.assertEqual(results, ['Rs. 250'])
+        self.assertIs(type(results[0]), str)
+        self.assertEqual(document.xpath(lxml.etree.XPath('//span[@class="price"]//text()')), results)
+        
+        # Callers get lists of their own
+        results.append('Rs. 300')
+        self.assertEqual(document.xpath('//span[@class="price"]//text()'), ['Rs. 250'])
+        self.assertEqual(document.xpath(lxml.etree.XPath('//h1/@itemprop')), ['name'])
+        self.assertEqual(len(document.xpath_results), 2)
+    
+    def testResetOnURLChange(self):
+        """Changing the URL or response should discard the parsed document"""
+        document = self.resource.document
+        self.resource.response = MagicMock(text='<html><body></body></html>')
+        self.assertIsNot(self.resource.document, document)
+        document = self.resource.document
+        self.resource.url = 'http://example.com/another'
+        self.assertFalse(hasattr(self.resource, '_document'))
+    
+    def testSharedResponse(self):
+        """Resources of the same response should share its Document"""
+        resource = Resource('http://example.com/the-hobbit')
+        resource.response = self.resource.response
+        self.assertIs(resource.document, self.resource.document)
+        resource.document.tree
+        self.assertEqual(self.resource.document.parse_count, 1)
+    
+    def testContentsDropped(self):
+        """The decoded contents should be dropped once parsed"""
+        document = self.resource.document
+        document.tree
+        self.assertIsNone(document.contents)
+        self.assertEqual(document.opengraph['title'], 'The Hobbit')
+
+
+
+class ReleasingResources(unittest.TestCase):
+    """Resources should drop their page once released"""
+    
+    def testRelease(self):
+        """release should drop the response & document, and refetch if needed"""
+        with patch('shoplift.web.scheduler') as scheduler:
+            response = MagicMock(text='<html><h1>One</h1></html>')
+            scheduler.fetch.return_value.result.side_effect = [response, response, MagicMock(text='<html></html>')]
+            shared = Resource('http://example.com/p/1')
+            with Resource('http://example.com/p/1') as resource:
+                document = resource.document
+                self.assertIs(response.document, document)
+            
+            self.assertFalse(hasattr(resource, '_response') or hasattr(resource, '_document'))
+            
+            # Resources sharing the response keep its parse
+            self.assertIs(shared.document, document)
+            self.assertIsNot(resource.document, document)
+            self.assertEqual(scheduler.fetch.call_count, 3)
+    
+    def testSlots(self):
+        """Resources should not carry an attribute dict"""
+        self.assertRaises(AttributeError, setattr, Resource('http://example.com'), 'cached', True)
+        self.assertFalse(hasattr(Resource('http://example.com'), '__dict__'))
+    
+    def testAsyncRelease(self):
+        """AsyncResource should drop the Future holding its response too"""
+        with patch('shoplift.web.scheduler') as scheduler:
+            resource = AsyncResource('http://example.com/p/1')
+            resource.release()
+            self.assertFalse(hasattr(resource, '_future'))
+            resource.release()
+    
+    def testPlainStrings(self):
+        """Scraped strings should not keep the parsed tree alive"""
+        resource = Resource('http://example.com/p/1')
+        resource.response = MagicMock(text='<html><h1>One</h1></html>')
+        name = xpath(resource, '//h1/text()')
+        self.assertEqual(name, 'One')
+        self.assertFalse(hasattr(name, 'getparent'))
+
+
+
+class AsyncResourceFetching(unittest.TestCase):
+    """AsyncResource should fetch through the scheduler in the background"""
+    
+    def setUp(self):
+        self.futures = {}
+        self.scheduler = MagicMock()
+        self.scheduler.fetch.side_effect = lambda url, timeout, **options: self.futures.setdefault(url, Future())
+    
+    def testBackgroundFetch(self):
+        """The fetch should start on creation, and complete the future"""
+        with patch('shoplift.web.scheduler', self.scheduler):
+            resource = AsyncResource('http://example.com/p/1', timeout=5, head_only=True)
+            self.scheduler.fetch.assert_called_once_with('http://example.com/p/1', 5, max_bytes=MAX_BODY_BYTES, head_only=True)
+            self.assertFalse(resource.future.done())
+            
+            self.futures['http://example.com/p/1'].set_result(MagicMock(text='<html><head><meta property="og:title" content="One" /></head></html>'))
+            self.assertTrue(resource.future.done())
+            self.assertEqual(resource.document.opengraph['title'], 'One')
+            self.assertEqual(self.scheduler.fetch.call_count, 1)
+    
+    def testURLChange(self):
+        """Changing the URL should start a new fetch"""
+        with patch('shoplift.web.scheduler', self.scheduler):
+            resource = AsyncResource('http://example.com/p/1')
+            resource.url = 'http://example.com/p/2'
+            self.assertIs(resource.future, self.futures['http://example.com/p/2'])
+    
+    def testFetchError(self):
+        """Fetch errors should be raised when the response is accessed"""
+        with patch('shoplift.web.scheduler', self.scheduler):
+            resource = AsyncResource('http://example.com/p/1')
+            self.futures['http://example.com/p/1'].set_exception(IOError('unreachable'))
+            self.assertRaises(IOError, resource.get_contents)
+
+
+
+class StreamingDownload(unittest.TestCase):
+    """read_body should stop reading a page as soon as it can"""
+    
+    page = '<html><head><meta property="og:title" content="One" /></head><body>%s</body></html>' % ('x' * 100000)
+    
+    def response(self):
+        response = requests.Response()
+        response.raw = BytesIO(self.page)
+        return response
+    
+    def testFullBody(self):
+        """Bodies under the cap should be read whole"""
+        response = read_body(self.response(), max_bytes=len(self.page))
+        self.assertEqual(response.content, self.page)
+        self.assertFalse(response.truncated)
+        self.assertFalse(response.raw.closed)
+    
+    def testMaxBytes(self):
+        """Bodies over the cap should be truncated, and the connection dropped"""
+        response = read_body(self.response(), max_bytes=1000)
+        self.assertEqual(response.content, self.page[:1000])
+        self.assertTrue(response.truncated)
+        self.assertTrue(response.raw.closed)
+    
+    def testHeadOnly(self):
+        """Reading should stop at the end of the <head>"""
+        response = read_body(self.response(), head_only=True)
+        self.assertTrue(response.truncated)
+        self.assertLess(len(response.content), len(self.page))
+        self.assertIn('</head>', response.content)
+        self.assertEqual(Document(response.content).opengraph, {'title': 'One'})
+    
+    def testHeadEndAcrossChunks(self):
+        """The end of the <head> should be found when split across chunks"""
+        padding = 'x' * (16 * 1024 - len('<html><head></he'))
+        self.page = '<html><head>%s</he' % padding + 'ad>' + '<p>y</p>' * 10000
+        response = read_body(self.response(), head_only=True)
+        self.assertTrue(response.truncated)
+        self.assertLess(len(response.content), len(self.page))
+
+
+
+class Revalidation(unittest.TestCase):
+    """Resources created with validators should revalidate their page"""
+    
+    validators = {'etag': '"v1"', 'last_modified': 'Sat, 01 Mar 2014 10:00:00 GMT'}
+    
+    def response(self, status_code=200, **headers):
+        response = requests.Response()
+        response.status_code = status_code
+        response.headers.update(headers)
+        return response
+    
+    @patch('shoplift.web.scheduler')
+    def testConditionalHeaders(self, scheduler):
+        """The validators should be sent, asking caches to revalidate"""
+        scheduler.fetch.return_value.result.return_value = self.response(304)
+        resource = Resource('http://example.com', validators=self.validators)
+        self.assertTrue(resource.unchanged)
+        scheduler.fetch.assert_called_once_with('http://example.com', max_bytes=MAX_BODY_BYTES, head_only=False, headers={
+            'Cache-Control': 'max-age=0',
+            'If-None-Match': '"v1"',
+            'If-Modified-Since': 'Sat, 01 Mar 2014 10:00:00 GMT',
+        })
+        # 304 responses are falsy, but should not be fetched again
+        resource.response
+        self.assertEqual(scheduler.fetch.call_count, 1)
+    
+    @patch('shoplift.web.scheduler')
+    def testChanged(self, scheduler):
+        """Pages with new validators should be changed"""
+        scheduler.fetch.return_value.result.return_value = self.response(ETag='"v2"')
+        resource = Resource('http://example.com', validators={'etag': '"v1"'})
+        self.assertFalse(resource.unchanged)
+        self.assertEqual(resource.validators, {'etag': '"v2"'})
+        
+        # As served by the HTTP cache once revalidated
+        scheduler.fetch.return_value.result.return_value = self.response(ETag='"v1"')
+        self.assertTrue(Resource('http://example.com', validators={'etag': '"v1"'}).unchanged)
+    
+    @patch('shoplift.web.scheduler')
+    def testChangedETag(self, scheduler):
+        """A new ETag should make the page changed, whatever its Last-Modified"""
+        scheduler.fetch.return_value.result.return_value = self.response(
+            ETag='"v2"', **{'Last-Modified': self.validators['last_modified']}
+        )
+        self.assertFalse(Resource('http://example.com', validators=self.validators).unchanged)
+        
+        # Without ETags, every shared validator must match
+        scheduler.fetch.return_value.result.return_value = self.response(**{'Last-Modified': self.validators['last_modified']})
+        self.assertTrue(Resource('http://example.com', validators={'last_modified': self.validators['last_modified']}).unchanged)
+        self.assertFalse(Resource('http://example.com', validators={'last_modified': 'Sun, 02 Mar 2014 10:00:00 GMT'}).unchanged)
+    
+    @patch('shoplift.web.scheduler')
+    def testNoValidators(self, scheduler):
+        """Resources without validators should never be unchanged"""
+        scheduler.fetch.return_value.result.return_value = self.response(304)
+        resource = Resource('http://example.com')
+        self.assertFalse(resource.unchanged)
+        self.assertNotIn('headers', resource.fetch_options)
+
+
+
 class GetURLPersistence(unittest.TestCase, GetPropertyPersistence):
     method = 'url'
 